@@ -27,15 +27,24 @@ const ClothingItem = ({ item, onDelete }) => {
     }
   };
 
-  // Get the image URL from the original_image_url field
-  const imageUrl = item.original_image_url || '';
+  // Prefer the WebP thumbnails over the full-size photo for the grid tile.
+  // Sizes not generated yet are the photo itself, so leave them out of srcSet.
+  const thumbnails = item.thumbnails?.original || {};
+  const imageUrl = thumbnails['256'] || item.original_image_url || '';
+  const imageSrcSet = Object.entries(thumbnails)
+    .filter(([, url]) => url !== item.original_image_url)
+    .map(([size, url]) => `${url} ${size}w`)
+    .join(', ');
 
   return (
     <div className="bg-white dark:bg-gray-800 rounded-lg shadow overflow-hidden group">
       <div className="relative">
         <img
           src={imageUrl}
+          srcSet={imageSrcSet || undefined}
+          sizes="(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw"
           alt={item.name}
+          loading="lazy"
           className="w-full h-48 object-cover"
         />
         <div className="absolute inset-0 bg-black bg-opacity-0 group-hover:bg-opacity-30 transition-opacity duration-200 flex items-center justify-center opacity-0 group-hover:opacity-100">
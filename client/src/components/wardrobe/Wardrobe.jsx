@@ -35,14 +35,29 @@ const Wardrobe = () => {
       const tokens = getAuthTokens();
       console.log('Fetching clothes with token:', tokens.access);
       
-      const response = await api.get('/wardrobe/clothing-items/', {
-        headers: {
-          'Authorization': `Bearer ${tokens.access}`,
-        },
-      });
+      // Only the fields the grid shows; the list is paginated with cursors.
+      // Unchanged pages are revalidated with their ETag and answered with 304.
+      const items = [];
+      let url = '/wardrobe/clothing-items/';
+      let params = {
+        fields: 'id,name,category,category_display,original_image_url,thumbnails,metadata',
+        page_size: 100,
+      };
+      while (url) {
+        const response = await api.get(url, {
+          params,
+          headers: {
+            'Authorization': `Bearer ${tokens.access}`,
+          },
+        });
+        items.push(...response.data.results);
+        // The next link already carries the cursor and the other parameters
+        url = response.data.next;
+        params = undefined;
+      }
       
-      console.log('Clothes response:', response.data);
-      setClothes(response.data);
+      console.log('Clothes response:', items);
+      setClothes(items);
     } catch (error) {
       console.error('Error fetching clothes:', error);
       setError('Failed to load wardrobe items');
@@ -122,72 +137,11 @@ const Wardrobe = () => {
       
       const tokens = getAuthTokens();
       
-      // First, process the image with the clothing processor
+      // Process the image and create the clothing item on the server in one request
       const formData = new FormData();
       formData.append('image', image);
       
-      const processResponse = await api.post('/clothing-processor/process/', formData, {
-        headers: {
-          'Authorization': `Bearer ${tokens.access}`,
-          'Content-Type': 'multipart/form-data',
-        },
-      });
-      
-      console.log('Processing response:', processResponse.data);
-      
-      // Check if the model successfully classified the clothing
-      if (!processResponse.data.category || processResponse.data.category === 'unknown') {
-        throw new Error('Could not identify the clothing item. Please try a clearer image.');
-      }
-      
-      // Map the category to match the model's choices
-      const categoryMap = {
-        'upper clothing': 'upper',
-        'lower clothing': 'lower',
-        'dress': 'dress',
-        'outerwear': 'outerwear',
-        'shoes': 'shoes',
-        'accessories': 'accessories'
-      };
-      
-      const mappedCategory = categoryMap[processResponse.data.category.toLowerCase()] || 'upper';
-      console.log('Mapped category:', mappedCategory);
-      
-      // Now create the clothing item with the processed data
-      const clothingFormData = new FormData();
-      clothingFormData.append('original_image', image);
-      clothingFormData.append('name', processResponse.data.metadata.description || 'New Clothing Item');
-      clothingFormData.append('category', mappedCategory);
-      
-      // Ensure metadata has the required fields
-      const metadata = {
-        colors: processResponse.data.metadata.colors || ['#000000'],
-        description: processResponse.data.metadata.description || 'A clothing item'
-      };
-      
-      clothingFormData.append('metadata', JSON.stringify(metadata));
-      
-      // If there's a segmented image, add it to the form data
-      if (processResponse.data.segmented_image_url) {
-        // Extract the filename from the path
-        const segmentedImagePath = processResponse.data.segmented_image_url;
-        const segmentedImageName = segmentedImagePath.split('\\').pop();
-        
-        // Create a file object from the segmented image
-        const segmentedImageResponse = await fetch(`/media/processed_clothes/${segmentedImageName}`);
-        const segmentedImageBlob = await segmentedImageResponse.blob();
-        const segmentedImageFile = new File([segmentedImageBlob], segmentedImageName, { type: 'image/jpeg' });
-        
-        clothingFormData.append('segmented_image', segmentedImageFile);
-      }
-      
-      console.log('Sending clothing data:', {
-        name: clothingFormData.get('name'),
-        category: clothingFormData.get('category'),
-        metadata: clothingFormData.get('metadata')
-      });
-      
-      const createResponse = await api.post('/wardrobe/clothing-items/', clothingFormData, {
+      const createResponse = await api.post('/wardrobe/clothing-items/process/', formData, {
         headers: {
           'Authorization': `Bearer ${tokens.access}`,
           'Content-Type': 'multipart/form-data',
@@ -43,8 +43,14 @@ export const isAuthenticated = () => {
   return !!tokens && !!tokens.access;
 };
 
-// Function to logout (clear tokens and user data)
+// Function to logout (revoke the tokens on the server, clear tokens and user data)
 export const logout = () => {
+  const tokens = getAuthTokens();
+  if (tokens && tokens.refresh) {
+    axios.post('/users/logout/', { refresh: tokens.refresh }).catch((error) => {
+      console.error('Error revoking tokens:', error);
+    });
+  }
   localStorage.removeItem(TOKEN_KEY);
   localStorage.removeItem(USER_KEY);
   delete axios.defaults.headers.common['Authorization'];
@@ -63,10 +69,11 @@ export const refreshToken = async () => {
     });
 
     if (response.data && response.data.access) {
-      // Update the access token
+      // Update the access token, and the refresh token when the server rotated it
       const newTokens = {
         ...tokens,
-        access: response.data.access
+        access: response.data.access,
+        refresh: response.data.refresh || tokens.refresh
       };
       setAuthTokens(newTokens);
       return newTokens;
@@ -0,0 +1,262 @@
+import math
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Least
+from rest_framework import status
+from rest_framework.response import Response
+from main.metrics import metrics
+from .models import RateLimitBucket
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_QUEUE = metrics.gauge(
+    'clothing_admission_requests',
+    'Processing requests running or waiting for a pipeline slot',
+    ['state'],
+)
+ADMISSION_REJECTIONS = metrics.counter(
+    'clothing_admission_rejections_total',
+    'Processing requests turned away by reason (rate_limited, queue_full, queue_timeout)',
+    ['reason'],
+)
+ADMISSION_WAIT_SECONDS = metrics.histogram(
+    'clothing_admission_wait_seconds',
+    'Time admitted requests waited for a pipeline slot',
+)
+
+
+class AdmissionRejected(Exception):
+    """A processing request was turned away; carries the HTTP status and Retry-After seconds."""
+
+    def __init__(self, reason, status_code, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBuckets:
+    """Per-user token buckets refilled at rate tokens per second, holding at most burst."""
+
+    def __init__(self, rate, burst, max_users=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key):
+        """
+        Take one token from key's bucket.
+
+        Returns:
+            float: 0 if a token was taken, else the seconds until one is available
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+            if wait == 0.0:
+                tokens -= 1
+            # Re-inserted so the dict stays ordered by last use
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_users:
+                self._buckets.pop(next(iter(self._buckets)))
+        return wait
+
+    def refund(self, key):
+        """Give back a token taken for a request that was then turned away."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(self.burst, tokens + 1), updated)
+
+
+class SharedTokenBuckets(TokenBuckets):
+    """
+    Token buckets kept in the RateLimitBucket table, so a user's rate holds
+    across every worker process. A take locks the user's row for the
+    duration of one small transaction.
+    """
+
+    def take(self, key):
+        if self.rate <= 0:
+            return 0.0
+        with transaction.atomic():
+            bucket, _ = RateLimitBucket.objects.select_for_update().get_or_create(
+                key=str(key), defaults={'tokens': self.burst, 'updated_at': time.time()})
+            now = time.time()
+            tokens = min(self.burst, bucket.tokens + max(0.0, now - bucket.updated_at) * self.rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+            if wait == 0.0:
+                tokens -= 1
+            RateLimitBucket.objects.filter(pk=bucket.pk).update(tokens=tokens, updated_at=now)
+        return wait
+
+    def refund(self, key):
+        if self.rate <= 0:
+            return
+        RateLimitBucket.objects.filter(key=str(key)).update(tokens=Least(F('tokens') + 1, Value(float(self.burst))))
+
+
+class AdmissionController:
+    """
+    Bounded concurrency in front of the clothing pipeline.
+
+    At most max_concurrent requests run the pipeline at once; up to
+    max_queue more wait, first come first served, for at most
+    queue_timeout seconds. Anything beyond that fails fast instead of
+    slowing every request down: 503 when the queue is full or the wait
+    ran out, 429 when the user's token bucket is empty. Retry-After is
+    estimated from the recent pipeline time.
+
+    The slots and the queue are per process, since each worker runs its
+    own copy of the models; they only fill up under a threaded server (see
+    gunicorn.conf.py). The user buckets are whatever buckets is given,
+    SharedTokenBuckets when built from settings.
+    """
+
+    def __init__(self, max_concurrent, max_queue, queue_timeout, user_rate=0.0, user_burst=1, buckets=None):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.buckets = buckets or TokenBuckets(user_rate, user_burst)
+        self._condition = threading.Condition()
+        self._active = 0
+        self._waiting = deque()
+        # Moving average of the pipeline time, for Retry-After
+        self._service_seconds = 1.0
+
+    @classmethod
+    def from_settings(cls):
+        options = settings.CLOTHING_PROCESSOR_ADMISSION
+        buckets = SharedTokenBuckets(options['USER_RATE_PER_MINUTE'] / 60.0, options['USER_BURST'])
+        return cls(options['MAX_CONCURRENT'], options['MAX_QUEUE'], options['QUEUE_TIMEOUT'], buckets=buckets)
+
+    def _snapshot(self):
+        return self._active, len(self._waiting)
+
+    def _publish(self, running, waiting):
+        # Recording writes the metrics file, so it is never done under the condition
+        ADMISSION_QUEUE.set(running, state='running')
+        ADMISSION_QUEUE.set(waiting, state='waiting')
+
+    def _reject(self, reason, status_code, retry_after):
+        ADMISSION_REJECTIONS.inc(reason=reason)
+        logger.warning(f"Rejected processing request: {reason} (retry after {retry_after:.1f}s)")
+        raise AdmissionRejected(reason, status_code, retry_after)
+
+    def _queue_retry_after(self):
+        return self._service_seconds * (len(self._waiting) + 1) / self.max_concurrent
+
+    def _acquire(self, start_time):
+        """
+        Take a pipeline slot, waiting in line when none is free.
+
+        Returns:
+            tuple: None once a slot is held, else (reason, retry_after)
+        """
+        with self._condition:
+            ticket = None
+            if self._active < self.max_concurrent and not self._waiting:
+                self._active += 1
+            elif len(self._waiting) >= self.max_queue:
+                return 'queue_full', self._queue_retry_after()
+            else:
+                ticket = object()
+                self._waiting.append(ticket)
+            snapshot = self._snapshot()
+        self._publish(*snapshot)
+        if ticket is None:
+            return None
+
+        rejection = None
+        deadline = start_time + self.queue_timeout
+        with self._condition:
+            try:
+                while self._active >= self.max_concurrent or self._waiting[0] is not ticket:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        rejection = ('queue_timeout', self._queue_retry_after())
+                        break
+                    self._condition.wait(remaining)
+                else:
+                    self._active += 1
+            finally:
+                self._waiting.remove(ticket)
+                # The next ticket may be admissible now
+                self._condition.notify_all()
+            snapshot = self._snapshot()
+        self._publish(*snapshot)
+        return rejection
+
+    @contextmanager
+    def admit(self, user_key):
+        """
+        Hold a pipeline slot for the duration of the with block.
+
+        Raises:
+            AdmissionRejected: If the request is rate limited or cannot get
+                a slot in time
+        """
+        wait = self.buckets.take(user_key)
+        if wait > 0:
+            self._reject('rate_limited', status.HTTP_429_TOO_MANY_REQUESTS, wait)
+
+        start_time = time.monotonic()
+        rejection = self._acquire(start_time)
+        if rejection is not None:
+            # Shed requests never ran, so they do not count against the user
+            self.buckets.refund(user_key)
+            self._reject(rejection[0], status.HTTP_503_SERVICE_UNAVAILABLE, rejection[1])
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - start_time)
+
+        run_start = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._active -= 1
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * (time.monotonic() - run_start)
+                self._condition.notify_all()
+                snapshot = self._snapshot()
+            self._publish(*snapshot)
+
+    def status(self):
+        with self._condition:
+            return {'running': self._active, 'waiting': len(self._waiting),
+                    'max_concurrent': self.max_concurrent, 'max_queue': self.max_queue}
+
+
+def rejected_response(exc):
+    """The 429/503 response for an AdmissionRejected, with Retry-After."""
+    if exc.reason == 'rate_limited':
+        message = 'Too many images processed. Please wait before uploading more.'
+    else:
+        message = 'The clothing processor is busy. Please try again shortly.'
+    return Response({'error': message}, status=exc.status_code, headers={'Retry-After': str(exc.retry_after)})
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def admission():
+    """The process-wide AdmissionController, created from settings on first use."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController.from_settings()
+    return _controller
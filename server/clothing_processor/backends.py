@@ -0,0 +1,397 @@
+import os
+import json
+import time
+import logging
+import threading
+import traceback
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from ultralytics import YOLO
+from transformers import YolosConfig, YolosForObjectDetection, YolosImageProcessor
+from transformers.models.yolos.modeling_yolos import YolosObjectDetectionOutput
+from PIL import Image
+
+try:
+    from .clothing_segmentation import YOLOS_MODEL_NAME
+except ImportError:
+    from clothing_segmentation import YOLOS_MODEL_NAME
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('eager', 'onnx', 'torchscript')
+MANIFEST_FILENAME = 'manifest.json'
+YOLOS_CONFIG_DIR = 'yolos_config'
+
+
+def variant_name(fmt, quantized=False):
+    """Name of an exported variant, e.g. 'onnx' or 'onnx-int8'."""
+    return f"{fmt}-int8" if quantized and fmt != 'eager' else fmt
+
+
+def _source_stat(model_path):
+    stat = os.stat(model_path)
+    return {'source_size': stat.st_size, 'source_mtime': int(stat.st_mtime)}
+
+
+def read_manifest(export_dir):
+    try:
+        with open(os.path.join(export_dir, MANIFEST_FILENAME), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(export_dir, manifest):
+    path = os.path.join(export_dir, MANIFEST_FILENAME)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def _quantize_onnx(source_path, target_path):
+    """Dynamic int8 quantization of an ONNX graph (weights int8, activations quantized at run time)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(source_path, target_path, weight_type=QuantType.QInt8)
+    return target_path
+
+
+def export_segmentation(model_path, export_dir, fmt, quantize=False, imgsz=640):
+    """
+    Export the YOLOv8 segmentation model with ultralytics.
+
+    ONNX graphs are exported with a dynamic batch axis so the batched stage
+    keeps working. int8 is only applied to ONNX: dynamic quantization in
+    PyTorch targets Linear/LSTM layers and leaves a conv net unchanged.
+
+    Returns:
+        str: Filename of the artifact inside export_dir
+    """
+    if quantize and fmt == 'torchscript':
+        logger.warning("int8 quantization is not applied to the TorchScript YOLOv8 export (conv layers only)")
+
+    exported_path = YOLO(model_path).export(format=fmt, imgsz=imgsz, dynamic=(fmt == 'onnx'))
+    extension = '.onnx' if fmt == 'onnx' else '.torchscript'
+    artifact = f"segmentation{extension}"
+    os.replace(exported_path, os.path.join(export_dir, artifact))
+
+    if quantize and fmt == 'onnx':
+        quantized = f"segmentation.int8{extension}"
+        _quantize_onnx(os.path.join(export_dir, artifact), os.path.join(export_dir, quantized))
+        artifact = quantized
+    logger.info(f"Exported YOLOv8 segmentation model to {artifact}")
+    return artifact
+
+
+def export_yolos(export_dir, fmt, quantize=False, image_size=800):
+    """
+    Export the YOLOS detector traced at a fixed square input of image_size.
+
+    Returns:
+        str: Filename of the artifact inside export_dir
+    """
+    model = YolosForObjectDetection.from_pretrained(YOLOS_MODEL_NAME, torchscript=True)
+    model.eval()
+    model.config.save_pretrained(os.path.join(export_dir, YOLOS_CONFIG_DIR))
+    dummy = torch.zeros((1, 3, image_size, image_size), dtype=torch.float32)
+
+    if fmt == 'onnx':
+        artifact = 'yolos.onnx'
+        with torch.no_grad():
+            torch.onnx.export(
+                model, (dummy,), os.path.join(export_dir, artifact),
+                input_names=['pixel_values'], output_names=['logits', 'pred_boxes'],
+                dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}, 'pred_boxes': {0: 'batch'}},
+                opset_version=17,
+            )
+        if quantize:
+            _quantize_onnx(os.path.join(export_dir, artifact), os.path.join(export_dir, 'yolos.int8.onnx'))
+            artifact = 'yolos.int8.onnx'
+    elif fmt == 'torchscript':
+        artifact = 'yolos.int8.torchscript' if quantize else 'yolos.torchscript'
+        if quantize:
+            # The transformer is almost entirely Linear layers
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        with torch.no_grad():
+            traced = torch.jit.trace(model, (dummy,), strict=False)
+        traced.save(os.path.join(export_dir, artifact))
+    else:
+        raise ValueError(f"Unsupported export format '{fmt}'")
+
+    logger.info(f"Exported YOLOS model to {artifact}")
+    return artifact
+
+
+def export_models(model_path, export_dir, fmt, quantize=False, imgsz=640, yolos_size=800):
+    """
+    Export both models once and record them in the export directory's manifest.
+
+    Returns:
+        dict: The manifest entry of the exported variant
+    """
+    if fmt not in FORMATS or fmt == 'eager':
+        raise ValueError(f"Unsupported export format '{fmt}', expected 'onnx' or 'torchscript'")
+    os.makedirs(export_dir, exist_ok=True)
+
+    start_time = time.time()
+    entry = {
+        'format': fmt,
+        'quantized': quantize,
+        'segmentation': dict(
+            artifact=export_segmentation(model_path, export_dir, fmt, quantize, imgsz),
+            imgsz=imgsz,
+            **_source_stat(model_path),
+        ),
+        'yolos': {
+            'artifact': export_yolos(export_dir, fmt, quantize, yolos_size),
+            'image_size': yolos_size,
+            'model_name': YOLOS_MODEL_NAME,
+        },
+        'exported_at': time.time(),
+    }
+    manifest = read_manifest(export_dir)
+    manifest[variant_name(fmt, quantize)] = entry
+    _write_manifest(export_dir, manifest)
+    logger.info(f"Exported {variant_name(fmt, quantize)} models in {time.time() - start_time:.2f} seconds")
+    return entry
+
+
+class LazyInferenceSession:
+    """
+    An onnxruntime InferenceSession created on the first run().
+
+    ORT sessions own native thread pools that do not survive fork, so a
+    parent that preloads the models before forking only records the graph
+    and every worker opens its own session.
+    """
+
+    def __init__(self, path, threads=None):
+        self.path = path
+        self.threads = threads
+        self._lock = threading.Lock()
+        self._session = None
+
+    def _create(self):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        return ort.InferenceSession(self.path, options, providers=['CPUExecutionProvider'])
+
+    def run(self, output_names, input_feed):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create()
+        return self._session.run(output_names, input_feed)
+
+
+class ExportedYolos:
+    """
+    Run an exported YOLOS graph behind the interface the pipeline uses.
+
+    Calling it with pixel_values returns an object with logits and pred_boxes,
+    and it exposes the model config (for id2label), so the image processor's
+    post-processing works unchanged. The graph was traced at a fixed square
+    size: inputs are downscaled to fit and zero-padded, and the predicted
+    boxes are mapped back to the unpadded image.
+    """
+
+    def __init__(self, runner, config, image_size, kind):
+        self.runner = runner
+        self.config = config
+        self.image_size = image_size
+        self.kind = kind
+
+    def _fit(self, pixel_values):
+        h, w = pixel_values.shape[-2:]
+        scale = min(1.0, self.image_size / max(h, w))
+        if scale < 1.0:
+            h, w = max(1, int(round(h * scale))), max(1, int(round(w * scale)))
+            pixel_values = F.interpolate(pixel_values, size=(h, w), mode='bilinear', align_corners=False)
+        padded = pixel_values.new_zeros((pixel_values.shape[0], 3, self.image_size, self.image_size))
+        padded[:, :, :h, :w] = pixel_values
+        return padded, h, w
+
+    def __call__(self, pixel_values, **kwargs):
+        padded, h, w = self._fit(pixel_values.float())
+        if self.kind == 'onnx':
+            logits, pred_boxes = self.runner.run(['logits', 'pred_boxes'], {'pixel_values': padded.numpy()})
+            logits, pred_boxes = torch.from_numpy(logits), torch.from_numpy(pred_boxes)
+        else:
+            outputs = self.runner(padded)
+            logits, pred_boxes = outputs[0], outputs[1]
+
+        # Boxes are (cx, cy, w, h) relative to the padded canvas
+        correction = torch.tensor([self.image_size / w, self.image_size / h] * 2, dtype=pred_boxes.dtype)
+        return YolosObjectDetectionOutput(logits=logits, pred_boxes=pred_boxes * correction)
+
+
+def _load_yolos(export_dir, entry, threads=None):
+    path = os.path.join(export_dir, entry['artifact'])
+    config = YolosConfig.from_pretrained(os.path.join(export_dir, YOLOS_CONFIG_DIR))
+    if path.endswith('.onnx'):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Exported YOLOS model not found at: {path}")
+        return ExportedYolos(LazyInferenceSession(path, threads), config, entry['image_size'], 'onnx')
+    module = torch.jit.load(path, map_location='cpu')
+    module.eval()
+    return ExportedYolos(module, config, entry['image_size'], 'torchscript')
+
+
+def load_models(model_path, export_dir, fmt, quantized=False, threads=None):
+    """
+    Load the exported segmentation and YOLOS models for the configured backend.
+
+    Any artifact that is missing, stale (exported from different weights) or
+    fails to load is reported and returned as None, in which case the
+    segmenter falls back to the eager PyTorch model.
+
+    Returns:
+        tuple: (model_seg, model_yolos, variant) where the models may be None
+    """
+    if fmt == 'eager':
+        return None, None, 'eager'
+
+    variant = variant_name(fmt, quantized)
+    entry = read_manifest(export_dir).get(variant)
+    if entry is None:
+        logger.warning(f"No exported '{variant}' models in {export_dir}; run manage.py export_models. "
+                       f"Falling back to eager PyTorch")
+        return None, None, 'eager'
+
+    model_seg = None
+    try:
+        segmentation = entry['segmentation']
+        if {k: segmentation[k] for k in ('source_size', 'source_mtime')} != _source_stat(model_path):
+            logger.warning("Exported segmentation model is stale (weights changed since export); using eager")
+        else:
+            model_seg = YOLO(os.path.join(export_dir, segmentation['artifact']), task='segment')
+            logger.info(f"Loaded {variant} segmentation model {segmentation['artifact']}")
+    except Exception as e:
+        logger.error(f"Error loading exported segmentation model: {str(e)}")
+        logger.error(traceback.format_exc())
+
+    model_yolos = None
+    try:
+        model_yolos = _load_yolos(export_dir, entry['yolos'], threads)
+        logger.info(f"Loaded {variant} YOLOS model {entry['yolos']['artifact']}")
+    except Exception as e:
+        logger.error(f"Error loading exported YOLOS model: {str(e)}")
+        logger.error(traceback.format_exc())
+
+    if model_seg is None and model_yolos is None:
+        variant = 'eager'
+    return model_seg, model_yolos, variant
+
+
+def _mask_iou(a, b):
+    union = np.logical_or(a, b).sum()
+    return float(np.logical_and(a, b).sum() / union) if union else 1.0
+
+
+def _class_masks(result, shape):
+    """Union mask per class id of one YOLOv8 result, resized to shape (h, w)."""
+    masks = {}
+    if result.masks is None:
+        return masks
+    for mask, class_id in zip(result.masks.data.cpu().numpy(), result.boxes.cls.cpu().numpy()):
+        mask = cv2.resize(mask.astype(np.float32), (shape[1], shape[0])) > 0.5
+        masks[int(class_id)] = masks.get(int(class_id), False) | mask
+    return masks
+
+
+def _timed(fn, runs):
+    """Run fn runs times; return the last output and the median latency in ms."""
+    latencies = []
+    output = None
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        output = fn()
+        latencies.append(1000 * (time.perf_counter() - start_time))
+    return output, float(np.median(latencies))
+
+
+def _yolos_labels(processor, model, image, threshold=0.9):
+    inputs = processor(images=image, return_tensors='pt')
+    with torch.no_grad():
+        outputs = model(pixel_values=inputs['pixel_values'])
+    result = processor.post_process_object_detection(
+        outputs, threshold=threshold, target_sizes=torch.tensor([image.size[::-1]]))[0]
+    return {model.config.id2label[label.item()] for label in result['labels']}
+
+
+def compare_backends(model_path, export_dir, fmt, quantized, image_paths, runs=3):
+    """
+    Compare an exported variant against the eager models on sample images.
+
+    For YOLOv8 the report gives the median latency of each backend, whether
+    the detected class sets agree and the mean per-class mask IoU; for YOLOS
+    the latency and the Jaccard similarity of the predicted label sets.
+
+    Returns:
+        dict: The comparison report
+    """
+    model_seg, model_yolos, variant = load_models(model_path, export_dir, fmt, quantized)
+    if variant == 'eager':
+        raise RuntimeError(f"No usable exported '{variant_name(fmt, quantized)}' models in {export_dir}")
+
+    eager_seg = YOLO(model_path)
+    processor = YolosImageProcessor.from_pretrained(YOLOS_MODEL_NAME)
+    eager_yolos = YolosForObjectDetection.from_pretrained(YOLOS_MODEL_NAME)
+    eager_yolos.eval()
+
+    images = []
+    for image_path in image_paths:
+        image = cv2.imread(image_path)
+        if image is None:
+            logger.warning(f"Skipping unreadable image {image_path}")
+            continue
+        images.append((image_path, image))
+    if not images:
+        raise ValueError("No readable images to compare on")
+
+    per_image = []
+    for image_path, image in images:
+        row = {'image': os.path.basename(image_path)}
+        if model_seg is not None:
+            eager_result, row['yolov8_eager_ms'] = _timed(
+                lambda: eager_seg.predict(image, conf=0.5, iou=0.5, verbose=False)[0], runs)
+            exported_result, row['yolov8_exported_ms'] = _timed(
+                lambda: model_seg.predict(image, conf=0.5, iou=0.5, verbose=False)[0], runs)
+            eager_masks = _class_masks(eager_result, image.shape[:2])
+            exported_masks = _class_masks(exported_result, image.shape[:2])
+            row['yolov8_classes_agree'] = set(eager_masks) == set(exported_masks)
+            shared = set(eager_masks) & set(exported_masks)
+            row['yolov8_mask_iou'] = (float(np.mean([_mask_iou(eager_masks[c], exported_masks[c]) for c in shared]))
+                                      if shared else (1.0 if not eager_masks and not exported_masks else 0.0))
+        if model_yolos is not None:
+            pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            eager_labels, row['yolos_eager_ms'] = _timed(
+                lambda: _yolos_labels(processor, eager_yolos, pil_image), runs)
+            exported_labels, row['yolos_exported_ms'] = _timed(
+                lambda: _yolos_labels(processor, model_yolos, pil_image), runs)
+            union = eager_labels | exported_labels
+            row['yolos_label_jaccard'] = len(eager_labels & exported_labels) / len(union) if union else 1.0
+        per_image.append(row)
+
+    summary = {}
+    for key in per_image[0]:
+        if key == 'image':
+            continue
+        values = [float(row[key]) for row in per_image if key in row]
+        summary[key] = float(np.mean(values))
+    for model in ('yolov8', 'yolos'):
+        if f'{model}_eager_ms' in summary:
+            summary[f'{model}_speedup'] = summary[f'{model}_eager_ms'] / summary[f'{model}_exported_ms']
+
+    return {
+        'variant': variant_name(fmt, quantized),
+        'images': len(per_image),
+        'runs': runs,
+        'torch_threads': torch.get_num_threads(),
+        'summary': summary,
+        'per_image': per_image,
+    }
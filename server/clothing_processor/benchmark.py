@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import tempfile
+import threading
+import tracemalloc
+import cv2
+import numpy as np
+
+try:
+    from .clothing_segmentation import CLASS_NAMES, PIPELINE_STAGES, PIPELINE_VERSION, DiskSink, find_images
+except ImportError:
+    from clothing_segmentation import CLASS_NAMES, PIPELINE_STAGES, PIPELINE_VERSION, DiskSink, find_images
+
+logger = logging.getLogger(__name__)
+
+# decode, rembg, yolov8, yolos, refine (CRF or the configured refiner),
+# postprocess (blur + connected components), colors (Lab k-means),
+# assemble, then write (JPEG encode + metadata through a DiskSink)
+BENCHMARK_STAGES = [name for name, _, _, _ in PIPELINE_STAGES] + ["write"]
+DEFAULT_RESOLUTIONS = [(640, 480), (1280, 960), (2048, 1536), (4032, 3024)]
+SCHEMA_VERSION = 1
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss():
+    """Resident set size of this process in bytes (0 where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class MemorySampler:
+    """
+    Track the peak RSS of the process while a stage runs.
+
+    Native allocations (torch, onnxruntime, OpenCV) are invisible to
+    tracemalloc, so a background thread polls the RSS every interval seconds.
+    With trace_allocations the tracemalloc peak of Python/NumPy allocations
+    is reported as well; it is more precise but slows the stages down.
+    """
+
+    def __init__(self, interval=0.002, trace_allocations=False):
+        self.interval = interval
+        self.trace_allocations = trace_allocations
+        self._stop = threading.Event()
+        self._thread = None
+        self.baseline = 0
+        self.peak = 0
+        self.peak_alloc = 0
+
+    def _poll(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        if self.trace_allocations:
+            tracemalloc.start()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, name="benchmark-memory", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        self.peak_alloc = 0
+        if self.trace_allocations:
+            self.peak_alloc = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return False
+
+    @property
+    def peak_delta(self):
+        return max(0, self.peak - self.baseline)
+
+
+def synthetic_image(width, height, seed=0):
+    """
+    A garment-like test image: a textured t-shirt silhouette on a white backdrop.
+
+    Returns:
+        tuple: (BGR image, binary garment mask)
+    """
+    rng = np.random.default_rng(seed + width * 7919 + height)
+    image = np.full((height, width, 3), 245, dtype=np.uint8)
+    s = min(width, height)
+    cx, top = width // 2, int(height * 0.15)
+    body = np.array([
+        (cx - 0.22 * s, top), (cx - 0.42 * s, top + 0.18 * s), (cx - 0.32 * s, top + 0.30 * s),
+        (cx - 0.22 * s, top + 0.24 * s), (cx - 0.22 * s, top + 0.70 * s), (cx + 0.22 * s, top + 0.70 * s),
+        (cx + 0.22 * s, top + 0.24 * s), (cx + 0.32 * s, top + 0.30 * s), (cx + 0.42 * s, top + 0.18 * s),
+        (cx + 0.22 * s, top),
+    ], dtype=np.int32)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(mask, [body], 1)
+
+    base = rng.integers(40, 200, size=3)
+    stripes = ((np.arange(height) // max(4, s // 40)) % 2)[:, None, None] * rng.integers(0, 50, size=3)
+    texture = rng.normal(0, 12, size=(height, width, 3))
+    garment = np.clip(base + stripes + texture, 0, 255).astype(np.uint8)
+    image[mask == 1] = garment[mask == 1]
+    return image, mask
+
+
+def build_corpus(image_dirs=(), resolutions=DEFAULT_RESOLUTIONS):
+    """
+    Collect the benchmark inputs: every image under image_dirs plus one
+    synthetic image per resolution.
+
+    Returns:
+        list: Dicts with name, image_bytes, resolution and, for synthetic
+            images, the ground-truth mask
+    """
+    corpus = []
+    for image_dir in image_dirs:
+        if not os.path.isdir(image_dir):
+            logger.warning(f"Benchmark image directory not found: {image_dir}")
+            continue
+        for relative_path in find_images(image_dir):
+            path = os.path.join(image_dir, relative_path)
+            with open(path, "rb") as f:
+                image_bytes = f.read()
+            image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                logger.warning(f"Skipping unreadable image {path}")
+                continue
+            corpus.append({"name": relative_path, "image_bytes": image_bytes,
+                           "resolution": f"{image.shape[1]}x{image.shape[0]}", "mask": None})
+
+    for width, height in resolutions:
+        image, mask = synthetic_image(width, height)
+        ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        if not ok:
+            raise ValueError(f"Failed to encode synthetic {width}x{height} image")
+        corpus.append({"name": f"synthetic_{width}x{height}.jpg", "image_bytes": buffer.tobytes(),
+                       "resolution": f"{width}x{height}", "mask": mask})
+    return corpus
+
+
+def _synthetic_detection(mask, lowres_side=160):
+    """Stand in for YOLOv8 on a synthetic image it found nothing in."""
+    h, w = mask.shape
+    scale = lowres_side / max(h, w)
+    lowres = cv2.resize(mask.astype(np.float32), (max(1, round(w * scale)), max(1, round(h * scale))),
+                        interpolation=cv2.INTER_AREA)
+    class_id = next(k for k, v in CLASS_NAMES.items() if v == "upper_clothes")
+    return {"class_id": class_id, "mask": lowres}
+
+
+def _percentile_ms(values, q):
+    return float(1000 * np.percentile(values, q)) if values else None
+
+
+def run_benchmark(segmenter, corpus, iterations=5, warmup=1, trace_allocations=False,
+                  inject_synthetic_detections=True):
+    """
+    Run every pipeline stage over the corpus and measure it.
+
+    The stages are driven one at a time with the segmenter's own _stage_*
+    methods so each can be timed and its peak memory sampled in isolation.
+    Synthetic images carry their garment mask: when YOLOv8 detects nothing
+    in them it is used as the detection so the refine, postprocess and
+    color stages are still exercised.
+
+    Returns:
+        dict: The JSON-serializable report
+    """
+    samples = {name: [] for name in BENCHMARK_STAGES + ["total"]}
+    memory = {name: {"peak_rss": 0, "peak_alloc": 0} for name in BENCHMARK_STAGES}
+    per_image = []
+    output_dir = tempfile.mkdtemp(prefix="clothing-benchmark-")
+    sink = DiskSink(output_dir)
+
+    try:
+        for entry in corpus:
+            image_samples = {name: [] for name in BENCHMARK_STAGES + ["total"]}
+            detections = None
+            error = None
+            for iteration in range(warmup + iterations):
+                artifacts = {"image_bytes": entry["image_bytes"]}
+                timings = {}
+                for name in BENCHMARK_STAGES:
+                    try:
+                        with MemorySampler(trace_allocations=trace_allocations) as sampler:
+                            start_time = time.perf_counter()
+                            if name == "write":
+                                sink.write(artifacts["items"], f"{iteration:02d}")
+                            else:
+                                artifacts.update(getattr(segmenter, f"_stage_{name}")(artifacts))
+                            timings[name] = time.perf_counter() - start_time
+                    except Exception as e:
+                        error = f"{name}: {str(e)}"
+                        logger.error(f"Benchmark stage {name} failed on {entry['name']}: {str(e)}")
+                        break
+
+                    if iteration >= warmup:
+                        memory[name]["peak_rss"] = max(memory[name]["peak_rss"], sampler.peak_delta)
+                        memory[name]["peak_alloc"] = max(memory[name]["peak_alloc"], sampler.peak_alloc)
+
+                    if name == "yolov8":
+                        if not artifacts["detections"] and entry["mask"] is not None and inject_synthetic_detections:
+                            artifacts.update(detections=[_synthetic_detection(entry["mask"])], is_dress=False)
+                        if not artifacts["detections"]:
+                            break
+                detections = len(artifacts.get("detections", []))
+                if error:
+                    break
+
+                if iteration >= warmup:
+                    for name, seconds in timings.items():
+                        image_samples[name].append(seconds)
+                    image_samples["total"].append(sum(timings.values()))
+
+            for name, values in image_samples.items():
+                samples[name].extend(values)
+            per_image.append({
+                "name": entry["name"],
+                "resolution": entry["resolution"],
+                "detections": detections,
+                "error": error,
+                "p50_ms": {name: _percentile_ms(values, 50) for name, values in image_samples.items() if values},
+            })
+            if image_samples["total"]:
+                logger.info(f"Benchmarked {entry['name']} ({entry['resolution']}): "
+                            f"p50 total {_percentile_ms(image_samples['total'], 50):.1f} ms")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    stages = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        stages[name] = {
+            "count": len(values),
+            "p50_ms": _percentile_ms(values, 50),
+            "p95_ms": _percentile_ms(values, 95),
+            "mean_ms": float(1000 * np.mean(values)),
+        }
+        if name in memory:
+            stages[name]["peak_rss_mb"] = memory[name]["peak_rss"] / 2 ** 20
+            if trace_allocations:
+                stages[name]["peak_alloc_mb"] = memory[name]["peak_alloc"] / 2 ** 20
+
+    return {
+        "schema": SCHEMA_VERSION,
+        "environment": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "pipeline_version": PIPELINE_VERSION,
+            "refiner": segmenter.refiner.name,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_threads": _torch_threads(),
+        },
+        "settings": {"iterations": iterations, "warmup": warmup, "trace_allocations": trace_allocations},
+        "corpus": [{"name": e["name"], "resolution": e["resolution"]} for e in corpus],
+        "stages": stages,
+        "per_image": per_image,
+    }
+
+
+def _torch_threads():
+    try:
+        import torch
+        return torch.get_num_threads()
+    except ImportError:
+        return None
+
+
+def compare_reports(baseline, current, threshold=0.10, min_delta_ms=1.0, metrics=("p50_ms", "p95_ms")):
+    """
+    Diff two benchmark reports stage by stage.
+
+    A metric regresses when it grew by more than threshold (a fraction of
+    the baseline) and by more than min_delta_ms, so sub-millisecond stages
+    do not trip on noise.
+
+    Returns:
+        tuple: (rows, regressions), each a list of dicts with stage, metric,
+            baseline, current and change
+    """
+    rows = []
+    regressions = []
+    for stage in BENCHMARK_STAGES + ["total"]:
+        before = baseline.get("stages", {}).get(stage)
+        after = current.get("stages", {}).get(stage)
+        if not before or not after:
+            continue
+        for metric in metrics + ("peak_rss_mb",):
+            if before.get(metric) is None or after.get(metric) is None:
+                continue
+            change = (after[metric] - before[metric]) / before[metric] if before[metric] else 0.0
+            row = {"stage": stage, "metric": metric, "baseline": before[metric],
+                   "current": after[metric], "change": change}
+            rows.append(row)
+            if metric in metrics and change > threshold and after[metric] - before[metric] > min_delta_ms:
+                regressions.append(row)
+    return rows, regressions
+
+
+def load_report(path):
+    with open(path, "r") as f:
+        report = json.load(f)
+    if report.get("schema") != SCHEMA_VERSION:
+        raise ValueError(f"{path} is not a benchmark report of schema {SCHEMA_VERSION}")
+    return report
@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Content-addressed cache of clothing processing results.
+
+    Entries are keyed by the SHA-256 of the uploaded bytes plus the pipeline
+    version, so a re-upload of the same photo is served without running any
+    model. Each entry lives on disk as <dir>/<key[:2]>/<key>/ holding
+    result.json and the segmented JPEG of every garment; a small in-memory
+    LRU sits in front of the disk. A hit touches the entry directory, so
+    when the cache exceeds max_entries / max_bytes the least recently used
+    entries are evicted first; entries older than max_age seconds always are.
+    """
+
+    RESULT_FILENAME = 'result.json'
+    IMAGE_FILENAME = 'segmented.jpg'
+
+    def __init__(self, cache_dir, version, max_entries=1000, max_bytes=512 * 1024 * 1024,
+                 max_age=7 * 24 * 3600, memory_entries=128, evict_every=32):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.memory_entries = memory_entries
+        self.evict_every = evict_every
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.join(self.cache_dir, 'idempotency'), exist_ok=True)
+
+    def key_for(self, image_bytes):
+        """Return the cache key for an upload under the current pipeline version."""
+        digest = hashlib.sha256(image_bytes)
+        digest.update(self.version.encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _idempotency_path(self, scope, idempotency_key):
+        name = hashlib.sha256(f"{scope}:{idempotency_key}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'idempotency', name)
+
+    @staticmethod
+    def _image_paths(result):
+        return [item['segmented_image'] for item in result.get('items') or [result]]
+
+    def _touch(self, key):
+        """Mark an entry as recently used for eviction."""
+        try:
+            os.utime(self._entry_dir(key))
+        except OSError:
+            pass
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached result for key, or None on a miss."""
+        return self.lookup([key])[1]
+
+    def lookup(self, keys):
+        """
+        Return (key, result) for the first of keys with a cached result, or
+        (None, None). Falling back through several keys (e.g. an idempotency
+        binding, then the content hash) still counts as a single hit or miss.
+        """
+        for key in keys:
+            result = self._load(key)
+            if result is not None:
+                self._touch(key)
+                return key, dict(result)
+        with self._lock:
+            self.misses += 1
+        return None, None
+
+    def _load(self, key):
+        entry_dir = self._entry_dir(key)
+        result_path = os.path.join(entry_dir, self.RESULT_FILENAME)
+
+        with self._lock:
+            result = self._memory.get(key)
+            if (result is not None and time.time() - result['cached_at'] <= self.max_age
+                    and all(os.path.exists(path) for path in self._image_paths(result))):
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return result
+            self._memory.pop(key, None)
+
+        try:
+            with open(result_path, 'r') as f:
+                result = json.load(f)
+            if (time.time() - result['cached_at'] > self.max_age
+                    or not all(os.path.exists(path) for path in self._image_paths(result))):
+                self._remove(key)
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, result)
+        return result
+
+    def put(self, key, result):
+        """
+        Store a processing result, copying every garment's segmented image
+        into the entry.
+
+        Returns:
+            dict: The cached result, whose image paths all point into the cache
+                (the run's workspace is no longer needed)
+        """
+        entry_dir = self._entry_dir(key)
+        tmp_dir = f"{entry_dir}.tmp{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            items = []
+            for i, item in enumerate(result.get('items') or [result]):
+                filename = self.IMAGE_FILENAME if i == 0 else f"segmented_{i}.jpg"
+                shutil.copyfile(item['segmented_image'], os.path.join(tmp_dir, filename))
+                items.append(dict(item, segmented_image=os.path.join(entry_dir, filename)))
+            cached = dict(result, segmented_image=items[0]['segmented_image'], items=items, cached_at=time.time())
+            cached.pop('timings', None)
+            cached.pop('workspace', None)
+            with open(os.path.join(tmp_dir, self.RESULT_FILENAME), 'w') as f:
+                json.dump(cached, f)
+            # Publish the entry atomically; a concurrent writer of the same key wins harmlessly
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        except Exception as e:
+            logger.error(f"Error writing processing cache entry {key}: {str(e)}")
+            logger.debug(traceback.format_exc())
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return result
+
+        with self._lock:
+            self._remember(key, cached)
+            self._puts += 1
+            should_evict = self._puts % self.evict_every == 0
+        if should_evict:
+            self.evict()
+        return dict(cached)
+
+    def resolve_idempotency_key(self, scope, idempotency_key):
+        """Return the cache key bound to a client idempotency key, if any."""
+        try:
+            with open(self._idempotency_path(scope, idempotency_key), 'r') as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def bind_idempotency_key(self, scope, idempotency_key, key):
+        """Map a client idempotency key (scoped, e.g. per user) to a cache key."""
+        try:
+            with open(self._idempotency_path(scope, idempotency_key), 'w') as f:
+                f.write(key)
+        except OSError as e:
+            logger.error(f"Error binding idempotency key: {str(e)}")
+
+    def _remove(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def evict(self):
+        """Drop expired entries, then the least recently used ones until under the size limits."""
+        now = time.time()
+        entries = []
+        for shard in os.listdir(self.cache_dir):
+            shard_dir = os.path.join(self.cache_dir, shard)
+            if shard == 'idempotency' or not os.path.isdir(shard_dir):
+                continue
+            for key in os.listdir(shard_dir):
+                entry_dir = os.path.join(shard_dir, key)
+                try:
+                    size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+                    mtime = os.stat(entry_dir).st_mtime
+                except OSError:
+                    continue
+                entries.append((mtime, key, size))
+
+        entries.sort()
+        total_bytes = sum(size for _, _, size in entries)
+        count = len(entries)
+        evicted = 0
+        for mtime, key, size in entries:
+            if now - mtime <= self.max_age and count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            self._remove(key)
+            count -= 1
+            total_bytes -= size
+            evicted += 1
+
+        # Idempotency bindings are only useful while their entry may exist
+        idempotency_dir = os.path.join(self.cache_dir, 'idempotency')
+        for entry in os.scandir(idempotency_dir):
+            try:
+                if now - entry.stat().st_mtime > self.max_age:
+                    os.remove(entry.path)
+            except OSError:
+                continue
+
+        if evicted:
+            with self._lock:
+                self.evictions += evicted
+            logger.info(f"Evicted {evicted} processing cache entries")
+        return evicted
+
+    def stats(self):
+        """Hit/miss counters for this process."""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'hits': hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+            }
@@ -2,19 +2,32 @@ import os
 import cv2
 import numpy as np
 import json
+import hashlib
 import logging
+import multiprocessing
 import time
+import threading
 import traceback
+from contextlib import contextmanager
+from dataclasses import dataclass
 from ultralytics import YOLO
-from rembg import remove
+from rembg import remove, new_session
 import torch
-import pydensecrf.densecrf as dcrf
-from pydensecrf.utils import unary_from_softmax
 from transformers import YolosImageProcessor, YolosForObjectDetection
 from PIL import Image
 import argparse
 import warnings
 
+try:
+    from .refinement import DenseCRFRefiner, get_refiner, mask_roi, unletterbox_mask, REFINERS
+    from .colors import extract_dominant_colors
+    from .color_names import name_colors
+except ImportError:
+    # Run as a script: python clothing_segmentation.py ...
+    from refinement import DenseCRFRefiner, get_refiner, mask_roi, unletterbox_mask, REFINERS
+    from colors import extract_dominant_colors
+    from color_names import name_colors
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -44,12 +57,152 @@ CATEGORY_MAP = {
     "dress": "dress"
 }
 
+YOLOS_MODEL_NAME = "valentinafeve/yolos-fashionpedia"
+
+# Bump whenever a change alters the pipeline's output so cached results are not reused
+PIPELINE_VERSION = "5"
+
+# Stage graph of the ClothingSegmenter pipeline: (name, inputs, outputs, optional).
+# Stages run in this order and share their outputs, so every model runs at most
+# once per image. An optional stage that fails yields empty outputs instead of
+# aborting the run.
+PIPELINE_STAGES = (
+    ("decode", ("image_bytes",), ("image",), False),
+    ("rembg", ("image",), ("bg_removed",), False),
+    ("yolov8", ("bg_removed",), ("detections", "is_dress"), False),
+    ("yolos", ("image", "detections", "is_dress"), ("lower_labels", "upper_labels"), True),
+    ("refine", ("bg_removed", "detections"), ("refined_masks",), False),
+    ("postprocess", ("refined_masks",), ("masks",), False),
+    ("colors", ("bg_removed", "masks"), ("colors",), False),
+    ("assemble", ("bg_removed", "detections", "masks", "colors", "lower_labels", "upper_labels"), ("items",), False),
+)
+
+
+@dataclass
+class SegmentedItem:
+    """One garment produced by the pipeline, held in memory."""
+
+    class_id: int
+    suffix: str
+    category: str
+    description: str
+    colors: list
+    color_weights: list
+    color_names: list
+    mask: np.ndarray
+    image: np.ndarray
+
+    @property
+    def bbox(self):
+        """Bounding box (x0, y0, x1, y1) of the mask."""
+        x, y, w, h = cv2.boundingRect(self.mask)
+        return (x, y, x + w, y + h)
+
+    @property
+    def crop(self):
+        """The segmented image cropped to the garment's bounding box."""
+        x0, y0, x1, y1 = self.bbox
+        return self.image[y0:y1, x0:x1]
+
+    def metadata(self, filename=None):
+        return {
+            "filename": filename,
+            "category": self.category,
+            "colors": self.colors,
+            "color_weights": self.color_weights,
+            "color_names": self.color_names,
+            "description": self.description
+        }
+
+    def encode(self, ext=".jpg"):
+        """Encode the segmented image, e.g. for storage or an HTTP response."""
+        ok, buffer = cv2.imencode(ext, self.image)
+        if not ok:
+            raise ValueError(f"Failed to encode segmented image as {ext}")
+        return buffer.tobytes()
+
+
+class DiskSink:
+    """Persist SegmentedItems as JPEG + metadata JSON pairs in a directory."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def write(self, items, prefix):
+        """
+        Write each item as <prefix>_<suffix>.jpg/.json.
+
+        Returns:
+            list: The metadata of each item plus image_path and metadata_path
+        """
+        written = []
+        for item in items:
+            seg_filename = f"{prefix}_{item.suffix}.jpg"
+            seg_output_path = os.path.join(self.output_dir, seg_filename)
+            with open(seg_output_path, "wb") as f:
+                f.write(item.encode(".jpg"))
+            logger.info(f"Saved segmentation as {seg_filename} (class: {CLASS_NAMES.get(item.class_id, item.class_id)})")
+
+            metadata = item.metadata(seg_filename)
+            metadata_filename = f"{prefix}_{item.suffix}.json"
+            metadata_path = os.path.join(self.output_dir, metadata_filename)
+            with open(metadata_path, 'w') as f:
+                json.dump(metadata, f, indent=2)
+            logger.info(f"Saved metadata file {metadata_filename}")
+
+            written.append(dict(metadata, image_path=seg_output_path, metadata_path=metadata_path))
+        return written
+
+
+class StageTimer:
+    """Accumulate wall-clock time per pipeline stage."""
+
+    def __init__(self):
+        self.timings = {}
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start_time)
+
+
 class ClothingSegmenter:
-    def __init__(self, model_path, images_output_dir):
-        """Initialize the clothing segmentation models."""
+    def __init__(self, model_path, images_output_dir, batch_imgsz=640, refiner=None,
+                 refine_max_side=768, roi_padding=0.1, model_seg=None, model_yolos=None):
+        """
+        Initialize the clothing segmentation models.
+
+        model_seg and model_yolos may be passed in already loaded (e.g. from
+        exported ONNX/TorchScript artifacts, see backends.py); otherwise the
+        eager PyTorch models are loaded from model_path and the hub.
+
+        refiner is a MaskRefiner backend (DenseCRF by default); masks are
+        refined on their padded bounding box (roi_padding, as a fraction of the
+        box) with the longest side capped at refine_max_side pixels.
+        """
         logger.info("Initializing ClothingSegmenter")
         start_time = time.time()
         self.images_output_dir = images_output_dir
+        # Letterbox size used when YOLOv8 runs on a batch of mixed-size images
+        self.batch_imgsz = batch_imgsz
+        # Ultralytics predictors keep per-call state and are not thread-safe;
+        # the other models can be called from several threads at once
+        self._seg_lock = threading.Lock()
+        # ONNX Runtime sessions own native thread pools that do not survive
+        # fork, so the rembg session is created on first use in each process
+        self._rembg_lock = threading.Lock()
+        self._rembg_session = None
+        self.refiner = refiner or DenseCRFRefiner()
+        self.refine_max_side = refine_max_side
+        self.roi_padding = roi_padding
+        logger.info(f"Mask refinement backend: {self.refiner.name}")
 
         try:
             os.makedirs(self.images_output_dir, exist_ok=True)
@@ -58,8 +211,8 @@ class ClothingSegmenter:
             # Load YOLOS model for clothing detection
             try:
                 logger.info("Loading YOLOS model for clothing detection")
-                self.processor = YolosImageProcessor.from_pretrained("valentinafeve/yolos-fashionpedia")
-                self.model_yolos = YolosForObjectDetection.from_pretrained("valentinafeve/yolos-fashionpedia")
+                self.processor = YolosImageProcessor.from_pretrained(YOLOS_MODEL_NAME)
+                self.model_yolos = model_yolos or YolosForObjectDetection.from_pretrained(YOLOS_MODEL_NAME)
                 logger.info("YOLOS model loaded successfully")
             except Exception as e:
                 logger.error(f"Error loading YOLOS model: {str(e)}")
@@ -68,7 +221,7 @@ class ClothingSegmenter:
             # Load segmentation model
             try:
                 logger.info(f"Loading YOLOv8 segmentation model from {model_path}")
-                self.model_seg = YOLO(model_path)
+                self.model_seg = model_seg or YOLO(model_path)
                 logger.info("YOLOv8 segmentation model loaded successfully")
             except Exception as e:
                 logger.error(f"Error loading YOLOv8 segmentation model: {str(e)}")
@@ -80,6 +233,44 @@ class ClothingSegmenter:
             logger.debug(traceback.format_exc())
             raise
 
+    @property
+    def rembg_session(self):
+        """
+        The rembg u2net session, created once per process on first use;
+        remove() would otherwise load the ONNX model again on every call.
+        """
+        if self._rembg_session is None:
+            with self._rembg_lock:
+                if self._rembg_session is None:
+                    try:
+                        logger.info("Creating rembg session")
+                        self._rembg_session = new_session("u2net")
+                        logger.info("rembg session created successfully")
+                    except Exception as e:
+                        logger.error(f"Error creating rembg session: {str(e)}")
+                        raise RuntimeError(f"Failed to create rembg session: {str(e)}")
+        return self._rembg_session
+
+    def warmup(self):
+        """
+        Run one dummy inference through every model so that the first real
+        request does not pay for layer fusion, kernel selection and lazy allocations.
+        """
+        start_time = time.time()
+        logger.info("Warming up clothing segmentation models")
+        dummy = np.zeros((640, 640, 3), dtype=np.uint8)
+        
+        remove(Image.fromarray(dummy), session=self.rembg_session)
+        with self._seg_lock:
+            self.model_seg.predict(dummy, conf=0.5, iou=0.5, verbose=False)
+        inputs_yolos = self.processor(images=Image.fromarray(dummy), return_tensors="pt")
+        with torch.no_grad():
+            self.model_yolos(**inputs_yolos)
+        
+        elapsed = time.time() - start_time
+        logger.info(f"Warm-up completed in {elapsed:.2f} seconds")
+        return elapsed
+
     def keep_largest_connected_component(self, mask):
         """Keep only the largest connected component in a binary mask."""
         try:
@@ -93,225 +284,397 @@ class ClothingSegmenter:
             logger.error(f"Error in keep_largest_connected_component: {str(e)}")
             return mask  # Return original mask on error
 
-    def apply_crf(self, soft_mask, image, iterations=5):
-        """
-        Apply DenseCRF to refine the segmentation mask.
+    def get_dominant_colors(self, image, mask, k=3):
         """
-        try:
-            h, w = soft_mask.shape
-            # Prepare probability map: 2 channels: background and foreground.
-            probs = np.stack([1 - soft_mask, soft_mask], axis=0)
-            d = dcrf.DenseCRF2D(w, h, 2)
-            U = unary_from_softmax(probs.astype(np.float32))
-            d.setUnaryEnergy(U)
-            d.addPairwiseGaussian(sxy=5, compat=5)
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-            d.addPairwiseBilateral(sxy=60, srgb=10, rgbim=image_rgb, compat=15)
-            Q = d.inference(iterations)
-            refined_mask = np.argmax(np.array(Q).reshape((2, h, w)), axis=0).astype(np.uint8)
-            return refined_mask
-        except Exception as e:
-            logger.error(f"Error in apply_crf: {str(e)}")
-            return np.where(soft_mask > 0.5, 1, 0).astype(np.uint8)
+        Extract dominant colors from the masked region of an image.
 
-    def get_dominant_colors(self, image, mask, k=3):
-        """Extract dominant colors from the masked region of an image."""
+        Returns:
+            list: (hex_color, pixel_share) pairs, most common first
+        """
         try:
-            region_pixels = image[mask == 1]
-            if region_pixels.size == 0:
-                logger.warning("No pixels found in masked region for color extraction")
-                return []
-            non_white = region_pixels[np.all(region_pixels < 230, axis=1)]
-            if non_white.size == 0:
-                logger.warning("No non-white pixels found in masked region")
-                return []
-            data = np.float32(non_white)
-            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
-            attempts = 10
-            ret, labels, centers = cv2.kmeans(data, k, None, criteria, attempts, cv2.KMEANS_RANDOM_CENTERS)
-            centers = centers.astype(int)
-            counts = np.bincount(labels.flatten())
-            sorted_idx = np.argsort(-counts)
-            dominant_colors = []
-            for idx in sorted_idx:
-                bgr_color = centers[idx]
-                rgb_color = (bgr_color[2], bgr_color[1], bgr_color[0])
-                hex_color = '#{:02x}{:02x}{:02x}'.format(*rgb_color)
-                dominant_colors.append(hex_color)
-            return dominant_colors
+            colors = extract_dominant_colors(image, mask, k=k, channel_order='bgr', exclude_above=230)
+            if not colors:
+                logger.warning("No non-white pixels found in masked region for color extraction")
+            return colors
         except Exception as e:
             logger.error(f"Error in get_dominant_colors: {str(e)}")
             return []
 
-    def process_image(self, image_path, index):
-        """Process a single image to detect and segment clothing items."""
-        start_time = time.time()
-        filename = os.path.basename(image_path)
-        logger.info(f"Processing image {index:02d}: {filename}")
-        
-        try:
-            orig_img = cv2.imread(image_path)
-            if orig_img is None:
-                logger.error(f"Unable to read image: {image_path}")
-                return
-            
-            # Background removal
-            try:
-                logger.debug("Removing background")
-                with open(image_path, "rb") as file:
-                    input_bytes = file.read()
-                rembg_output = remove(input_bytes)
-                data = np.frombuffer(rembg_output, np.uint8)
-                bg_removed_img = cv2.imdecode(data, cv2.IMREAD_COLOR)
-                if bg_removed_img is None:
-                    logger.error("Failed to decode background-removed image")
-                    return
-                gray = cv2.cvtColor(bg_removed_img, cv2.COLOR_BGR2GRAY)
-                _, binary_mask = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
-                bg_removed_img = cv2.bitwise_and(bg_removed_img, bg_removed_img, mask=binary_mask)
-            except Exception as e:
-                logger.error(f"Error during background removal: {str(e)}")
-                logger.debug(traceback.format_exc())
-                return
+    @classmethod
+    def describe_pipeline(cls):
+        """Return the stage graph: each stage with the artifacts it reads and produces."""
+        return [
+            {"stage": name, "inputs": list(inputs), "outputs": list(outputs), "optional": optional}
+            for name, inputs, outputs, optional in PIPELINE_STAGES
+        ]
 
-            # Initial segmentation to check for dress
-            try:
-                logger.debug("Running YOLOv8 segmentation for dress detection")
-                results = self.model_seg.predict(bg_removed_img, conf=0.5, iou=0.5)
-                is_dress = False
-                if results and results[0].boxes is not None:
-                    for class_id_tensor in results[0].boxes.cls:
-                        class_id = int(class_id_tensor.item())
-                        if CLASS_NAMES.get(class_id, "").lower() == "dress":
-                            is_dress = True
-                            break
-
-                if is_dress:
-                    logger.info("Detected dress - processing as single item")
-                    mask_tensor = results[0].masks.data[0]
-                    mask_np = mask_tensor.cpu().numpy().astype(np.float32)
-                    soft_mask = cv2.resize(mask_np, (bg_removed_img.shape[1], bg_removed_img.shape[0]), 
-                                             interpolation=cv2.INTER_NEAREST)
-                    soft_mask = np.clip(soft_mask, 0, 1)
-                    refined_mask = self.apply_crf(soft_mask, bg_removed_img)
-                    smoothed_mask = cv2.GaussianBlur(refined_mask.astype(np.float32), (17, 17), 0)
-                    smoothed_mask = np.where(smoothed_mask > 0.5, 1, 0).astype(np.uint8)
-                    cleaned_mask = self.keep_largest_connected_component(smoothed_mask)
-                    segmented_output = np.where(cleaned_mask[:, :, None] == 1, bg_removed_img, 255)
-                    colors = self.get_dominant_colors(bg_removed_img, cleaned_mask)
-                    
-                    seg_filename = f"{index:02d}_dress.jpg"
-                    seg_output_path = os.path.join(self.images_output_dir, seg_filename)
-                    cv2.imwrite(seg_output_path, segmented_output)
-                    
-                    metadata = {
-                        "filename": seg_filename,
-                        "category": "dress",
-                        "colors": colors if colors else [],
-                        "description": "dress"
-                    }
-                    metadata_filename = f"{index:02d}_dress.json"
-                    metadata_path = os.path.join(self.images_output_dir, metadata_filename)
-                    with open(metadata_path, 'w') as f:
-                        json.dump(metadata, f, indent=2)
-                    
-                    logger.info(f"Saved dress segmentation as {seg_filename}")
-                    return  # Exit early if dress is detected
-
-                # --- YOLOS detection for additional info ---
-                # Initialize the label sets so they are available later.
-                lower_clothes_labels = set()
-                upper_clothes_labels = set()
-                try:
-                    pil_image = Image.fromarray(cv2.cvtColor(orig_img, cv2.COLOR_BGR2RGB))
-                    inputs_yolos = self.processor(images=pil_image, return_tensors="pt")
-                    with torch.no_grad():
-                        outputs_yolos = self.model_yolos(**inputs_yolos)
-                    target_sizes = torch.tensor([pil_image.size[::-1]])
-                    results_yolos = self.processor.post_process_object_detection(
-                        outputs_yolos, threshold=0.9, target_sizes=target_sizes)[0]
-                    
-                    for label in results_yolos["labels"]:
-                        label_name = (self.model_yolos.config.id2label[label.item()]
-                                      if self.model_yolos.config.id2label else str(label.item()))
-                        if label_name in LOWER_CLOTHES:
-                            lower_clothes_labels.add(label_name)
-                        elif label_name in UPPER_CLOTHES:
-                            upper_clothes_labels.add(label_name)
-                    
-                    logger.info(f"YOLOS detected lower clothing: {' '.join(lower_clothes_labels) if lower_clothes_labels else 'None'}")
-                    logger.info(f"YOLOS detected upper clothing: {' '.join(upper_clothes_labels) if upper_clothes_labels else 'None'}")
-                except Exception as e:
-                    logger.error(f"Error during YOLOS detection: {str(e)}")
-                    logger.debug(traceback.format_exc())
-                
-                # --- Segmentation for each detected mask for non-dress items ---
+    def _stage_decode(self, artifacts):
+        """Decode the encoded upload once (skipped when given an array)."""
+        if "image" in artifacts:
+            return {}
+        orig_img = cv2.imdecode(np.frombuffer(artifacts["image_bytes"], np.uint8), cv2.IMREAD_COLOR)
+        if orig_img is None:
+            raise ValueError("Unable to decode image")
+        return {"image": orig_img}
+
+    def _stage_rembg(self, artifacts):
+        """
+        Remove the background using rembg's raw alpha mask.
+
+        Asking for the mask alone avoids rembg encoding a PNG cutout that
+        would only be decoded again; the cutout is rebuilt from the mask.
+        """
+        orig_img = artifacts["image"]
+        pil_image = Image.fromarray(cv2.cvtColor(orig_img, cv2.COLOR_BGR2RGB))
+        alpha = np.asarray(remove(pil_image, session=self.rembg_session, only_mask=True), dtype=np.uint8)
+        if alpha.shape[:2] != orig_img.shape[:2]:
+            raise ValueError("Background mask does not match the image size")
+        bg_removed_img = (orig_img * (alpha[:, :, None] / 255.0)).astype(np.uint8)
+        gray = cv2.cvtColor(bg_removed_img, cv2.COLOR_BGR2GRAY)
+        _, binary_mask = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
+        bg_removed_img = cv2.bitwise_and(bg_removed_img, bg_removed_img, mask=binary_mask)
+        return {"bg_removed": bg_removed_img}
+
+    def _parse_segmentation(self, result):
+        """
+        Turn one YOLOv8 result into detections. If a dress is present it is
+        processed as the single item.
+
+        Masks come back at the padded letterbox resolution; the padding is
+        cropped so each mask covers exactly the photo.
+        """
+        detections = []
+        if result is not None and result.masks is not None and result.masks.data is not None:
+            for mask_tensor, class_id_tensor in zip(result.masks.data, result.boxes.cls):
+                mask = mask_tensor.cpu().numpy().astype(np.float32)
+                detections.append({
+                    "class_id": int(class_id_tensor.item()),
+                    "mask": unletterbox_mask(mask, result.orig_shape),
+                })
+
+        dress = next((d for d in detections
+                      if CLASS_NAMES.get(d["class_id"], "").lower() == "dress"), None)
+        if dress is not None:
+            logger.info("Detected dress - processing as single item")
+            detections = [dress]
+        return {"detections": detections, "is_dress": dress is not None}
+
+    def _stage_yolov8(self, artifacts):
+        """
+        Run YOLOv8 segmentation once. Its result serves both the dress check
+        and the per-item masks.
+        """
+        with self._seg_lock:
+            results = self.model_seg.predict(artifacts["bg_removed"], conf=0.5, iou=0.5)
+        return self._parse_segmentation(results[0] if results else None)
+
+    def _batch_yolov8(self, artifacts_list):
+        """
+        Run YOLOv8 segmentation on a whole batch in one forward pass.
+
+        Ultralytics letterboxes every image to a padded imgsz square, so mixed
+        sizes batch together; _parse_segmentation removes each image's padding.
+        """
+        with self._seg_lock:
+            results = self.model_seg.predict([a["bg_removed"] for a in artifacts_list],
+                                             conf=0.5, iou=0.5, imgsz=self.batch_imgsz)
+        return [self._parse_segmentation(result) for result in results]
+
+    def _needs_yolos(self, artifacts):
+        return not artifacts["is_dress"] and bool(artifacts["detections"])
+
+    def _collect_labels(self, results_yolos):
+        """Split YOLOS detections into lower and upper clothing label sets."""
+        lower_clothes_labels = set()
+        upper_clothes_labels = set()
+        for label in results_yolos["labels"]:
+            label_name = (self.model_yolos.config.id2label[label.item()]
+                          if self.model_yolos.config.id2label else str(label.item()))
+            if label_name in LOWER_CLOTHES:
+                lower_clothes_labels.add(label_name)
+            elif label_name in UPPER_CLOTHES:
+                upper_clothes_labels.add(label_name)
+
+        logger.info(f"YOLOS detected lower clothing: {' '.join(lower_clothes_labels) if lower_clothes_labels else 'None'}")
+        logger.info(f"YOLOS detected upper clothing: {' '.join(upper_clothes_labels) if upper_clothes_labels else 'None'}")
+        return {"lower_labels": lower_clothes_labels, "upper_labels": upper_clothes_labels}
+
+    def _stage_yolos(self, artifacts):
+        """Detect fine-grained garment labels with YOLOS (not needed for dresses)."""
+        if not self._needs_yolos(artifacts):
+            return {"lower_labels": set(), "upper_labels": set()}
+
+        pil_image = Image.fromarray(cv2.cvtColor(artifacts["image"], cv2.COLOR_BGR2RGB))
+        inputs_yolos = self.processor(images=pil_image, return_tensors="pt")
+        with torch.no_grad():
+            outputs_yolos = self.model_yolos(**inputs_yolos)
+        target_sizes = torch.tensor([pil_image.size[::-1]])
+        results_yolos = self.processor.post_process_object_detection(
+            outputs_yolos, threshold=0.9, target_sizes=target_sizes)[0]
+        return self._collect_labels(results_yolos)
+
+    def _batch_yolos(self, artifacts_list):
+        """
+        Run YOLOS on every image of the batch that needs labels in one forward pass.
+
+        The image processor pads the batch to a common size. Only the labels
+        are used downstream, so the padding does not affect the result.
+        """
+        produced = [{"lower_labels": set(), "upper_labels": set()} for _ in artifacts_list]
+        needed = [i for i, artifacts in enumerate(artifacts_list) if self._needs_yolos(artifacts)]
+        if not needed:
+            return produced
+
+        pil_images = [Image.fromarray(cv2.cvtColor(artifacts_list[i]["image"], cv2.COLOR_BGR2RGB))
+                      for i in needed]
+        inputs_yolos = self.processor(images=pil_images, return_tensors="pt")
+        with torch.no_grad():
+            outputs_yolos = self.model_yolos(pixel_values=inputs_yolos["pixel_values"])
+        target_sizes = torch.tensor([pil_image.size[::-1] for pil_image in pil_images])
+        results_yolos = self.processor.post_process_object_detection(
+            outputs_yolos, threshold=0.9, target_sizes=target_sizes)
+
+        for i, result in zip(needed, results_yolos):
+            produced[i] = self._collect_labels(result)
+        return produced
+
+    def _stage_refine(self, artifacts):
+        """
+        Refine each mask inside its padded bounding box at a capped working resolution.
+
+        Only the garment's region is cropped, downscaled so its longest side is
+        at most refine_max_side, and handed to the refinement backend, so the
+        cost no longer grows with the full photo resolution.
+        """
+        bg_removed_img = artifacts["bg_removed"]
+        refined_masks = []
+        for i, detection in enumerate(artifacts["detections"]):
+            lowres_mask = np.clip(detection["mask"], 0, 1)
+            roi = mask_roi(lowres_mask, bg_removed_img.shape, padding=self.roi_padding)
+            if roi is None:
+                refined_masks.append(None)
+                continue
+            (lx0, ly0, lx1, ly1), (x0, y0, x1, y1) = roi
+            scale = min(1.0, self.refine_max_side / max(x1 - x0, y1 - y0))
+            work_size = (max(1, int(round((x1 - x0) * scale))), max(1, int(round((y1 - y0) * scale))))
+
+            soft_mask = cv2.resize(lowres_mask[ly0:ly1, lx0:lx1], work_size, interpolation=cv2.INTER_NEAREST)
+            work_image = bg_removed_img[y0:y1, x0:x1]
+            if scale < 1.0:
+                work_image = cv2.resize(work_image, work_size, interpolation=cv2.INTER_AREA)
+            logger.debug(f"Applying {self.refiner.name} refinement for mask {i+1} on a {work_size[0]}x{work_size[1]} region")
+            refined_masks.append({
+                "box": (x0, y0, x1, y1),
+                "scale": scale,
+                "mask": self.refiner.refine(soft_mask, work_image, scale),
+            })
+        return {"refined_masks": refined_masks}
+
+    def _stage_postprocess(self, artifacts):
+        """
+        Smooth each refined mask and keep its largest connected component, still
+        at working resolution, then upsample it into a full-size mask.
+        """
+        image_shape = artifacts["bg_removed"].shape[:2]
+        masks = []
+        for refined in artifacts["refined_masks"]:
+            mask = np.zeros(image_shape, dtype=np.uint8)
+            if refined is None:
+                masks.append(mask)
+                continue
+            # The 17x17 kernel was tuned at full resolution
+            ksize = max(3, int(round(17 * refined["scale"])) | 1)
+            smoothed_mask = cv2.GaussianBlur(refined["mask"].astype(np.float32), (ksize, ksize), 0)
+            smoothed_mask = np.where(smoothed_mask > 0.5, 1, 0).astype(np.uint8)
+            cleaned_mask = self.keep_largest_connected_component(smoothed_mask)
+
+            x0, y0, x1, y1 = refined["box"]
+            if refined["scale"] < 1.0:
+                upsampled = cv2.resize(cleaned_mask.astype(np.float32), (x1 - x0, y1 - y0),
+                                       interpolation=cv2.INTER_LINEAR)
+                cleaned_mask = np.where(upsampled > 0.5, 1, 0).astype(np.uint8)
+            mask[y0:y1, x0:x1] = cleaned_mask
+            masks.append(mask)
+        return {"masks": masks}
+
+    def _stage_colors(self, artifacts):
+        """Extract the dominant colors under each final mask."""
+        bg_removed_img = artifacts["bg_removed"]
+        return {"colors": [self.get_dominant_colors(bg_removed_img, mask) for mask in artifacts["masks"]]}
+
+    def _stage_assemble(self, artifacts):
+        """Build the in-memory SegmentedItem for every final mask."""
+        bg_removed_img = artifacts["bg_removed"]
+        # Name every color of every item in one vectorized lookup
+        all_names = iter(name_colors([color for colors in artifacts["colors"] for color, _ in colors]))
+        items = []
+        for detection, mask, colors in zip(artifacts["detections"], artifacts["masks"], artifacts["colors"]):
+            class_id = detection["class_id"]
+            class_name = CLASS_NAMES.get(class_id, "").lower()
+
+            if class_name == "dress":
+                # For dress, description is always "dress"
+                suffix = "dress"
+                description = "dress"
+            elif class_name == "lower_clothes":
+                suffix = str(class_id)
+                description = " ".join(artifacts["lower_labels"]) if artifacts["lower_labels"] else ""
+            elif class_name == "upper_clothes":
+                suffix = str(class_id)
+                description = " ".join(artifacts["upper_labels"]) if artifacts["upper_labels"] else ""
+            else:
+                suffix = str(class_id)
+                description = ""
+
+            items.append(SegmentedItem(
+                class_id=class_id,
+                suffix=suffix,
+                category=CATEGORY_MAP.get(CLASS_NAMES.get(class_id, ""), ""),
+                description=description,
+                colors=[color for color, _ in colors],
+                color_weights=[round(weight, 4) for _, weight in colors],
+                color_names=[next(all_names) for _ in colors],
+                mask=mask,
+                image=np.where(mask[:, :, None] == 1, bg_removed_img, 255).astype(np.uint8),
+            ))
+        return {"items": items}
+
+    def _run_pipeline(self, batch):
+        """
+        Run PIPELINE_STAGES over a batch of (artifacts, filename) pairs.
+
+        Stages with a _batch_<name> method (the model stages) run once for
+        all images still in flight; the others fan out per image. A batched
+        stage's time is split evenly across its images.
+
+        Returns:
+            list: One result dict per input, in order
+        """
+        runs = [{"artifacts": artifacts, "filename": filename, "timer": StageTimer(), "error": None,
+                 "failed_stages": [], "active": True}
+                for artifacts, filename in batch]
+
+        for name, _, outputs, optional in PIPELINE_STAGES:
+            active = [run for run in runs if run["active"]]
+            if not active:
+                break
+
+            batch_method = getattr(self, f"_batch_{name}", None) if len(active) > 1 else None
+            if batch_method is not None:
+                stage_start = time.perf_counter()
                 try:
-                    logger.debug("Running YOLOv8 segmentation for full processing")
-                    results = self.model_seg.predict(bg_removed_img, conf=0.5, iou=0.5)
-                    if not (results and results[0].masks and results[0].masks.data is not None):
-                        logger.warning("No segmentation masks detected")
-                        return
-                    
-                    for i, (mask_tensor, class_id_tensor) in enumerate(zip(results[0].masks.data, results[0].boxes.cls)):
-                        class_id = int(class_id_tensor.item())
-                        mask_np = mask_tensor.cpu().numpy().astype(np.float32)
-                        soft_mask = cv2.resize(mask_np, (bg_removed_img.shape[1], bg_removed_img.shape[0]),
-                                                 interpolation=cv2.INTER_NEAREST)
-                        soft_mask = np.clip(soft_mask, 0, 1)
-                        logger.debug(f"Applying DenseCRF refinement for mask {i+1}")
-                        refined_mask = self.apply_crf(soft_mask, bg_removed_img, iterations=5)
-                        smoothed_mask = cv2.GaussianBlur(refined_mask.astype(np.float32), (17, 17), 0)
-                        smoothed_mask = np.where(smoothed_mask > 0.5, 1, 0).astype(np.uint8)
-                        cleaned_mask = self.keep_largest_connected_component(smoothed_mask)
-                        segmented_output = np.where(cleaned_mask[:, :, None] == 1, bg_removed_img, 255)
-                        
-                        seg_filename = f"{index:02d}_{class_id}.jpg"
-                        seg_output_path = os.path.join(self.images_output_dir, seg_filename)
-                        cv2.imwrite(seg_output_path, segmented_output)
-                        logger.info(f"Saved segmentation as {seg_filename} (class: {CLASS_NAMES.get(class_id, class_id)})")
-                        
-                        colors = self.get_dominant_colors(bg_removed_img, cleaned_mask)
-                        
-                        # Create metadata JSON file
-                        if CLASS_NAMES.get(class_id, "").lower() == "dress":
-                            # For dress, description is always "dress"
-                            description = "dress"
-                        elif CLASS_NAMES.get(class_id, "").lower() == "lower_clothes":
-                            description = " ".join(lower_clothes_labels) if lower_clothes_labels else ""
-                        elif CLASS_NAMES.get(class_id, "").lower() == "upper_clothes":
-                            description = " ".join(upper_clothes_labels) if upper_clothes_labels else ""
-                        else:
-                            description = ""
-                        
-                        metadata = {
-                            "filename": seg_filename,
-                            "category": CATEGORY_MAP.get(CLASS_NAMES.get(class_id, ""), ""),
-                            "colors": colors if colors else [],
-                            "description": description
-                        }
-                        
-                        metadata_filename = f"{index:02d}_{class_id}.json"
-                        metadata_path = os.path.join(self.images_output_dir, metadata_filename)
-                        with open(metadata_path, 'w') as f:
-                            json.dump(metadata, f, indent=2)
-                        logger.info(f"Saved metadata file {metadata_filename}")
+                    produced = batch_method([run["artifacts"] for run in active])
                 except Exception as e:
-                    logger.error(f"Error during segmentation processing: {str(e)}")
-                    logger.debug(traceback.format_exc())
-                    
-                logger.info(f"Completed processing {filename} in {time.time() - start_time:.2f} seconds")
-            except Exception as e:
-                logger.error(f"Unhandled error processing {filename}: {str(e)}")
-                logger.debug(traceback.format_exc())
-        except Exception as e:
-            logger.error(f"Unhandled error processing {filename}: {str(e)}")
-            logger.debug(traceback.format_exc())
+                    for run in active:
+                        self._stage_failed(run, name, outputs, optional, e)
+                else:
+                    share = (time.perf_counter() - stage_start) / len(active)
+                    for run, artifacts in zip(active, produced):
+                        run["artifacts"].update(artifacts)
+                        run["timer"].add(name, share)
+            else:
+                stage = getattr(self, f"_stage_{name}")
+                for run in active:
+                    try:
+                        with run["timer"].stage(name):
+                            run["artifacts"].update(stage(run["artifacts"]))
+                    except Exception as e:
+                        self._stage_failed(run, name, outputs, optional, e)
+
+            if name == "yolov8":
+                for run in active:
+                    if run["active"] and not run["artifacts"]["detections"]:
+                        logger.warning(f"No segmentation masks detected in {run['filename']}")
+                        run["active"] = False
+
+        results = []
+        for run in runs:
+            total = sum(run["timer"].timings.values())
+            logger.info(f"Completed processing {run['filename']} in {total:.2f} seconds")
+            results.append({
+                "filename": run["filename"],
+                "items": run["artifacts"].get("items", []),
+                "timings": dict(run["timer"].timings, total=total),
+                "error": run["error"],
+                "failed_stages": run["failed_stages"],
+            })
+        return results
+
+    def _stage_failed(self, run, name, outputs, optional, error):
+        logger.error(f"Error during {name} stage for {run['filename']}: {str(error)}")
+        logger.debug(traceback.format_exc())
+        run["failed_stages"].append(name)
+        if optional:
+            run["artifacts"].update({output: set() for output in outputs})
+        else:
+            run["error"] = str(error)
+            run["active"] = False
+
+    def process_bytes(self, image_bytes, filename=""):
+        """
+        Process an encoded image held in memory.
+
+        Returns:
+            dict: In-memory SegmentedItem objects under "items" and per-stage
+                timings in seconds; nothing is written to disk
+        """
+        logger.info(f"Processing image {filename or '<bytes>'}")
+        return self._run_pipeline([({"image_bytes": image_bytes}, filename)])[0]
+
+    def process_array(self, image, filename=""):
+        """Process an already decoded BGR image (skips the decode stage)."""
+        logger.info(f"Processing image {filename or '<array>'}")
+        return self._run_pipeline([({"image": image}, filename)])[0]
+
+    def process_batch(self, images):
+        """
+        Process several encoded images, batching the YOLOv8 and YOLOS passes.
+
+        Args:
+            images (list): (filename, image_bytes) pairs
+
+        Returns:
+            list: One process_bytes-style result per image, in order
+        """
+        logger.info(f"Processing batch of {len(images)} images")
+        return self._run_pipeline([({"image_bytes": image_bytes}, filename) for filename, image_bytes in images])
+
+    def process_image(self, image_path, index, sink=None):
+        """
+        Process a single image file and persist the segmented items.
+
+        Args:
+            image_path (str): Path to the image file
+            index (int): Index used as the output filename prefix
+            sink: Where to write the items; defaults to a DiskSink on images_output_dir
+
+        Returns:
+            dict: The written items (metadata plus file paths) and per-stage timings in seconds
+        """
+        filename = os.path.basename(image_path)
+        try:
+            with open(image_path, "rb") as file:
+                image_bytes = file.read()
+        except OSError as e:
+            logger.error(f"Unable to read image: {image_path} ({str(e)})")
+            return {"filename": filename, "items": [], "timings": {}, "error": str(e)}
+
+        result = self.process_bytes(image_bytes, filename)
+        sink = sink or DiskSink(self.images_output_dir)
+        write_start = time.perf_counter()
+        result["items"] = sink.write(result["items"], f"{index:02d}")
+        result["timings"]["write"] = time.perf_counter() - write_start
+        return result
+
+    def process_directory(self, input_dir, batch_size=1):
+        """
+        Process all images in the input directory.
 
-    def process_directory(self, input_dir):
-        """Process all images in the input directory sequentially."""
+        With batch_size > 1 the images are grouped and each group goes
+        through the models in a single batched pass.
+        """
         start_time = time.time()
-        logger.info(f"Starting batch processing of images from {input_dir}")
+        logger.info(f"Starting batch processing of images from {input_dir} (batch size {batch_size})")
         
         try:
             image_files = sorted([f for f in os.listdir(input_dir)
@@ -323,12 +686,211 @@ class ClothingSegmenter:
             
             logger.info(f"Found {len(image_files)} images to process")
             
-            for idx, filename in enumerate(image_files):
-                image_path = os.path.join(input_dir, filename)
-                self.process_image(image_path, idx)
+            if batch_size <= 1:
+                for idx, filename in enumerate(image_files):
+                    image_path = os.path.join(input_dir, filename)
+                    self.process_image(image_path, idx)
+            else:
+                sink = DiskSink(self.images_output_dir)
+                for batch_start in range(0, len(image_files), batch_size):
+                    batch_files = image_files[batch_start:batch_start + batch_size]
+                    images = []
+                    for filename in batch_files:
+                        with open(os.path.join(input_dir, filename), "rb") as file:
+                            images.append((filename, file.read()))
+                    for offset, result in enumerate(self.process_batch(images)):
+                        sink.write(result["items"], f"{batch_start + offset:02d}")
             
-            logger.info(f"Batch processing completed in {time.time() - start_time:.2f} seconds")
-            logger.info(f"Successfully processed {len(image_files)} images")
+            elapsed = time.time() - start_time
+            logger.info(f"Batch processing completed in {elapsed:.2f} seconds")
+            logger.info(f"Successfully processed {len(image_files)} images "
+                        f"({len(image_files) / elapsed:.2f} images/second)")
         except Exception as e:
             logger.critical(f"Critical error during batch processing: {str(e)}")
-            logger.debug(traceback.format_exc()) 
\ No newline at end of file
+            logger.debug(traceback.format_exc())
+
+
+# --- Command-line batch processing -------------------------------------------
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+_worker_segmenter = None
+
+
+def output_prefix(relative_path):
+    """
+    Collision-free output prefix for an input file: its stem plus a hash of
+    its path relative to the input root, so files with the same name in
+    different folders, or handled by different workers, never overwrite each other.
+    """
+    stem = os.path.splitext(os.path.basename(relative_path))[0]
+    digest = hashlib.sha1(relative_path.replace(os.sep, "/").encode("utf-8")).hexdigest()[:10]
+    return f"{stem}_{digest}"
+
+
+def find_images(input_dir):
+    """Return the image files under input_dir (recursively), relative to it."""
+    found = []
+    for root, _, files in os.walk(input_dir):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                found.append(os.path.relpath(os.path.join(root, name), input_dir))
+    return sorted(found)
+
+
+def load_manifest(manifest_path):
+    """
+    Return the relative paths already processed successfully according to the manifest.
+
+    Lines that are not a JSON record with a path (e.g. the truncated last
+    line left by a crash) are skipped, so their images are processed again.
+    """
+    done = set()
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get("status") == "done" and isinstance(record.get("path"), str):
+                done.add(record["path"])
+    return done
+
+
+def _end_manifest_line(manifest_path):
+    """Terminate a truncated last line so appended records start on a line of their own."""
+    if not os.path.exists(manifest_path) or os.path.getsize(manifest_path) == 0:
+        return
+    with open(manifest_path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def _init_worker(model_path, output_dir, threads, batch_imgsz, refiner, refine_max_side):
+    """Pool initializer: pin the thread count and load the models once per worker."""
+    global _worker_segmenter
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(threads)
+    _worker_segmenter = ClothingSegmenter(model_path, output_dir, batch_imgsz=batch_imgsz,
+                                          refiner=get_refiner(refiner), refine_max_side=refine_max_side)
+
+
+def _process_chunk(task):
+    """Pool task: process a chunk of relative paths and return one manifest record per file."""
+    input_dir, relative_paths = task
+    images = []
+    records = []
+    for relative_path in relative_paths:
+        try:
+            with open(os.path.join(input_dir, relative_path), "rb") as file:
+                images.append((relative_path, file.read()))
+        except OSError as e:
+            records.append({"path": relative_path, "status": "failed", "error": str(e), "outputs": [], "timings": {}})
+
+    results = _worker_segmenter.process_batch(images) if len(images) > 1 else [
+        _worker_segmenter.process_bytes(image_bytes, relative_path) for relative_path, image_bytes in images]
+
+    sink = DiskSink(_worker_segmenter.images_output_dir)
+    for (relative_path, _), result in zip(images, results):
+        try:
+            write_start = time.perf_counter()
+            written = sink.write(result["items"], output_prefix(relative_path))
+            result["timings"]["write"] = time.perf_counter() - write_start
+        except OSError as e:
+            result["error"] = str(e)
+            written = []
+        records.append({
+            "path": relative_path,
+            "status": "failed" if result["error"] else "done",
+            "error": result["error"],
+            "outputs": [os.path.basename(item["image_path"]) for item in written],
+            "timings": result["timings"],
+            "worker": os.getpid(),
+        })
+    return records
+
+
+def summarize_timings(records):
+    """Per-stage p50/p90/p99 latency in seconds over the given manifest records."""
+    per_stage = {}
+    for record in records:
+        for stage, seconds in record["timings"].items():
+            per_stage.setdefault(stage, []).append(seconds)
+    return {
+        stage: {
+            "count": len(values),
+            "p50": float(np.percentile(values, 50)),
+            "p90": float(np.percentile(values, 90)),
+            "p99": float(np.percentile(values, 99)),
+        }
+        for stage, values in per_stage.items()
+    }
+
+
+def run_cli(args):
+    """Process a directory tree with a pool of workers, resuming from the manifest."""
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.output_dir, "manifest.jsonl")
+
+    all_images = find_images(args.input_dir)
+    done = load_manifest(manifest_path)
+    pending = [path for path in all_images if path not in done]
+    logger.info(f"Found {len(all_images)} images, {len(done)} already processed, {len(pending)} to go")
+    if not pending:
+        return []
+
+    workers = max(1, args.workers)
+    threads = args.threads or max(1, (os.cpu_count() or 1) // workers)
+    # Children are spawned, so this reaches torch's and onnxruntime's thread pools before they start
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+    logger.info(f"Starting {workers} workers with {threads} threads each")
+
+    batch_size = max(1, args.batch_size)
+    chunks = [(args.input_dir, pending[i:i + batch_size]) for i in range(0, len(pending), batch_size)]
+    records = []
+    start_time = time.time()
+    _end_manifest_line(manifest_path)
+    context = multiprocessing.get_context("spawn")
+    with open(manifest_path, "a") as manifest, context.Pool(
+            workers, initializer=_init_worker,
+            initargs=(args.model, args.output_dir, threads, args.imgsz,
+                      args.refiner, args.refine_max_side)) as pool:
+        for chunk_records in pool.imap_unordered(_process_chunk, chunks):
+            for record in chunk_records:
+                manifest.write(json.dumps(record) + "\n")
+                records.append(record)
+            manifest.flush()
+            logger.info(f"Processed {len(records)}/{len(pending)} images")
+
+    elapsed = time.time() - start_time
+    succeeded = sum(1 for record in records if record["status"] == "done")
+    logger.info(f"Processed {len(records)} images ({succeeded} succeeded) in {elapsed:.2f} seconds "
+                f"({len(records) / elapsed:.2f} images/second)")
+    for stage, stats in summarize_timings([r for r in records if r["status"] == "done"]).items():
+        logger.info(f"  {stage:<12} p50 {stats['p50']:.3f}s  p90 {stats['p90']:.3f}s  p99 {stats['p99']:.3f}s")
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Segment the clothing in every image of a directory tree.")
+    parser.add_argument("input_dir", help="Directory searched recursively for images")
+    parser.add_argument("output_dir", help="Directory for segmented images, metadata and the manifest")
+    parser.add_argument("--model", required=True, help="Path to the YOLOv8 segmentation weights")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Torch threads per worker (default: CPU count divided by workers)")
+    parser.add_argument("--batch-size", type=int, default=1, help="Images per batched model pass")
+    parser.add_argument("--imgsz", type=int, default=640, help="YOLOv8 letterbox size for batches")
+    parser.add_argument("--refiner", choices=sorted(REFINERS), default="densecrf",
+                        help="Mask refinement backend")
+    parser.add_argument("--refine-max-side", type=int, default=768,
+                        help="Longest side of the region a mask is refined at")
+    parser.add_argument("--manifest", help="JSONL manifest path (default: <output_dir>/manifest.jsonl)")
+    run_cli(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
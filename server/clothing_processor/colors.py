@@ -0,0 +1,123 @@
+import numpy as np
+
+# sRGB (D65) <-> CIE XYZ
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ)
+_WHITE_D65 = np.array([0.95047, 1.0, 1.08883])
+_DELTA = 6 / 29
+
+# Lab histogram bin sizes (L in 0..100, a/b in -128..127)
+L_BIN = 5
+AB_BIN = 8
+
+
+def srgb_to_lab(rgb):
+    """Convert sRGB values in 0..255 (array of shape (..., 3)) to CIE Lab."""
+    c = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _RGB_TO_XYZ.T / _WHITE_D65
+    f = np.where(xyz > _DELTA ** 3, np.cbrt(xyz), xyz / (3 * _DELTA ** 2) + 4 / 29)
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+
+def lab_to_srgb(lab):
+    """Convert CIE Lab values (array of shape (..., 3)) to sRGB in 0..255 (uint8)."""
+    lab = np.asarray(lab, dtype=np.float64)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+    xyz = np.where(f > _DELTA, f ** 3, 3 * _DELTA ** 2 * (f - 4 / 29)) * _WHITE_D65
+    linear = np.clip(xyz @ _XYZ_TO_RGB.T, 0, 1)
+    c = np.where(linear <= 0.0031308, linear * 12.92, 1.055 * linear ** (1 / 2.4) - 0.055)
+    return np.clip(np.round(c * 255), 0, 255).astype(np.uint8)
+
+
+def rgb_to_hex(rgb):
+    return '#{:02x}{:02x}{:02x}'.format(*(int(v) for v in rgb))
+
+
+def _weighted_kmeans(points, weights, k, rng, iterations=20):
+    """Small weighted k-means with k-means++ seeding; returns (centers, labels)."""
+    k = min(k, len(points))
+    probabilities = weights / weights.sum()
+    centers = [points[rng.choice(len(points), p=probabilities)]]
+    for _ in range(1, k):
+        distances = ((points[:, None, :] - np.array(centers)[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        scores = weights * distances
+        if scores.sum() == 0:
+            break
+        centers.append(points[rng.choice(len(points), p=scores / scores.sum())])
+    centers = np.array(centers)
+
+    for _ in range(iterations):
+        labels = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        cluster_weights = np.bincount(labels, weights=weights, minlength=len(centers))
+        new_centers = centers.copy()
+        for channel in range(points.shape[1]):
+            sums = np.bincount(labels, weights=weights * points[:, channel], minlength=len(centers))
+            filled = cluster_weights > 0
+            new_centers[filled, channel] = sums[filled] / cluster_weights[filled]
+        if np.allclose(new_centers, centers, atol=1e-3):
+            centers = new_centers
+            break
+        centers = new_centers
+
+    labels = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    return centers, labels
+
+
+def extract_dominant_colors(image, mask=None, k=3, max_pixels=20000, seed=0, channel_order='bgr',
+                            exclude_above=None):
+    """
+    Extract the dominant colors of the masked region of an image.
+
+    The pixels are subsampled to at most max_pixels and converted to CIE Lab.
+    They are binned into a coarse Lab histogram, and a small weighted k-means
+    runs on the bin means. The cost is bounded whatever the image size, and a
+    fixed seed makes the result reproducible.
+
+    Args:
+        image (np.ndarray): HxWx3 uint8 image
+        mask (np.ndarray): Optional HxW mask; non-zero pixels are used
+        k (int): Number of colors to return at most
+        max_pixels (int): Pixel budget for the clustering
+        seed (int): Seed for subsampling and k-means++ initialization
+        channel_order (str): 'bgr' (OpenCV) or 'rgb'
+        exclude_above (int): Ignore pixels with any channel at or above this
+            value (e.g. the white background of a segmented image)
+
+    Returns:
+        list: (hex_color, weight) pairs sorted by weight, weights summing to 1
+    """
+    pixels = image[mask > 0] if mask is not None else image.reshape(-1, 3)
+    if exclude_above is not None and len(pixels):
+        pixels = pixels[np.all(pixels < exclude_above, axis=1)]
+    if len(pixels) == 0:
+        return []
+
+    rng = np.random.default_rng(seed)
+    if len(pixels) > max_pixels:
+        pixels = pixels[rng.choice(len(pixels), max_pixels, replace=False)]
+    if channel_order == 'bgr':
+        pixels = pixels[:, ::-1]
+
+    lab = srgb_to_lab(pixels)
+    bins = (np.floor(lab[:, 0] / L_BIN).astype(np.int64) * 1024
+            + np.floor((lab[:, 1] + 128) / AB_BIN).astype(np.int64) * 32
+            + np.floor((lab[:, 2] + 128) / AB_BIN).astype(np.int64))
+    _, inverse, counts = np.unique(bins, return_inverse=True, return_counts=True)
+    bin_means = np.stack([np.bincount(inverse, weights=lab[:, c]) / counts for c in range(3)], axis=1)
+
+    centers, labels = _weighted_kmeans(bin_means, counts.astype(np.float64), k, rng)
+    shares = np.bincount(labels, weights=counts, minlength=len(centers)) / counts.sum()
+
+    order = np.argsort(-shares, kind='stable')
+    rgb = lab_to_srgb(centers[order])
+    return [(rgb_to_hex(color), float(share)) for color, share in zip(rgb, shares[order]) if share > 0]
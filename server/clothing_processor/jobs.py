@@ -0,0 +1,229 @@
+import os
+import logging
+import signal
+import socket
+import time
+import traceback
+import multiprocessing
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+from main.metrics import metrics
+from .models import ProcessingJob
+
+logger = logging.getLogger(__name__)
+
+JOB_SECONDS = metrics.histogram(
+    'clothing_processing_job_seconds',
+    'Run time of processing jobs by final status',
+    ['status'],
+)
+JOB_QUEUE_WAIT_SECONDS = metrics.histogram(
+    'clothing_processing_job_queue_wait_seconds',
+    'Time processing jobs spent queued before a worker claimed them',
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+
+
+def job_counts():
+    """Number of jobs per status, for the queue depth gauge."""
+    counts = dict(ProcessingJob.objects
+                  .filter(status__in=[ProcessingJob.STATUS_QUEUED, ProcessingJob.STATUS_RUNNING])
+                  .values_list('status')
+                  .annotate(count=Count('pk'))
+                  .order_by())
+    return [((job_status,), counts.get(job_status, 0))
+            for job_status in (ProcessingJob.STATUS_QUEUED, ProcessingJob.STATUS_RUNNING)]
+
+
+metrics.gauge_callback(
+    'clothing_processing_jobs',
+    'Processing jobs currently queued or running',
+    ['status'],
+    job_counts,
+)
+
+
+def enqueue_job(user, image_file):
+    """
+    Store an uploaded image and queue it for processing by the worker pool.
+
+    Args:
+        user: Owner of the job
+        image_file: Uploaded file from request.FILES
+
+    Returns:
+        ProcessingJob: The newly queued job
+    """
+    job = ProcessingJob(user=user)
+    job.image.save(image_file.name, image_file, save=False)
+    job.save()
+    logger.info(f"Queued processing job {job.pk} for user {user.pk}")
+    return job
+
+
+def claim_next_job(worker_name):
+    """
+    Atomically take the oldest queued job and mark it as running.
+
+    Uses SELECT ... FOR UPDATE SKIP LOCKED so several workers can poll
+    the same table without handing out a job twice.
+    """
+    with transaction.atomic():
+        job = (ProcessingJob.objects
+               .select_for_update(skip_locked=True)
+               .filter(status=ProcessingJob.STATUS_QUEUED)
+               .order_by('created_at')
+               .first())
+        if job is None:
+            return None
+        job.status = ProcessingJob.STATUS_RUNNING
+        job.started_at = timezone.now()
+        job.worker = worker_name
+        job.save(update_fields=['status', 'started_at', 'worker'])
+    return job
+
+
+def requeue_running_jobs(stale_after=None):
+    """
+    Put jobs left in the running state by a dead worker back on the queue.
+
+    Only jobs claimed more than stale_after seconds ago (default
+    CLOTHING_PROCESSOR_JOB_TIMEOUT) are requeued, so jobs that workers of
+    other pools or hosts are still running are left alone.
+    """
+    if stale_after is None:
+        stale_after = settings.CLOTHING_PROCESSOR_JOB_TIMEOUT
+    count = (ProcessingJob.objects
+             .filter(status=ProcessingJob.STATUS_RUNNING,
+                     started_at__lt=timezone.now() - timedelta(seconds=stale_after))
+             .update(status=ProcessingJob.STATUS_QUEUED, started_at=None, worker=''))
+    if count:
+        logger.warning(f"Requeued {count} jobs left running for over {stale_after:g} seconds")
+    return count
+
+
+def run_job(job, service):
+    """Run the segmentation pipeline for a claimed job and store the outcome."""
+    from .services import format_processing_result
+
+    start_time = time.time()
+    timings = {'queue_wait': (job.started_at - job.created_at).total_seconds()}
+    try:
+        result = service.process_clothing_item(job.image.path)
+        try:
+            if not result:
+                job.status = ProcessingJob.STATUS_FAILED
+                job.error = 'Failed to process the image'
+            elif not result.get('category') or result['category'] == 'unknown':
+                job.status = ProcessingJob.STATUS_FAILED
+                job.error = 'Could not identify the clothing item. Please try a clearer image.'
+            else:
+                # Stores the segmented images, the workspace is deleted below
+                job.result = format_processing_result(result)
+                job.status = ProcessingJob.STATUS_DONE
+                timings.update(result.get('timings', {}))
+        finally:
+            service.release(result)
+    except Exception as e:
+        logger.error(f"Error running processing job {job.pk}: {str(e)}")
+        logger.error(traceback.format_exc())
+        job.status = ProcessingJob.STATUS_FAILED
+        job.error = str(e)
+
+    timings['total'] = time.time() - start_time
+    job.timings = timings
+    JOB_SECONDS.observe(timings['total'], status=job.status)
+    JOB_QUEUE_WAIT_SECONDS.observe(timings['queue_wait'])
+    job.finished_at = timezone.now()
+
+    # The upload is only needed while the pipeline runs
+    if job.image:
+        job.image.delete(save=False)
+
+    job.save(update_fields=['status', 'result', 'error', 'timings', 'finished_at', 'image'])
+    logger.info(f"Processing job {job.pk} finished with status {job.status} in {timings['total']:.2f} seconds")
+    return job
+
+
+def worker_loop(worker_name, stop_event, poll_interval=1.0):
+    """
+    Poll the job table and process jobs until stop_event is set.
+
+    The models are loaded once when the loop starts (or inherited from the
+    parent when it preloaded them) and reused for every job.
+    """
+    from .registry import registry
+
+    # Let the parent decide when to stop; finish the current job on SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    logger.info(f"Worker {worker_name} starting")
+    try:
+        service = registry.load()
+    except RuntimeError as e:
+        logger.critical(f"Worker {worker_name} could not load the models: {str(e)}")
+        logger.critical(traceback.format_exc())
+        return
+
+    while not stop_event.is_set():
+        try:
+            job = claim_next_job(worker_name)
+        except Exception as e:
+            logger.error(f"Worker {worker_name} failed to claim a job: {str(e)}")
+            connections.close_all()
+            job = None
+
+        if job is None:
+            stop_event.wait(poll_interval)
+            continue
+
+        run_job(job, service)
+
+    connections.close_all()
+    logger.info(f"Worker {worker_name} stopped")
+
+
+def start_worker_pool(num_workers, poll_interval=1.0, preload=True):
+    """
+    Fork num_workers processes running worker_loop and wait for them to exit.
+
+    With preload the parent loads the model weights before forking so the
+    workers share them copy-on-write; each worker creates its own ONNX
+    Runtime sessions when it warms up (see ModelRegistry.prepare_for_fork).
+    Database connections are closed before forking so that each worker
+    opens its own connection instead of sharing the parent's socket.
+    """
+    if preload:
+        from .registry import registry
+        registry.prepare_for_fork()
+
+    # Workers inherit the configured Django process, so always fork
+    context = multiprocessing.get_context('fork')
+    stop_event = context.Event()
+    connections.close_all()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    processes = []
+    for i in range(num_workers):
+        worker_name = f"{socket.gethostname()}:{os.getpid()}:{i}"
+        process = context.Process(
+            target=worker_loop,
+            args=(worker_name, stop_event, poll_interval),
+            name=f"clothing-worker-{i}",
+        )
+        process.start()
+        processes.append(process)
+    logger.info(f"Started {num_workers} processing workers")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        logger.info("Stopping processing workers")
+        stop_event.set()
+        for process in processes:
+            process.join()
@@ -0,0 +1,90 @@
+import os
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from clothing_processor.benchmark import (
+    DEFAULT_RESOLUTIONS, build_corpus, compare_reports, load_report, run_benchmark,
+)
+
+
+def parse_resolution(value):
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise CommandError(f"Invalid resolution '{value}', expected WIDTHxHEIGHT")
+    return width, height
+
+
+class Command(BaseCommand):
+    help = 'Benchmark each clothing pipeline stage (p50/p95 latency and peak memory) and check for regressions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='pipeline_benchmark.json',
+                            help='Where to write the JSON report')
+        parser.add_argument('--images', nargs='*',
+                            default=[os.path.join(settings.MEDIA_ROOT, 'temp'),
+                                     os.path.join(settings.MEDIA_ROOT, 'clothes', 'original')],
+                            help='Directories of sample images (searched recursively)')
+        parser.add_argument('--resolutions', nargs='*', type=parse_resolution,
+                            default=DEFAULT_RESOLUTIONS,
+                            help='Synthetic image sizes, e.g. 640x480 4032x3024')
+        parser.add_argument('--iterations', type=int, default=5,
+                            help='Measured runs per image')
+        parser.add_argument('--warmup', type=int, default=1,
+                            help='Unmeasured runs per image before measuring')
+        parser.add_argument('--trace-allocations', action='store_true',
+                            help='Also report tracemalloc peaks (slows the stages down)')
+        parser.add_argument('--baseline',
+                            help='Compare against this earlier report')
+        parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                            help='Only diff two existing reports')
+        parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Allowed relative p50/p95 slowdown per stage (0.10 = 10%%)')
+        parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                            help='Ignore slowdowns smaller than this many milliseconds')
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            baseline_path, current_path = options['compare']
+            self._check(load_report(baseline_path), load_report(current_path), options)
+            return
+
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        from clothing_processor.registry import registry
+        try:
+            service = registry.get_service()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        corpus = build_corpus(options['images'], options['resolutions'])
+        self.stdout.write(f"Benchmarking {len(corpus)} images x {options['iterations']} iterations "
+                          f"(refiner: {service.segmenter.refiner.name}, backend: {service.backend})")
+        report = run_benchmark(service.segmenter, corpus, iterations=options['iterations'],
+                               warmup=options['warmup'], trace_allocations=options['trace_allocations'])
+        report['environment']['backend'] = service.backend
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self.stdout.write(f"{'stage':<12}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'peak MB':>10}")
+        for stage, row in report['stages'].items():
+            peak = row.get('peak_rss_mb')
+            self.stdout.write(f"{stage:<12}{row['count']:>7}{row['p50_ms']:>11.1f}{row['p95_ms']:>11.1f}"
+                              f"{(f'{peak:.1f}' if peak is not None else '-'):>10}")
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+        if options['baseline']:
+            self._check(load_report(options['baseline']), report, options)
+
+    def _check(self, baseline, current, options):
+        rows, regressions = compare_reports(baseline, current, threshold=options['threshold'],
+                                            min_delta_ms=options['min_delta_ms'])
+        for row in rows:
+            self.stdout.write(f"{row['stage']:<12}{row['metric']:<13}{row['baseline']:>10.1f} -> "
+                              f"{row['current']:>10.1f} ({row['change']:+.1%})")
+        if regressions:
+            names = ', '.join(f"{row['stage']} {row['metric']}" for row in regressions)
+            raise CommandError(f"Performance regression over {options['threshold']:.0%}: {names}")
+        self.stdout.write(self.style.SUCCESS('No stage regressed beyond the threshold'))
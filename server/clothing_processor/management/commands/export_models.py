@@ -0,0 +1,67 @@
+import os
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from clothing_processor.backends import compare_backends, export_models, variant_name
+
+
+class Command(BaseCommand):
+    help = 'Export the YOLOv8 and YOLOS models to ONNX or TorchScript and compare them with eager PyTorch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['onnx', 'torchscript'], default='onnx',
+                            help='Export format')
+        parser.add_argument('--quantize', action='store_true',
+                            help='Apply dynamic int8 quantization')
+        parser.add_argument('--output-dir', default=settings.CLOTHING_PROCESSOR_BACKEND['EXPORT_DIR'],
+                            help='Directory for the exported artifacts and manifest')
+        parser.add_argument('--imgsz', type=int, default=640,
+                            help='YOLOv8 input size')
+        parser.add_argument('--yolos-size', type=int, default=800,
+                            help='Square input size the YOLOS graph is traced at')
+        parser.add_argument('--skip-export', action='store_true',
+                            help='Only run the comparison against an existing export')
+        parser.add_argument('--compare', nargs='*', metavar='IMAGE',
+                            help='Compare latency and outputs with eager PyTorch on these images')
+        parser.add_argument('--runs', type=int, default=3,
+                            help='Timed runs per image in the comparison')
+        parser.add_argument('--report', help='Write the comparison report to this JSON file')
+
+    def handle(self, *args, **options):
+        model_path = os.path.abspath(os.path.join(settings.BASE_DIR, 'server', 'models', 'best.pt'))
+        if not os.path.exists(model_path):
+            raise CommandError(f"Model file not found at: {model_path}")
+        variant = variant_name(options['format'], options['quantize'])
+
+        if not options['skip_export']:
+            try:
+                entry = export_models(model_path, options['output_dir'], options['format'],
+                                      quantize=options['quantize'], imgsz=options['imgsz'],
+                                      yolos_size=options['yolos_size'])
+            except Exception as e:
+                raise CommandError(f"Export failed: {str(e)}")
+            self.stdout.write(f"Segmentation: {entry['segmentation']['artifact']}")
+            self.stdout.write(f"YOLOS: {entry['yolos']['artifact']}")
+            self.stdout.write(self.style.SUCCESS(f"Exported '{variant}' models to {options['output_dir']}"))
+
+        if options['compare'] is None:
+            return
+
+        image_paths = options['compare']
+        if not image_paths:
+            # Default to the wardrobe uploads already in the media directory
+            sample_dir = os.path.join(settings.MEDIA_ROOT, 'clothes', 'original')
+            image_paths = [os.path.join(sample_dir, name) for name in sorted(os.listdir(sample_dir))
+                           if name.lower().endswith(('.jpg', '.jpeg', '.png'))] if os.path.isdir(sample_dir) else []
+        try:
+            report = compare_backends(model_path, options['output_dir'], options['format'],
+                                      options['quantize'], image_paths, runs=options['runs'])
+        except Exception as e:
+            raise CommandError(f"Comparison failed: {str(e)}")
+
+        for key, value in report['summary'].items():
+            self.stdout.write(f"{key}: {value:.3f}")
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['report']}")
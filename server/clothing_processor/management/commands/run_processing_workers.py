@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from clothing_processor.jobs import requeue_running_jobs, start_worker_pool
+
+
+class Command(BaseCommand):
+    help = 'Start a pool of worker processes that run queued clothing processing jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.CLOTHING_PROCESSOR_WORKERS,
+                            help='Number of worker processes to start')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait between polls when the queue is empty')
+        parser.add_argument('--requeue-running', action='store_true',
+                            help='Requeue jobs left running by workers that did not shut down cleanly')
+        parser.add_argument('--stale-after', type=float, default=settings.CLOTHING_PROCESSOR_JOB_TIMEOUT,
+                            help='Only requeue jobs claimed more than this many seconds ago')
+        parser.add_argument('--no-preload', action='store_true',
+                            help='Load the models in each worker instead of once before forking')
+
+    def handle(self, *args, **options):
+        if options['requeue_running']:
+            requeue_running_jobs(options['stale_after'])
+
+        self.stdout.write(f"Starting {options['workers']} processing workers")
+        start_worker_pool(options['workers'], poll_interval=options['poll_interval'],
+                          preload=not options['no_preload'])
+        self.stdout.write(self.style.SUCCESS('Processing workers stopped'))
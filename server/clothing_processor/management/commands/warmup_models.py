@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from clothing_processor.registry import registry
+
+
+class Command(BaseCommand):
+    """
+    Check that the models load and run, and how long that takes.
+
+    Only this command's own process is warmed up: running servers and
+    processing workers warm up their models themselves (gunicorn's post_fork
+    hook, the worker loop), so this does not make them any faster.
+    """
+
+    help = ('Load the clothing processing models and time a warm-up inference in this process '
+            '(a check; it does not warm up running servers or workers)')
+
+    def handle(self, *args, **options):
+        try:
+            registry.load()
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        registry_status = registry.status()
+        if not registry_status['ready']:
+            raise CommandError(f"Warm-up failed: {registry_status['error']}")
+
+        self.stdout.write(f"Models loaded in {registry_status['load_seconds']:.2f} seconds")
+        self.stdout.write(f"Warm-up completed in {registry_status['warmup_seconds']:.2f} seconds")
+        self.stdout.write(self.style.SUCCESS('Clothing processing models are ready'))
@@ -1,3 +1,48 @@
 from django.db import models
+from django.conf import settings
 
-# Create your models here.
+
+class ProcessingJob(models.Model):
+    """A queued run of the clothing segmentation pipeline for one upload."""
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='processing_jobs')
+    image = models.FileField(upload_to='processing_jobs/')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    result = models.JSONField(null=True, blank=True)
+    timings = models.JSONField(default=dict)
+    error = models.TextField(blank=True, default='')
+    worker = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='cp_job_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.pk} ({self.status})"
+
+
+class RateLimitBucket(models.Model):
+    """A user's processing token bucket, shared by every worker process."""
+
+    key = models.CharField(max_length=64, unique=True)
+    tokens = models.FloatField()
+    # time.time() of the last refill
+    updated_at = models.FloatField()
+
+    def __str__(self):
+        return f"Bucket {self.key} ({self.tokens:.2f} tokens)"
@@ -0,0 +1,135 @@
+import gc
+import logging
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Process-wide holder for the clothing processing models.
+
+    Nothing is loaded at import time. The models (YOLOS and its image
+    processor, the YOLOv8 segmentation model and the rembg session) are
+    loaded on first use, or eagerly with load(). Loading before a pre-fork
+    server forks lets every worker share the weights copy-on-write.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._service = None
+        self._loading = False
+        self._warmed_up = False
+        self._error = None
+        self._load_seconds = None
+        self._warmup_seconds = None
+
+    @property
+    def loaded(self):
+        return self._service is not None
+
+    @property
+    def ready(self):
+        return self._service is not None and self._warmed_up
+
+    def get_service(self):
+        """
+        Return the shared ClothingProcessorService, loading it on first use.
+
+        Raises:
+            RuntimeError: If the models could not be loaded
+        """
+        if self._service is None:
+            self.load()
+        return self._service
+
+    def load(self, warmup=True):
+        """Load the models once for this process and optionally warm them up."""
+        with self._lock:
+            if self._service is None:
+                from .services import ClothingProcessorService
+
+                self._loading = True
+                start_time = time.time()
+                try:
+                    logger.info("Loading clothing processing models")
+                    self._service = ClothingProcessorService()
+                    self._error = None
+                    self._load_seconds = time.time() - start_time
+                    logger.info(f"Clothing processing models loaded in {self._load_seconds:.2f} seconds")
+                except Exception as e:
+                    self._error = str(e)
+                    logger.error(f"Failed to load clothing processing models: {str(e)}")
+                    logger.error(traceback.format_exc())
+                    raise RuntimeError(f"Failed to load clothing processing models: {str(e)}")
+                finally:
+                    self._loading = False
+
+        if warmup:
+            self.warmup()
+        return self._service
+
+    def warmup(self):
+        """Run a dummy inference through every model (once per process)."""
+        with self._lock:
+            if self._service is None or self._warmed_up:
+                return
+            try:
+                self._warmup_seconds = self._service.segmenter.warmup()
+                self._warmed_up = True
+            except Exception as e:
+                self._error = str(e)
+                logger.error(f"Model warm-up failed: {str(e)}")
+                logger.error(traceback.format_exc())
+
+    def load_in_background(self):
+        """Start loading in a daemon thread unless loading already started."""
+        with self._lock:
+            if self._service is not None or self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._background_load, name="model-registry-load", daemon=True).start()
+
+    def _background_load(self):
+        try:
+            self.load()
+        except RuntimeError:
+            pass
+        finally:
+            self._loading = False
+
+    def prepare_for_fork(self):
+        """
+        Load the weights in the parent process ahead of forking workers.
+
+        Warm-up is left to each child (see warmup()): running torch inference
+        before fork starts OpenMP thread pools that children cannot reuse.
+        For the same reason no ONNX Runtime session (rembg's u2net, exported
+        ONNX models) is created here; each child opens its own on warm-up
+        or first use, so only the weights are shared.
+        gc.freeze() moves everything loaded so far out of the collector's
+        reach so that garbage collection in the children does not write to,
+        and therefore copy, the pages holding the model objects.
+        """
+        self.load(warmup=False)
+        gc.freeze()
+        logger.info("Models loaded before fork; workers will share them copy-on-write")
+
+    def status(self):
+        """Describe the registry state for the readiness endpoint."""
+        return {
+            'ready': self.ready,
+            'loaded': self.loaded,
+            'warmed_up': self._warmed_up,
+            'loading': self._loading,
+            'load_seconds': self._load_seconds,
+            'warmup_seconds': self._warmup_seconds,
+            'error': self._error,
+            'backend': self._service.backend if self._service else None,
+            'refiner': self._service.segmenter.refiner.stats() if self._service else None,
+        }
+
+
+registry = ModelRegistry()
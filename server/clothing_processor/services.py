@@ -1,8 +1,19 @@
 import os
+import time
+import uuid
+import shutil
 import logging
 import traceback
+from contextlib import nullcontext
 from django.conf import settings
-from .clothing_segmentation import ClothingSegmenter
+from django.core.files import File
+from django.core.files.storage import default_storage
+from main.metrics import metrics
+from .clothing_segmentation import ClothingSegmenter, DiskSink, PIPELINE_VERSION
+from .admission import AdmissionRejected
+from .cache import ResultCache
+from .refinement import get_refiner
+from .backends import load_models
 
 # Configure logging
 logging.basicConfig(
@@ -15,6 +26,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+STAGE_SECONDS = metrics.histogram(
+    'clothing_pipeline_stage_seconds',
+    'Time spent in each clothing pipeline stage',
+    ['stage'],
+)
+STAGE_FAILURES = metrics.counter(
+    'clothing_pipeline_stage_failures_total',
+    'Pipeline stages that raised (optional stages continue with empty output)',
+    ['stage'],
+)
+PROCESSING_RESULTS = metrics.counter(
+    'clothing_processing_results_total',
+    'Processed uploads by outcome',
+    ['outcome'],
+)
+CACHE_LOOKUPS = metrics.counter(
+    'clothing_processing_cache_lookups_total',
+    'Result cache lookups by outcome',
+    ['result'],
+)
+
+
+def record_pipeline_metrics(timings, failed_stages=()):
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    for stage in failed_stages:
+        STAGE_FAILURES.inc(stage=stage)
+
+
 class ClothingProcessorService:
     def __init__(self):
         """Initialize the clothing processor service."""
@@ -33,9 +73,45 @@ class ClothingProcessorService:
         os.makedirs(self.output_dir, exist_ok=True)
         logger.info(f"Output directory: {self.output_dir}")
         
+        backend_settings = settings.CLOTHING_PROCESSOR_BACKEND
+        model_seg, model_yolos, self.backend = load_models(
+            model_path,
+            backend_settings['EXPORT_DIR'],
+            backend_settings['FORMAT'],
+            quantized=backend_settings['QUANTIZED'],
+            threads=backend_settings.get('THREADS'),
+        )
+        logger.info(f"Inference backend: {self.backend}")
+        
+        cache_settings = settings.CLOTHING_PROCESSOR_CACHE
+        if cache_settings['ENABLED']:
+            # Results depend on the pipeline code, the weights file and the inference backend
+            model_stat = os.stat(model_path)
+            version = f"{PIPELINE_VERSION}:{model_stat.st_size}:{int(model_stat.st_mtime)}:{self.backend}"
+            self.cache = ResultCache(
+                cache_settings['DIR'],
+                version,
+                max_entries=cache_settings['MAX_ENTRIES'],
+                max_bytes=cache_settings['MAX_BYTES'],
+                max_age=cache_settings['MAX_AGE'],
+                memory_entries=cache_settings['MEMORY_ENTRIES'],
+            )
+            logger.info(f"Result cache: {cache_settings['DIR']} (version {version})")
+        else:
+            self.cache = None
+        
         try:
             logger.info("Initializing ClothingSegmenter")
-            self.segmenter = ClothingSegmenter(model_path, self.output_dir)
+            refiner_settings = settings.CLOTHING_MASK_REFINER
+            self.segmenter = ClothingSegmenter(
+                model_path,
+                self.output_dir,
+                refiner=get_refiner(refiner_settings['BACKEND'], **refiner_settings.get('OPTIONS', {})),
+                refine_max_side=refiner_settings['MAX_SIDE'],
+                roi_padding=refiner_settings['PADDING'],
+                model_seg=model_seg,
+                model_yolos=model_yolos,
+            )
             logger.info("ClothingSegmenter initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize ClothingSegmenter: {str(e)}")
@@ -44,59 +120,178 @@ class ClothingProcessorService:
 
     def process_clothing_item(self, image_path, index=0):
         """
-        Process a single clothing item image.
+        Process a single clothing item image file.
         
         Args:
             image_path (str): Path to the image file
             index (int): Index for the output filename
             
         Returns:
-            dict: Processing results including segmented image path and metadata
+            dict: Processing results including segmented image path, metadata
+                and per-stage timings
         """
         try:
-            # Process the image using the segmenter
-            self.segmenter.process_image(image_path, index)
-            
-            # Get the base filename without extension
-            base_name = f"{index:02d}"
-            
-            # Look for the generated files
-            segmented_files = []
-            metadata_files = []
+            with open(image_path, 'rb') as f:
+                image_bytes = f.read()
+        except OSError as e:
+            logger.error(f"Error reading clothing item image: {str(e)}")
+            return None
+        
+        result = self.process_clothing_bytes(image_bytes, os.path.basename(image_path), index)
+        if result:
+            result['original_image'] = image_path
+        return result
+
+    def new_workspace(self):
+        """Create a unique directory for one processing run's outputs."""
+        workspace = os.path.join(self.output_dir, time.strftime('%Y/%m/%d'), uuid.uuid4().hex)
+        os.makedirs(workspace)
+        return workspace
+
+    def release(self, result):
+        """
+        Delete a result's workspace once its consumer has copied what it
+        needs. Results served from or stored in the cache have none left.
+        """
+        workspace = result.get('workspace') if result else None
+        if workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    def process_clothing_bytes(self, image_bytes, name='', index=0, idempotency_key=None, scope='', admission=None):
+        """
+        Process an uploaded clothing item image held in memory.
+        
+        The pipeline runs on the bytes directly and every segmented item is
+        written to a workspace directory unique to this run. Results are
+        looked up in the content-addressed cache first, and a client
+        idempotency key (scoped, e.g. by user id) maps to the same entry.
+        New results are always stored under the content hash, which the
+        idempotency key is then bound to. Only a cache miss enters the
+        admission context, so cached results never take a pipeline slot
+        or a rate limit token.
+        
+        Args:
+            image_bytes (bytes): Encoded image
+            name (str): Original filename, for logging
+            index (int): Index for the output filename
+            idempotency_key (str): Optional client-supplied idempotency key
+            scope (str): Namespace for the idempotency key
+            admission: Optional context manager held while the pipeline
+                runs, e.g. AdmissionController.admit(user_key)
             
-            # Check for both dress and other clothing items
-            for suffix in ['_dress', '_0', '_1', '_2']:
-                seg_path = os.path.join(self.output_dir, f"{base_name}{suffix}.jpg")
-                meta_path = os.path.join(self.output_dir, f"{base_name}{suffix}.json")
-                
-                if os.path.exists(seg_path) and os.path.exists(meta_path):
-                    segmented_files.append(seg_path)
-                    metadata_files.append(meta_path)
+        Returns:
+            dict: The first garment's segmented image path, category and
+                metadata, all garments under 'items', the run's workspace
+                (if the result could not be cached; pass the result to
+                release() when done with its files) and per-stage timings
+        
+        Raises:
+            AdmissionRejected: If admission refused to run the pipeline
+        """
+        content_key = None
+        if self.cache:
+            lookup_start = time.perf_counter()
+            content_key = self.cache.key_for(image_bytes)
+            bound_key = self.cache.resolve_idempotency_key(scope, idempotency_key) if idempotency_key else None
+            # The bound entry may have been evicted; fall back to the bytes
+            cache_key, cached = self.cache.lookup(dict.fromkeys(key for key in (bound_key, content_key) if key))
+            CACHE_LOOKUPS.inc(result='hit' if cached else 'miss')
+            if cached:
+                cached['timings'] = {'cache_lookup': time.perf_counter() - lookup_start}
+                record_pipeline_metrics(cached['timings'])
+                PROCESSING_RESULTS.inc(outcome='cached')
+                if idempotency_key:
+                    self.cache.bind_idempotency_key(scope, idempotency_key, cache_key)
+                logger.info(f"Serving cached result for {name or cache_key}")
+                return cached
+        
+        workspace = None
+        try:
+            with admission or nullcontext():
+                run = self.segmenter.process_bytes(image_bytes, name)
             
-            if not segmented_files or not metadata_files:
-                logger.error("No segmented images or metadata files were generated")
+            if not run['items']:
+                logger.error("No segmented items were produced")
+                record_pipeline_metrics(run['timings'], run['failed_stages'])
+                PROCESSING_RESULTS.inc(outcome='error' if run['error'] else 'no_items')
                 return None
             
-            # For now, we'll just use the first segmented item
-            # In the future, you might want to handle multiple items differently
-            with open(metadata_files[0], 'r') as f:
-                import json
-                metadata = json.load(f)
+            # Every run writes into its own workspace so concurrent requests,
+            # threads and worker processes never overwrite each other's files
+            workspace = self.new_workspace()
+            write_start = time.perf_counter()
+            written = DiskSink(workspace).write(run['items'], f"{index:02d}")
+            run['timings']['write'] = time.perf_counter() - write_start
+            record_pipeline_metrics(run['timings'], run['failed_stages'])
+            PROCESSING_RESULTS.inc(outcome='processed')
             
-            # Update the metadata with the actual file paths
-            result = {
-                'original_image': image_path,
-                'segmented_image': segmented_files[0],
-                'category': metadata.get('category', ''),
-                'metadata': {
-                    'colors': metadata.get('colors', []),
-                    'description': metadata.get('description', ''),
+            items = [
+                {
+                    'segmented_image': entry['image_path'],
+                    'category': item.category,
+                    'metadata': {
+                        'colors': item.colors,
+                        'color_weights': item.color_weights,
+                        'color_names': item.color_names,
+                        'description': item.description,
+                    },
                 }
-            }
+                for item, entry in zip(run['items'], written)
+            ]
+            # The first garment stays the primary result for existing clients
+            result = dict(items[0], original_image=name, workspace=workspace, items=items, timings=run['timings'])
+            
+            if self.cache:
+                cached = self.cache.put(content_key, result)
+                if 'workspace' not in cached:
+                    # Every garment was copied into the cache entry
+                    self.release(result)
+                result = dict(cached, timings=run['timings'])
+                if idempotency_key:
+                    self.cache.bind_idempotency_key(scope, idempotency_key, content_key)
             
             logger.info(f"Successfully processed clothing item: {result}")
             return result
             
+        except AdmissionRejected:
+            raise
         except Exception as e:
             logger.error(f"Error processing clothing item: {str(e)}")
-            return None 
\ No newline at end of file
+            PROCESSING_RESULTS.inc(outcome='error')
+            if workspace:
+                shutil.rmtree(workspace, ignore_errors=True)
+            return None
+
+
+def _store_segmented_image(path):
+    """Copy a segmented image into media storage and return its URL."""
+    with open(path, 'rb') as f:
+        name = default_storage.save(f"processed_clothes/results/{os.path.basename(path)}", File(f))
+    return default_storage.url(name)
+
+
+def _format_garment(garment, segmented_image_url):
+    return {
+        'category': garment['category'],
+        'metadata': {
+            'colors': garment['metadata']['colors'],
+            'color_weights': garment['metadata'].get('color_weights', []),
+            'color_names': garment['metadata'].get('color_names', []),
+            'description': garment['metadata']['description']
+        },
+        'segmented_image_url': segmented_image_url
+    }
+
+
+def format_processing_result(result):
+    """
+    Shape a process_clothing_item result into the API response payload.
+
+    The segmented images are copied into media storage first, since the
+    workspace or cache entry the result points at does not outlive the
+    request. Call this before releasing the result.
+    """
+    garments = result.get('items', [result])
+    # Every detected garment, the first one being the top-level fields
+    items = [_format_garment(garment, _store_segmented_image(garment['segmented_image'])) for garment in garments]
+    return dict(items[0], items=items)
@@ -1,3 +1,843 @@
-from django.test import TestCase
+import os
+import time
+import shutil
+import tempfile
+import json
+import threading
+from argparse import Namespace
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.models import User
+from . import backends
+from .admission import AdmissionController, AdmissionRejected, SharedTokenBuckets, TokenBuckets
+from .cache import ResultCache
+from . import clothing_segmentation
+from .clothing_segmentation import SegmentedItem, load_manifest, output_prefix, run_cli
+from .color_names import NAMED_COLORS, name_color, name_colors
+from .colors import extract_dominant_colors, lab_to_srgb, srgb_to_lab
+from .jobs import claim_next_job, enqueue_job, requeue_running_jobs, run_job
+from .models import ProcessingJob
+from .refinement import mask_roi, unletterbox_mask
+from .registry import registry
+from .services import ClothingProcessorService
+
+
+def letterbox(mask, size):
+    """Pad a mask into a size x size square the way ultralytics letterboxes its input."""
+    h, w = mask.shape
+    gain = min(size / h, size / w)
+    new_w, new_h = int(round(w * gain)), int(round(h * gain))
+    resized = cv2.resize(mask, (new_w, new_h), interpolation=cv2.INTER_NEAREST)
+    dw, dh = (size - new_w) / 2, (size - new_h) / 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    return cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=0)
+
+
+class _Tensor:
+    def __init__(self, value):
+        self.value = value
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.value
+
+    def item(self):
+        return self.value
+
+
+class _Result:
+    """The parts of an ultralytics Results object _parse_segmentation reads."""
+
+    def __init__(self, masks, class_ids, orig_shape):
+        self.masks = type('Masks', (), {'data': [_Tensor(mask) for mask in masks]})()
+        self.boxes = type('Boxes', (), {'cls': [_Tensor(class_id) for class_id in class_ids]})()
+        self.orig_shape = orig_shape
+
+
+class LetterboxMaskTests(SimpleTestCase):
+    """Masks of a mixed-size batch must map back onto each photo without squeeze or offset."""
+
+    # (height, width) of the photos and the garment box (x0, y0, x1, y1) in each
+    FIXTURES = [
+        ((480, 640), (160, 120, 480, 400)),
+        ((900, 300), (50, 300, 250, 800)),
+        ((512, 512), (100, 100, 300, 400)),
+    ]
+    BATCH_IMGSZ = 160
+
+    def garment_mask(self, shape, box):
+        mask = np.zeros(shape, dtype=np.float32)
+        x0, y0, x1, y1 = box
+        mask[y0:y1, x0:x1] = 1
+        return mask
+
+    def assert_box_close(self, actual, expected, tolerance):
+        for a, e in zip(actual, expected):
+            self.assertLessEqual(abs(a - e), tolerance, f"{actual} != {expected}")
+
+    def test_unletterbox_keeps_the_photo_aspect_ratio(self):
+        for shape, box in self.FIXTURES:
+            padded = letterbox(self.garment_mask(shape, box), self.BATCH_IMGSZ)
+            self.assertEqual(padded.shape, (self.BATCH_IMGSZ, self.BATCH_IMGSZ))
+            mask = unletterbox_mask(padded, shape)
+            self.assertAlmostEqual(mask.shape[1] / mask.shape[0], shape[1] / shape[0], delta=0.02)
+
+    def test_roi_of_unletterboxed_mask_matches_the_garment(self):
+        for shape, box in self.FIXTURES:
+            padded = letterbox(self.garment_mask(shape, box), self.BATCH_IMGSZ)
+            mask = unletterbox_mask(padded, shape)
+            _, image_box = mask_roi(mask, shape, padding=0.0, min_padding=0)
+            # One low-res pixel of rounding either way
+            tolerance = max(shape) / self.BATCH_IMGSZ * 1.5
+            self.assert_box_close(image_box, box, tolerance)
+
+    def test_unpadded_mask_is_unchanged(self):
+        mask = np.ones((120, 160), dtype=np.float32)
+        self.assertEqual(unletterbox_mask(mask, (480, 640)).shape, (120, 160))
+
+    def test_parse_segmentation_removes_padding_per_image(self):
+        from .clothing_segmentation import CLASS_NAMES, ClothingSegmenter
+
+        class_id = next(k for k, v in CLASS_NAMES.items() if v.lower() != 'dress')
+        for shape, box in self.FIXTURES:
+            padded = letterbox(self.garment_mask(shape, box), self.BATCH_IMGSZ)
+            parsed = ClothingSegmenter._parse_segmentation(None, _Result([padded], [class_id], shape))
+            mask = parsed['detections'][0]['mask']
+            _, image_box = mask_roi(mask, shape, padding=0.0, min_padding=0)
+            self.assert_box_close(image_box, box, max(shape) / self.BATCH_IMGSZ * 1.5)
+
+
+class DominantColorTests(SimpleTestCase):
+    """Dominant colors of a synthetic two-color image, in OpenCV's BGR order."""
+
+    def setUp(self):
+        # Three quarters navy, one quarter red
+        self.image = np.zeros((40, 40, 3), np.uint8)
+        self.image[:30] = (128, 0, 0)
+        self.image[30:] = (0, 0, 255)
+
+    def test_colors_and_weights(self):
+        self.assertEqual(extract_dominant_colors(self.image, k=3), [('#000080', 0.75), ('#ff0000', 0.25)])
+
+    def test_mask_selects_the_pixels(self):
+        mask = np.zeros((40, 40), np.uint8)
+        mask[25:] = 255
+        colors = extract_dominant_colors(self.image, mask, k=3)
+        self.assertEqual([color for color, _ in colors], ['#ff0000', '#000080'])
+        self.assertAlmostEqual(colors[0][1], 2 / 3)
+
+    def test_repeat_runs_are_identical(self):
+        noisy = np.clip(self.image.astype(np.int16) + np.random.default_rng(1).integers(-20, 20, self.image.shape),
+                        0, 255).astype(np.uint8)
+        runs = [extract_dominant_colors(noisy, k=3, max_pixels=500) for _ in range(3)]
+        self.assertEqual(runs[0], runs[1])
+        self.assertEqual(runs[0], runs[2])
+        self.assertAlmostEqual(sum(weight for _, weight in runs[0]), 1.0)
+
+
+class ColorNameTests(SimpleTestCase):
+    """Lab conversion and nearest palette names."""
+
+    def test_lab_reference_values(self):
+        lab = srgb_to_lab([[255, 255, 255], [255, 0, 0], [0, 0, 0]])
+        np.testing.assert_allclose(lab, [[100.0, 0.0, 0.0], [53.24, 80.09, 67.20], [0.0, 0.0, 0.0]], atol=0.01)
+        np.testing.assert_array_equal(lab_to_srgb(lab), [[255, 255, 255], [255, 0, 0], [0, 0, 0]])
+
+    def test_palette_colors_name_themselves(self):
+        names, hex_colors = zip(*NAMED_COLORS)
+        self.assertEqual(name_colors(list(hex_colors)), list(names))
+
+    def test_nearest_names(self):
+        self.assertEqual(
+            name_colors(['#fefefe', '#7f7f7f', '#0a0a85', '#c8102e', '#2b2b2b', '#4a5d23']),
+            ['white', 'gray', 'dark blue', 'crimson', 'black', 'dark olive green'],
+        )
+        self.assertEqual(name_color('#ff0001'), 'red')
+        self.assertEqual(name_colors([]), [])
+
+
+class ResultCacheTests(SimpleTestCase):
+    """put copies every garment out of the run's workspace; get and evict behave as an LRU."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.cache = ResultCache(os.path.join(self.root, 'cache'), 'v1', memory_entries=0)
+
+    def make_result(self, garments=2):
+        workspace = tempfile.mkdtemp(dir=self.root)
+        items = []
+        for i in range(garments):
+            path = os.path.join(workspace, f"item_{i}.jpg")
+            with open(path, 'wb') as f:
+                f.write(f"garment {i}".encode())
+            items.append({'segmented_image': path, 'category': 'shirt', 'metadata': {'colors': [[i, i, i]]}})
+        return dict(items[0], original_image='photo.jpg', workspace=workspace, items=items)
+
+    def test_put_copies_every_garment_into_the_entry(self):
+        result = self.make_result()
+        key = self.cache.key_for(b'photo')
+        cached = self.cache.put(key, result)
+        shutil.rmtree(result['workspace'])
+
+        self.assertNotIn('workspace', cached)
+        self.assertEqual(cached['segmented_image'], cached['items'][0]['segmented_image'])
+        for i, item in enumerate(self.cache.get(key)['items']):
+            self.assertTrue(item['segmented_image'].startswith(self.cache.cache_dir))
+            with open(item['segmented_image'], 'rb') as f:
+                self.assertEqual(f.read(), f"garment {i}".encode())
+
+    def test_missing_garment_file_is_a_miss(self):
+        key = self.cache.key_for(b'photo')
+        cached = self.cache.put(key, self.make_result())
+        os.remove(cached['items'][1]['segmented_image'])
+        self.assertIsNone(self.cache.get(key))
+
+    def test_key_depends_on_pipeline_version(self):
+        other = ResultCache(os.path.join(self.root, 'cache'), 'v2')
+        self.assertNotEqual(self.cache.key_for(b'photo'), other.key_for(b'photo'))
+
+    def test_idempotency_key_binding(self):
+        key = self.cache.key_for(b'photo')
+        self.assertIsNone(self.cache.resolve_idempotency_key('user-1', 'retry-1'))
+        self.cache.bind_idempotency_key('user-1', 'retry-1', key)
+        self.assertEqual(self.cache.resolve_idempotency_key('user-1', 'retry-1'), key)
+        self.assertIsNone(self.cache.resolve_idempotency_key('user-2', 'retry-1'))
+
+    def test_fallback_lookup_counts_once(self):
+        content_key = self.cache.key_for(b'photo')
+        stale_key = self.cache.key_for(b'evicted photo')
+        self.assertEqual(self.cache.lookup([stale_key, content_key]), (None, None))
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+        self.cache.put(content_key, self.make_result(garments=1))
+        key, result = self.cache.lookup([stale_key, content_key])
+        self.assertEqual(key, content_key)
+        self.assertIsNotNone(result)
+        self.assertEqual((self.cache.stats()['hits'], self.cache.stats()['misses']), (1, 1))
+
+    def test_evict_drops_least_recently_used(self):
+        self.cache.max_entries = 2
+        keys = [self.cache.key_for(f"photo {i}".encode()) for i in range(3)]
+        for age, key in zip((30, 20, 10), keys):
+            self.cache.put(key, self.make_result(garments=1))
+            past = time.time() - age
+            os.utime(self.cache._entry_dir(key), (past, past))
+
+        # A hit on the oldest entry makes the middle one least recently used
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+
+    def test_evict_drops_expired_entries(self):
+        key = self.cache.key_for(b'photo')
+        self.cache.put(key, self.make_result(garments=1))
+        past = time.time() - self.cache.max_age - 1
+        os.utime(self.cache._entry_dir(key), (past, past))
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertIsNone(self.cache.get(key))
+
+
+class BackendSelectionTests(SimpleTestCase):
+    """Exported models are used only when the manifest matches the current weights."""
+
+    def setUp(self):
+        self.export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_dir, ignore_errors=True)
+        self.model_path = os.path.join(self.export_dir, 'best.pt')
+        with open(self.model_path, 'wb') as f:
+            f.write(b'weights')
+        yolo = mock.patch.object(backends, 'YOLO', return_value=mock.sentinel.model_seg)
+        self.yolo = yolo.start()
+        self.addCleanup(yolo.stop)
+        load_yolos = mock.patch.object(backends, '_load_yolos', return_value=mock.sentinel.model_yolos)
+        self.load_yolos = load_yolos.start()
+        self.addCleanup(load_yolos.stop)
+
+    def export(self, variant, **source_stat):
+        segmentation = dict(backends._source_stat(self.model_path), artifact='segmentation.onnx', **source_stat)
+        manifest = backends.read_manifest(self.export_dir)
+        manifest[variant] = {'segmentation': segmentation,
+                             'yolos': {'artifact': 'yolos.onnx', 'image_size': 800}}
+        backends._write_manifest(self.export_dir, manifest)
+
+    def test_eager_loads_nothing(self):
+        self.export('onnx')
+        self.assertEqual(backends.load_models(self.model_path, self.export_dir, 'eager'), (None, None, 'eager'))
+        self.yolo.assert_not_called()
+
+    def test_missing_variant_falls_back_to_eager(self):
+        self.export('onnx')
+        self.assertEqual(backends.load_models(self.model_path, self.export_dir, 'onnx', quantized=True),
+                         (None, None, 'eager'))
+        self.assertEqual(backends.load_models(self.model_path, os.path.join(self.export_dir, 'missing'), 'onnx'),
+                         (None, None, 'eager'))
+
+    def test_selects_the_requested_variant(self):
+        self.export('onnx')
+        self.export('onnx-int8')
+        self.assertEqual(backends.load_models(self.model_path, self.export_dir, 'onnx', quantized=True),
+                         (mock.sentinel.model_seg, mock.sentinel.model_yolos, 'onnx-int8'))
+        self.yolo.assert_called_once_with(os.path.join(self.export_dir, 'segmentation.onnx'), task='segment')
+
+    def test_stale_segmentation_export_is_skipped(self):
+        self.export('onnx')
+        with open(self.model_path, 'wb') as f:
+            f.write(b'retrained weights')
+        self.assertEqual(backends.load_models(self.model_path, self.export_dir, 'onnx'),
+                         (None, mock.sentinel.model_yolos, 'onnx'))
+        self.yolo.assert_not_called()
+
+    def test_nothing_loaded_reports_eager(self):
+        self.export('onnx', source_mtime=0)
+        self.load_yolos.side_effect = FileNotFoundError('yolos.onnx')
+        self.assertEqual(backends.load_models(self.model_path, self.export_dir, 'onnx'), (None, None, 'eager'))
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    """Requests beyond the slots and the queue are shed; users beyond their rate get 429."""
+
+    def hold_slot(self, controller, user_key):
+        """Occupy a slot from another thread until the returned event is set."""
+        admitted, release = threading.Event(), threading.Event()
+
+        def run():
+            with controller.admit(user_key):
+                admitted.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.assertTrue(admitted.wait(5))
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(release.set)
+        return release
+
+    def wait_until_idle(self, controller):
+        deadline = time.monotonic() + 5
+        while controller.status()['running']:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_admits_up_to_max_concurrent(self):
+        controller = AdmissionController(max_concurrent=2, max_queue=0, queue_timeout=1)
+        self.hold_slot(controller, 'a')
+        with controller.admit('b'):
+            self.assertEqual(controller.status()['running'], 2)
+        self.assertEqual(controller.status()['running'], 1)
+
+    def test_full_queue_is_shed_with_503(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1)
+        self.hold_slot(controller, 'a')
+        with self.assertRaises(AdmissionRejected) as context:
+            with controller.admit('b'):
+                pass
+        self.assertEqual(context.exception.reason, 'queue_full')
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertGreaterEqual(context.exception.retry_after, 1)
+
+    def test_queued_request_times_out(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+        self.hold_slot(controller, 'a')
+        with self.assertRaises(AdmissionRejected) as context:
+            with controller.admit('b'):
+                pass
+        self.assertEqual(context.exception.reason, 'queue_timeout')
+        self.assertEqual(controller.status()['waiting'], 0)
+
+    def test_queued_request_runs_when_a_slot_frees(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+        release = self.hold_slot(controller, 'a')
+        threading.Timer(0.05, release.set).start()
+        with controller.admit('b'):
+            self.assertEqual(controller.status(), {'running': 1, 'waiting': 0, 'max_concurrent': 1, 'max_queue': 1})
+
+    def test_rate_limited_with_429(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1,
+                                         user_rate=1 / 60.0, user_burst=2)
+        for _ in range(2):
+            with controller.admit('a'):
+                pass
+        with self.assertRaises(AdmissionRejected) as context:
+            with controller.admit('a'):
+                pass
+        self.assertEqual(context.exception.reason, 'rate_limited')
+        self.assertEqual(context.exception.status_code, 429)
+        self.assertGreater(context.exception.retry_after, 30)
+        # Other users have their own bucket
+        with controller.admit('b'):
+            pass
+
+    def test_shed_request_refunds_the_token(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=0, queue_timeout=1,
+                                         user_rate=1 / 60.0, user_burst=1)
+        release = self.hold_slot(controller, 'a')
+        with self.assertRaises(AdmissionRejected) as context:
+            with controller.admit('b'):
+                pass
+        self.assertEqual(context.exception.reason, 'queue_full')
+        release.set()
+        self.wait_until_idle(controller)
+        # b's only token was given back, so b is not rate limited now
+        with controller.admit('b'):
+            pass
+
+
+class SharedTokenBucketsTests(TestCase):
+    """The database buckets behave like the in-process ones, across instances."""
+
+    def test_rate_is_shared_between_processes(self):
+        # Two instances stand in for two worker processes
+        first, second = SharedTokenBuckets(1 / 60.0, 2), SharedTokenBuckets(1 / 60.0, 2)
+        self.assertEqual(first.take(1), 0.0)
+        self.assertEqual(second.take(1), 0.0)
+        self.assertGreater(first.take(1), 0.0)
+        self.assertGreater(second.take(1), 0.0)
+        self.assertEqual(first.take(2), 0.0)
+
+    def test_refund_is_capped_at_burst(self):
+        buckets = SharedTokenBuckets(1 / 60.0, 1)
+        buckets.take(1)
+        buckets.refund(1)
+        buckets.refund(1)
+        self.assertEqual(buckets.take(1), 0.0)
+        self.assertGreater(buckets.take(1), 0.0)
+
+    def test_matches_in_process_buckets(self):
+        shared, local = SharedTokenBuckets(1 / 60.0, 3), TokenBuckets(1 / 60.0, 3)
+        for _ in range(5):
+            self.assertEqual(shared.take('a') > 0, local.take('a') > 0)
+
+
+def segmented_item(category='upper', suffix='upper', color=(128, 0, 0)):
+    """A small garment as the pipeline would produce it."""
+    mask = np.zeros((40, 30), np.uint8)
+    mask[5:35, 5:25] = 255
+    image = np.zeros((40, 30, 3), np.uint8)
+    image[mask > 0] = color
+    return SegmentedItem(0, suffix, category, f"A {category} garment", ['#000080'], [1.0], ['navy'], mask, image)
+
+
+def processing_service(output_dir, items=None, cache=None):
+    """A ClothingProcessorService whose segmenter returns items without loading any model."""
+    service = ClothingProcessorService.__new__(ClothingProcessorService)
+    service.output_dir = output_dir
+    service.cache = cache
+    service.backend = 'eager'
+    service.segmenter = mock.Mock()
+    garments = [segmented_item()] if items is None else items
+    service.segmenter.process_bytes.side_effect = lambda image_bytes, name='': {
+        'items': garments, 'timings': {'decode': 0.001}, 'failed_stages': [], 'error': None,
+    }
+    return service
+
+
+def storage_name(url):
+    """The default_storage name behind a media URL."""
+    return url[len(settings.MEDIA_URL):]
+
+
+class ProcessClothingViewTests(TestCase):
+    """The synchronous endpoint returns URLs of stored images, not of the run's workspace."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = User.objects.create_user(email='owner@example.com', first_name='Test', last_name='User',
+                                             gender='F', birthday=date(1990, 1, 1), password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, service):
+        image = SimpleUploadedFile('outfit.jpg', b'image bytes', content_type='image/jpeg')
+        with mock.patch.object(registry, 'get_service', return_value=service):
+            return self.client.post('/clothing-processor/process/', {'image': image, 'mode': 'sync'}, format='multipart')
+
+    def assert_stored(self, payload):
+        for garment in [payload] + payload['items']:
+            self.assertTrue(default_storage.exists(storage_name(garment['segmented_image_url'])))
+
+    def test_urls_outlive_the_workspace(self):
+        service = processing_service(os.path.join(self.media_root, 'processed_clothes'),
+                                     items=[segmented_item(), segmented_item('lower', 'lower')])
+        response = self.post(service)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['category'] for item in response.json()['items']], ['upper', 'lower'])
+        self.assert_stored(response.json())
+        # The workspace itself was released
+        workspace_files = [name for root, _, names in os.walk(service.output_dir)
+                           if os.path.basename(root) != 'results' for name in names]
+        self.assertEqual(workspace_files, [])
+
+    def test_cache_hits_skip_admission(self):
+        cache = ResultCache(os.path.join(self.media_root, 'processing_cache'), 'v1', memory_entries=0)
+        service = processing_service(os.path.join(self.media_root, 'processed_clothes'), cache=cache)
+        # One run per minute and no queue
+        controller = AdmissionController(1, 0, 0.1, user_rate=1 / 60.0, user_burst=1)
+        with mock.patch('clothing_processor.views.admission', return_value=controller):
+            self.assertEqual(self.post(service).status_code, 200)
+            self.assertEqual(self.post(service).status_code, 200)
+            self.assertEqual(service.segmenter.process_bytes.call_count, 1)
+            # A new photo does need a token
+            image = SimpleUploadedFile('other.jpg', b'other bytes', content_type='image/jpeg')
+            with mock.patch.object(registry, 'get_service', return_value=service):
+                response = self.client.post('/clothing-processor/process/', {'image': image, 'mode': 'sync'})
+        self.assertEqual(response.status_code, 429)
+
+    def test_urls_outlive_the_cache_entry(self):
+        cache = ResultCache(os.path.join(self.media_root, 'processing_cache'), 'v1', memory_entries=0)
+        response = self.post(processing_service(os.path.join(self.media_root, 'processed_clothes'), cache=cache))
+        self.assertEqual(response.status_code, 200)
+        shutil.rmtree(cache.cache_dir)
+        self.assert_stored(response.json())
+
+
+class ProcessingJobTests(TestCase):
+    """Workers claim jobs once, store their outcome and only requeue abandoned ones."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = User.objects.create_user(email='owner@example.com', first_name='Test', last_name='User',
+                                             gender='F', birthday=date(1990, 1, 1), password='password')
+        self.service = processing_service(os.path.join(self.media_root, 'processed_clothes'))
+
+    def enqueue(self):
+        return enqueue_job(self.user, SimpleUploadedFile('outfit.jpg', b'image bytes', content_type='image/jpeg'))
+
+    def test_claim_hands_out_each_job_once_oldest_first(self):
+        first, second = self.enqueue(), self.enqueue()
+        claimed = claim_next_job('host:1:0')
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual(claimed.status, ProcessingJob.STATUS_RUNNING)
+        self.assertEqual(claimed.worker, 'host:1:0')
+        self.assertIsNotNone(claimed.started_at)
+        self.assertEqual(claim_next_job('host:1:1').pk, second.pk)
+        self.assertIsNone(claim_next_job('host:1:0'))
+
+    def test_run_stores_image_urls_and_deletes_the_upload(self):
+        self.enqueue()
+        job = run_job(claim_next_job('host:1:0'), self.service)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ProcessingJob.STATUS_DONE)
+        self.assertEqual(job.result['category'], 'upper')
+        for garment in [job.result] + job.result['items']:
+            self.assertTrue(default_storage.exists(storage_name(garment['segmented_image_url'])))
+        self.assertIn('queue_wait', job.timings)
+        self.assertIn('total', job.timings)
+        self.assertFalse(job.image)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f"/clothing-processor/jobs/{job.pk}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(self.media_root, response.content.decode('utf-8'))
+
+    def test_failed_run_records_the_error(self):
+        self.enqueue()
+        self.service.segmenter.process_bytes.side_effect = lambda image_bytes, name='': {
+            'items': [], 'timings': {}, 'failed_stages': ['rembg'], 'error': 'rembg failed',
+        }
+        job = run_job(claim_next_job('host:1:0'), self.service)
+        self.assertEqual(job.status, ProcessingJob.STATUS_FAILED)
+        self.assertEqual(job.error, 'Failed to process the image')
+        self.assertIsNone(job.result)
+
+    def test_exception_fails_the_job(self):
+        self.enqueue()
+        with mock.patch.object(self.service, 'process_clothing_item', side_effect=RuntimeError('out of memory')):
+            job = run_job(claim_next_job('host:1:0'), self.service)
+        self.assertEqual(job.status, ProcessingJob.STATUS_FAILED)
+        self.assertEqual(job.error, 'out of memory')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_requeue_leaves_recently_claimed_jobs_alone(self):
+        stale, live = self.enqueue(), self.enqueue()
+        claim_next_job('dead-host:1:0')
+        claim_next_job('other-host:1:0')
+        ProcessingJob.objects.filter(pk=stale.pk).update(started_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(requeue_running_jobs(stale_after=3600), 1)
+        stale.refresh_from_db()
+        live.refresh_from_db()
+        self.assertEqual((stale.status, stale.worker, stale.started_at), (ProcessingJob.STATUS_QUEUED, '', None))
+        self.assertEqual((live.status, live.worker), (ProcessingJob.STATUS_RUNNING, 'other-host:1:0'))
+        self.assertEqual(claim_next_job('host:1:0').pk, stale.pk)
+
+
+class ModelRegistryTests(SimpleTestCase):
+    """Models load once per process, readiness follows warm-up and fork preparation skips it."""
+
+    def setUp(self):
+        self.registry = type(registry)()
+        self.service = mock.Mock(backend='eager')
+        self.service.segmenter.warmup.return_value = 0.5
+        self.service.segmenter.refiner.stats.return_value = {}
+        service_class = mock.patch('clothing_processor.services.ClothingProcessorService', return_value=self.service)
+        self.service_class = service_class.start()
+        self.addCleanup(service_class.stop)
+        view_registry = mock.patch('clothing_processor.views.registry', self.registry)
+        view_registry.start()
+        self.addCleanup(view_registry.stop)
+
+    def test_loads_and_warms_up_once(self):
+        self.assertFalse(self.registry.loaded)
+        self.assertIs(self.registry.get_service(), self.service)
+        self.assertIs(self.registry.get_service(), self.service)
+        self.assertEqual(self.service_class.call_count, 1)
+        self.assertEqual(self.service.segmenter.warmup.call_count, 1)
+        self.assertTrue(self.registry.ready)
+        self.assertEqual(self.registry.status()['warmup_seconds'], 0.5)
+
+    def test_load_failure_raises_and_is_retried(self):
+        self.service_class.side_effect = OSError('weights not found')
+        with self.assertRaises(RuntimeError):
+            self.registry.get_service()
+        self.assertFalse(self.registry.loaded)
+        self.assertEqual(self.registry.status()['error'], 'weights not found')
+
+        self.service_class.side_effect = None
+        self.assertIs(self.registry.get_service(), self.service)
+        self.assertIsNone(self.registry.status()['error'])
+
+    def test_prepare_for_fork_loads_without_warming_up(self):
+        with mock.patch('clothing_processor.registry.gc.freeze') as freeze:
+            self.registry.prepare_for_fork()
+        freeze.assert_called_once_with()
+        self.assertTrue(self.registry.loaded)
+        self.assertFalse(self.registry.ready)
+        self.service.segmenter.warmup.assert_not_called()
+
+        # Each worker warms up on its own
+        self.registry.warmup()
+        self.assertTrue(self.registry.ready)
+
+    def test_readiness_is_503_until_warmed_up(self):
+        with mock.patch.object(self.registry, 'load_in_background') as load_in_background:
+            response = APIClient().get('/clothing-processor/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.data['ready'])
+        load_in_background.assert_called_once_with()
+
+        self.registry.load()
+        response = APIClient().get('/clothing-processor/ready/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['ready'])
+
+    def test_readiness_hides_the_load_error(self):
+        self.service_class.side_effect = OSError('/secret/path/best.pt not found')
+        with self.assertRaises(RuntimeError):
+            self.registry.load()
+        with mock.patch.object(self.registry, 'load_in_background'):
+            response = APIClient().get('/clothing-processor/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertNotIn('error', response.data)
+        self.assertNotIn('/secret/path', response.content.decode('utf-8'))
+
+
+def photo(width=60, height=80):
+    """A PNG of a red rectangle on white, with the rectangle's mask."""
+    mask = np.zeros((height, width), np.float32)
+    mask[height // 4:3 * height // 4, width // 4:3 * width // 4] = 1
+    image = np.full((height, width, 3), 255, np.uint8)
+    image[mask > 0] = (0, 0, 200)
+    return cv2.imencode('.png', image)[1].tobytes(), mask
+
+
+class PipelineStageTests(SimpleTestCase):
+    """Every stage reads what earlier stages produced, and each model runs once per image."""
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir, ignore_errors=True)
+        self.model_seg = mock.Mock()
+        self.model_seg.predict.side_effect = self.segment
+        self.model_yolos = mock.Mock()
+        self.model_yolos.config.id2label = {0: 'shirt', 1: 'pants'}
+        with mock.patch.object(clothing_segmentation.YolosImageProcessor, 'from_pretrained'):
+            self.segmenter = clothing_segmentation.ClothingSegmenter(
+                'best.pt', self.output_dir, refiner=clothing_segmentation.get_refiner('none'),
+                model_seg=self.model_seg, model_yolos=self.model_yolos)
+        self.segmenter._rembg_session = mock.sentinel.rembg_session
+        self.segmenter.processor.return_value = {'pixel_values': mock.sentinel.pixel_values}
+        self.segmenter.processor.post_process_object_detection.side_effect = (
+            lambda outputs, threshold, target_sizes: [{'labels': [_Tensor(0)]} for _ in target_sizes])
+        self.class_id = 0
+        remove = mock.patch.object(clothing_segmentation, 'remove', side_effect=self.remove_background)
+        self.remove = remove.start()
+        self.addCleanup(remove.stop)
+
+    def remove_background(self, pil_image, session=None, only_mask=False):
+        return clothing_segmentation.Image.new('L', pil_image.size, 255)
+
+    def segment(self, source, **kwargs):
+        images = source if isinstance(source, list) else [source]
+        results = []
+        for image in images:
+            _, mask = photo(image.shape[1], image.shape[0])
+            results.append(_Result([mask], [self.class_id], image.shape))
+        return results
+
+    def test_stage_inputs_are_produced_by_earlier_stages(self):
+        available = {'image_bytes'}
+        for name, inputs, outputs, optional in clothing_segmentation.PIPELINE_STAGES:
+            self.assertLessEqual(set(inputs), available, name)
+            self.assertTrue(callable(getattr(self.segmenter, f"_stage_{name}", None)), name)
+            available |= set(outputs)
+        self.assertIn('items', available)
+
+    def test_describe_pipeline_follows_the_stage_order(self):
+        described = clothing_segmentation.ClothingSegmenter.describe_pipeline()
+        self.assertEqual([stage['stage'] for stage in described],
+                         [stage[0] for stage in clothing_segmentation.PIPELINE_STAGES])
+        self.assertEqual(len({stage['stage'] for stage in described}), len(described))
+        self.assertEqual([stage['stage'] for stage in described if stage['optional']], ['yolos'])
+
+    def test_each_model_runs_once_per_image(self):
+        image_bytes, _ = photo()
+        result = self.segmenter.process_bytes(image_bytes, 'photo.png')
+        self.assertIsNone(result['error'])
+        self.assertEqual(self.remove.call_count, 1)
+        self.assertEqual(self.model_seg.predict.call_count, 1)
+        self.assertEqual(self.model_yolos.call_count, 1)
+        self.assertEqual(set(result['timings']),
+                         {stage[0] for stage in clothing_segmentation.PIPELINE_STAGES} | {'total'})
+        [item] = result['items']
+        self.assertEqual((item.category, item.description), ('upper clothing', 'shirt'))
+
+    def test_batch_runs_each_model_once(self):
+        images = [(f"{i}.png", photo(60 + 10 * i, 80)[0]) for i in range(3)]
+        results = self.segmenter.process_batch(images)
+        self.assertEqual([len(result['items']) for result in results], [1, 1, 1])
+        self.assertEqual(self.remove.call_count, 3)
+        self.assertEqual(self.model_seg.predict.call_count, 1)
+        self.assertEqual(self.model_yolos.call_count, 1)
+
+    def test_dress_skips_yolos(self):
+        self.class_id = 2
+        result = self.segmenter.process_bytes(photo()[0], 'dress.png')
+        self.assertEqual(self.model_yolos.call_count, 0)
+        self.assertEqual([item.description for item in result['items']], ['dress'])
+
+    def test_process_bytes_matches_process_image(self):
+        image_bytes, _ = photo()
+        image_path = os.path.join(self.output_dir, 'photo.png')
+        with open(image_path, 'wb') as f:
+            f.write(image_bytes)
+
+        in_memory = self.segmenter.process_bytes(image_bytes, 'photo.png')
+        written = self.segmenter.process_image(image_path, 0, sink=clothing_segmentation.DiskSink(
+            os.path.join(self.output_dir, 'written')))
+        self.assertEqual((in_memory['error'], written['error']), (None, None))
+        self.assertEqual(len(written['items']), len(in_memory['items']))
+        for item, record in zip(in_memory['items'], written['items']):
+            self.assertEqual(item.metadata(f"00_{item.suffix}.jpg"),
+                             {key: value for key, value in record.items()
+                              if key not in ('image_path', 'metadata_path')})
+            with open(record['image_path'], 'rb') as f:
+                self.assertEqual(f.read(), item.encode('.jpg'))
+
+
+class _InlinePool:
+    """multiprocessing Pool stand-in that runs the tasks in this process."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def imap_unordered(self, func, iterable):
+        return map(func, iterable)
+
+
+class SegmentationCliTests(SimpleTestCase):
+    """Output names never collide and a resumed run skips what the manifest records as done."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.input_dir = os.path.join(self.root, 'input')
+        self.output_dir = os.path.join(self.root, 'output')
+        self.manifest = os.path.join(self.output_dir, 'manifest.jsonl')
+        for relative_path in ('a.jpg', 'b.jpg', os.path.join('sub', 'a.jpg')):
+            os.makedirs(os.path.dirname(os.path.join(self.input_dir, relative_path)), exist_ok=True)
+            with open(os.path.join(self.input_dir, relative_path), 'wb') as f:
+                f.write(relative_path.encode())
+        os.makedirs(self.output_dir)
+
+    def write_manifest(self, content):
+        with open(self.manifest, 'wb') as f:
+            f.write(content if isinstance(content, bytes) else content.encode())
+
+    def run_cli(self):
+        """Run the CLI with an in-process pool; returns the paths the segmenter was given."""
+        segmenter = mock.Mock(images_output_dir=self.output_dir)
+        segmenter.process_bytes.side_effect = lambda image_bytes, name='': {
+            'items': [segmented_item()], 'timings': {'decode': 0.001}, 'error': None,
+        }
+        args = Namespace(input_dir=self.input_dir, output_dir=self.output_dir, manifest=None, workers=1,
+                         threads=1, batch_size=1, imgsz=640, refiner='none', refine_max_side=768, model='best.pt')
+        with mock.patch.object(clothing_segmentation.multiprocessing, 'get_context',
+                               return_value=mock.Mock(Pool=_InlinePool)), \
+                mock.patch.object(clothing_segmentation, '_worker_segmenter', segmenter), \
+                mock.patch.dict(os.environ):
+            run_cli(args)
+        return sorted(call.args[1] for call in segmenter.process_bytes.call_args_list)
+
+    def test_output_prefix(self):
+        self.assertEqual(output_prefix('a.jpg'), output_prefix('a.jpg'))
+        self.assertTrue(output_prefix(os.path.join('sub', 'a.jpg')).startswith('a_'))
+        self.assertNotEqual(output_prefix('a.jpg'), output_prefix(os.path.join('sub', 'a.jpg')))
+        self.assertNotEqual(output_prefix('a.jpg'), output_prefix('a.png'))
+
+    def test_load_manifest_keeps_completed_records_only(self):
+        self.assertEqual(load_manifest(self.manifest), set())
+        self.write_manifest(b'\n'.join([
+            json.dumps({'path': 'a.jpg', 'status': 'done'}).encode(),
+            json.dumps({'path': 'b.jpg', 'status': 'failed'}).encode(),
+            b'[1, 2]',
+            json.dumps({'status': 'done'}).encode(),
+            b'\xff\xfe garbage',
+            b'{"path": "sub/a.jpg", "status": "do',
+        ]))
+        self.assertEqual(load_manifest(self.manifest), {'a.jpg'})
+
+    def test_resume_skips_completed_images(self):
+        self.write_manifest(json.dumps({'path': 'a.jpg', 'status': 'done'}) + '\n'
+                            + json.dumps({'path': 'b.jpg', 'status': 'failed'}) + '\n')
+        self.assertEqual(self.run_cli(), ['b.jpg', os.path.join('sub', 'a.jpg')])
+        self.assertEqual(load_manifest(self.manifest), {'a.jpg', 'b.jpg', os.path.join('sub', 'a.jpg')})
+        # Nothing left to do
+        self.assertEqual(self.run_cli(), [])
+
+    def test_resume_after_a_truncated_manifest(self):
+        self.write_manifest(json.dumps({'path': 'a.jpg', 'status': 'done'}) + '\n{"path": "b.jpg", "sta')
+        self.assertEqual(self.run_cli(), ['b.jpg', os.path.join('sub', 'a.jpg')])
+        # The first appended record was not glued onto the truncated line
+        self.assertEqual(self.run_cli(), [])
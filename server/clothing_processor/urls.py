@@ -3,4 +3,7 @@ from . import views
 
 urlpatterns = [
     path('process/', views.process_clothing, name='process_clothing'),
+    path('jobs/<int:job_id>/', views.processing_job_status, name='processing_job_status'),
+    path('ready/', views.readiness, name='processing_readiness'),
+    path('cache/stats/', views.cache_stats, name='processing_cache_stats'),
 ] 
\ No newline at end of file
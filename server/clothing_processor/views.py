@@ -2,26 +2,23 @@ from django.shortcuts import render
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 import os
-from .services import ClothingProcessorService
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from .services import format_processing_result
+from .registry import registry
+from .admission import AdmissionRejected, admission, rejected_response
+from .jobs import enqueue_job
+from .models import ProcessingJob
 import logging
 import traceback
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
-# Initialize the clothing processor service
-try:
-    logger.info("Starting clothing processor initialization")
-    clothing_processor = ClothingProcessorService()
-    logger.info("Clothing processor initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize ClothingProcessorService: {str(e)}")
-    logger.error(traceback.format_exc())
-    clothing_processor = None
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -30,9 +27,21 @@ def process_clothing(request):
     Process a clothing item image.
     Expects a multipart form with an 'image' file.
     Returns the processing results including segmented image and metadata.
+
+    With mode=job (query string or form field) the image is queued for the
+    worker pool instead, and the response carries the job id to poll.
     """
     logger.info("Received clothing processing request")
     
+    mode = request.query_params.get('mode') or request.data.get('mode') or settings.CLOTHING_PROCESSOR_DEFAULT_MODE
+    if mode == 'job':
+        return enqueue_processing_job(request)
+    
+    try:
+        clothing_processor = registry.get_service()
+    except RuntimeError:
+        clothing_processor = None
+    
     if not clothing_processor:
         logger.error("Clothing processor service is not available")
         return Response(
@@ -51,60 +60,134 @@ def process_clothing(request):
         image_file = request.FILES['image']
         logger.info(f"Processing image: {image_file.name}")
         
-        # Save the uploaded file temporarily
-        temp_dir = os.path.join(settings.MEDIA_ROOT, 'temp')
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_path = os.path.join(temp_dir, image_file.name)
-        
-        logger.info(f"Saving uploaded file to: {temp_path}")
-        with open(temp_path, 'wb+') as destination:
-            for chunk in image_file.chunks():
-                destination.write(chunk)
-        
-        # Process the image
+        # Process the image straight from the upload, without a temp file.
+        # Re-uploads and retries with the same Idempotency-Key hit the result cache,
+        # which answers without an admission slot or rate limit token.
         logger.info("Processing image with clothing processor")
-        result = clothing_processor.process_clothing_item(temp_path)
-        
-        if not result:
-            logger.error("Image processing failed")
-            return Response(
-                {'error': 'Failed to process the image'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        
-        # Check if the model successfully classified the clothing
-        if not result.get('category') or result['category'] == 'unknown':
-            logger.error("Could not identify the clothing item")
-            return Response(
-                {'error': 'Could not identify the clothing item. Please try a clearer image.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Clean up the temporary file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-            logger.info(f"Removed temporary file: {temp_path}")
+        result = clothing_processor.process_clothing_bytes(
+            image_file.read(),
+            image_file.name,
+            idempotency_key=request.headers.get('Idempotency-Key'),
+            scope=str(request.user.pk),
+            admission=admission().admit(request.user.pk)
+        )
         
-        logger.info("Returning processing results")
-        return Response({
-            'category': result['category'],
-            'metadata': {
-                'colors': result['metadata']['colors'],
-                'description': result['metadata']['description']
-            },
-            'segmented_image_url': result['segmented_image']
-        })
+        try:
+            if not result:
+                logger.error("Image processing failed")
+                return Response(
+                    {'error': 'Failed to process the image'},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+            
+            # Check if the model successfully classified the clothing
+            if not result.get('category') or result['category'] == 'unknown':
+                logger.error("Could not identify the clothing item")
+                return Response(
+                    {'error': 'Could not identify the clothing item. Please try a clearer image.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            logger.info("Returning processing results")
+            response = format_processing_result(result)
+        finally:
+            # The segmented images have been copied into storage
+            clothing_processor.release(result)
+        return Response(response)
         
+    except AdmissionRejected as e:
+        return rejected_response(e)
     except Exception as e:
         logger.error(f"Error processing clothing: {str(e)}")
         logger.error(traceback.format_exc())
-        
-        # Clean up the temporary file if it exists
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.remove(temp_path)
-            logger.info(f"Removed temporary file after error: {temp_path}")
-            
+
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
+
+
+def enqueue_processing_job(request):
+    """
+    Queue an uploaded image for asynchronous processing.
+    Returns 202 with the job id and the URL to poll for its status.
+    """
+    if 'image' not in request.FILES:
+        logger.error("No image file provided")
+        return Response(
+            {'error': 'No image file provided'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # Queued jobs wait for the worker pool, but still count against the user's rate
+    wait = admission().buckets.take(request.user.pk)
+    if wait > 0:
+        return rejected_response(AdmissionRejected('rate_limited', status.HTTP_429_TOO_MANY_REQUESTS, wait))
+    
+    try:
+        job = enqueue_job(request.user, request.FILES['image'])
+    except Exception as e:
+        logger.error(f"Error queueing processing job: {str(e)}")
+        logger.error(traceback.format_exc())
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    return Response({
+        'job_id': job.pk,
+        'status': job.status,
+        'status_url': request.build_absolute_uri(reverse('processing_job_status', args=[job.pk]))
+    }, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def processing_job_status(request, job_id):
+    """
+    Report the state of a processing job owned by the current user.
+    Includes per-stage timings and, once done, the processing results.
+    """
+    job = get_object_or_404(ProcessingJob, pk=job_id, user=request.user)
+    
+    return Response({
+        'job_id': job.pk,
+        'status': job.status,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'timings': job.timings,
+        'result': job.result,
+        'error': job.error or None
+    })
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def readiness(request):
+    """
+    Readiness probe: 200 once the models are loaded and warmed up, 503 otherwise.
+    The first probe in a process that has not loaded the models starts loading them
+    in the background. Load errors are logged, not returned to anonymous callers.
+    """
+    if not registry.loaded:
+        registry.load_in_background()
+    
+    registry_status = registry.status()
+    registry_status.pop('error')
+    return Response(
+        registry_status,
+        status=status.HTTP_200_OK if registry_status['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_stats(request):
+    """
+    Return the result cache hit/miss counters of this process.
+    """
+    if not registry.loaded or not registry.get_service().cache:
+        return Response({'enabled': False})
+    
+    return Response(dict(registry.get_service().cache.stats(), enabled=True))
@@ -5,6 +5,8 @@ import cv2
 from pathlib import Path
 import json
 import colorsys
+from .colors import extract_dominant_colors
+from .color_names import name_color, name_colors
 
 class YOLOClothingProcessor:
     def __init__(self, model_path, classes_path):
@@ -90,21 +92,16 @@ class YOLOClothingProcessor:
         # Apply mask
         masked_img = cv2.bitwise_and(image, image, mask=mask)
         
-        # Reshape the image to be a list of pixels
-        pixels = masked_img[mask > 0].reshape(-1, 3)
+        # Subsampled Lab-histogram clustering with a fixed seed
+        dominant = extract_dominant_colors(masked_img, mask, k=num_colors, channel_order='rgb')
         
-        if len(pixels) == 0:
+        if not dominant:
             return ['#000000']
         
-        # Use k-means clustering to find dominant colors
-        pixels = np.float32(pixels)
-        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 200, .1)
-        flags = cv2.KMEANS_RANDOM_CENTERS
-        _, labels, palette = cv2.kmeans(pixels, num_colors, None, criteria, 10, flags)
-        
         # Convert colors to hex
         colors = []
-        for color in palette:
+        for hex_color, _ in dominant:
+            color = [int(hex_color[i:i+2], 16) for i in (1, 3, 5)]
             # Convert to HSV and adjust saturation and value
             h, s, v = colorsys.rgb_to_hsv(color[0]/255, color[1]/255, color[2]/255)
             s = min(1.0, s * 1.2)  # Increase saturation
@@ -116,7 +113,7 @@ class YOLOClothingProcessor:
     
     def generate_description(self, category, colors):
         """Generate a natural language description of the clothing item"""
-        color_names = [self.get_color_name(color) for color in colors[:2]]
+        color_names = name_colors(colors[:2])
         
         if len(color_names) > 1:
             color_desc = f"{color_names[0]} and {color_names[1]}"
@@ -127,34 +124,4 @@ class YOLOClothingProcessor:
     
     def get_color_name(self, hex_color):
         """Convert hex color to a human-readable name"""
-        # Simple color name mapping - you can expand this
-        basic_colors = {
-            '#FF0000': 'red',
-            '#00FF00': 'green',
-            '#0000FF': 'blue',
-            '#FFFF00': 'yellow',
-            '#FF00FF': 'purple',
-            '#00FFFF': 'cyan',
-            '#000000': 'black',
-            '#FFFFFF': 'white',
-        }
-        
-        # Convert hex to RGB
-        hex_color = hex_color.lstrip('#')
-        r, g, b = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-        
-        # Find the closest basic color
-        min_distance = float('inf')
-        closest_color = 'unknown'
-        
-        for hex_basic, name in basic_colors.items():
-            hex_basic = hex_basic.lstrip('#')
-            r2, g2, b2 = tuple(int(hex_basic[i:i+2], 16) for i in (0, 2, 4))
-            
-            distance = ((r - r2) ** 2 + (g - g2) ** 2 + (b - b2) ** 2) ** 0.5
-            
-            if distance < min_distance:
-                min_distance = distance
-                closest_color = name
-        
-        return closest_color 
\ No newline at end of file
+        return name_color(hex_color)
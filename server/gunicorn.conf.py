@@ -0,0 +1,35 @@
+# Gunicorn configuration for serving the API with shared model weights.
+#
+#   CLOTHING_PROCESSOR_PRELOAD=True gunicorn -c gunicorn.conf.py main.wsgi
+#
+# preload_app imports main.wsgi in the master, which loads the models once;
+# each forked worker then shares those pages copy-on-write and only runs the
+# warm-up inference for itself, which also opens its own ONNX Runtime sessions
+# (none are created in the master, they are not fork-safe).
+#
+# Workers are threaded: requests served by one worker share its models and
+# its admission queue (clothing_processor/admission.py), so MAX_CONCURRENT and
+# MAX_QUEUE apply per worker and need threads > MAX_CONCURRENT + MAX_QUEUE to
+# ever fill. The per-user rate is kept in the database and holds across workers.
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '2'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+preload_app = True
+
+
+def on_starting(server):
+    # Metric snapshots from a previous run belong to processes that no longer exist
+    from main.metrics import metrics
+    metrics.reset_directory()
+
+
+def post_fork(server, worker):
+    from django.conf import settings
+
+    if settings.CLOTHING_PROCESSOR_PRELOAD:
+        from clothing_processor.registry import registry
+        registry.warmup()
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metric:
+    """A named counter, gauge or histogram; recording goes through the owning registry."""
+
+    def __init__(self, registry, kind, name, documentation, labelnames, buckets=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+
+    def _key(self, labels):
+        return (self.name, tuple(str(labels.get(label, '')) for label in self.labelnames))
+
+    def inc(self, amount=1, **labels):
+        self.registry._record(self, self._key(labels), amount)
+
+    def observe(self, value, **labels):
+        self.registry._record(self, self._key(labels), value)
+
+    def set(self, value, **labels):
+        self.registry._record(self, self._key(labels), value)
+
+
+class MetricsRegistry:
+    """
+    Process-local metrics that can be merged across worker processes.
+
+    Recording only takes a lock and bumps numbers in a dict. Every
+    flush_interval seconds (checked when a value is recorded) the process
+    writes its values to <directory>/<pid>.json; render() sums the files of
+    every process, so a scrape that lands on any gunicorn or job worker
+    sees the totals for the whole deployment. A forked child notices its new
+    pid and starts from zero so the parent's values are not counted twice.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._configured = directory is not None
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._callbacks = []
+        self._values = {}
+        self._pid = os.getpid()
+        self._last_flush = time.monotonic()
+        atexit.register(self._flush_at_exit)
+
+    def configure(self, directory, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._configured = True
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _ensure_configured(self):
+        """Read settings.METRICS on first use (the registry is created at import time)."""
+        if self._configured:
+            return
+        from django.conf import settings
+        metrics_settings = getattr(settings, 'METRICS', {})
+        self.configure(metrics_settings.get('DIR'), metrics_settings.get('FLUSH_INTERVAL', 5.0))
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Metric(self, 'counter', name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        """
+        A value set by the process, e.g. its queue depth. The scrape sums the
+        values of the processes that are still running.
+        """
+        return self._register(Metric(self, 'gauge', name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Metric(self, 'histogram', name, documentation, labelnames, buckets))
+
+    def gauge_callback(self, name, documentation, labelnames, callback):
+        """
+        Register a gauge computed at scrape time, e.g. the job queue depth.
+
+        callback() returns a list of (label values tuple, value) pairs.
+        """
+        self._callbacks.append((name, documentation, tuple(labelnames), callback))
+
+    def _record(self, metric, key, value):
+        self._ensure_configured()
+        with self._lock:
+            if self._pid != os.getpid():
+                self._values = {}
+                self._pid = os.getpid()
+            if metric.kind == 'counter':
+                self._values[key] = self._values.get(key, 0) + value
+            elif metric.kind == 'gauge':
+                self._values[key] = value
+            else:
+                sample = self._values.get(key)
+                if sample is None:
+                    # Bucket counts (non-cumulative, last one is +Inf), then sum
+                    sample = self._values[key] = [0] * (len(metric.buckets) + 1) + [0.0]
+                sample[bisect.bisect_left(metric.buckets, value)] += 1
+                sample[-1] += value
+            flush = self.directory and time.monotonic() - self._last_flush >= self.flush_interval
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Write this process's values to its file in the metrics directory."""
+        self._ensure_configured()
+        if not self.directory:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._last_flush = time.monotonic()
+            snapshot = [[name, list(labels), value] for (name, labels), value in self._values.items()]
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        try:
+            with open(f"{path}.tmp", 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.error(f"Error writing metrics snapshot: {str(e)}")
+
+    def _flush_at_exit(self):
+        if self._configured:
+            self.flush()
+
+    def reset_directory(self):
+        """Remove the snapshots of a previous deployment (call once, before workers start)."""
+        self._ensure_configured()
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.json') or name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _collect(self):
+        """Sum the snapshots of every process."""
+        self.flush()
+        merged = {}
+        if not self.directory:
+            with self._lock:
+                return {key: (list(value) if isinstance(value, list) else value)
+                        for key, value in self._values.items()}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            alive = _pid_alive(name[:-len('.json')])
+            try:
+                with open(os.path.join(self.directory, name), 'r') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric_name, labels, value in snapshot:
+                metric = self._metrics.get(metric_name)
+                if metric is not None and metric.kind == 'gauge' and not alive:
+                    # The last value of an exited worker is no longer true
+                    continue
+                key = (metric_name, tuple(labels))
+                if isinstance(value, list):
+                    current = merged.setdefault(key, [0] * len(value))
+                    if len(current) == len(value):
+                        merged[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format."""
+        merged = self._collect()
+        by_metric = {}
+        for (name, labels), value in merged.items():
+            by_metric.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(by_metric.get(name, [])):
+                label_pairs = list(zip(metric.labelnames, labels))
+                if metric.kind in ('counter', 'gauge'):
+                    lines.append(f"{name}{_format_labels(label_pairs)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f"{name}_bucket{_format_labels(label_pairs + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(label_pairs)} {value[-1]}")
+                lines.append(f"{name}_count{_format_labels(label_pairs)} {cumulative}")
+
+        for name, documentation, labelnames, callback in self._callbacks:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                for labels, value in callback():
+                    lines.append(f"{name}{_format_labels(list(zip(labelnames, labels)))} {value}")
+            except Exception as e:
+                logger.error(f"Error collecting gauge {name}: {str(e)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+metrics = MetricsRegistry()
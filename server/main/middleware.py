@@ -0,0 +1,42 @@
+import time
+from .metrics import metrics
+
+REQUEST_SECONDS = metrics.histogram(
+    'http_request_duration_seconds',
+    'Latency of API requests by view, method and status code',
+    ['view', 'method', 'status'],
+)
+REQUEST_EXCEPTIONS = metrics.counter(
+    'http_request_exceptions_total',
+    'Requests whose view raised an unhandled exception',
+    ['view', 'exception'],
+)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    Observe the latency of every request, labelled with the resolved URL name
+    (e.g. process_clothing, clothing-item-list, login), the method and the
+    status code. The metrics endpoint itself is not recorded.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start_time = time.perf_counter()
+        response = self.get_response(request)
+        view = _view_name(request)
+        if view != 'metrics':
+            REQUEST_SECONDS.observe(time.perf_counter() - start_time,
+                                    view=view, method=request.method, status=response.status_code)
+        return response
+
+    def process_exception(self, request, exception):
+        REQUEST_EXCEPTIONS.inc(view=_view_name(request), exception=type(exception).__name__)
+        return None
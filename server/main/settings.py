@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_simplejwt',
     'users',
@@ -52,7 +53,7 @@ AUTH_USER_MODEL = 'users.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
 }
 
@@ -82,6 +83,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main.middleware.MetricsMiddleware',
 ]
 
 CORS_ALLOWED_ORIGINS = [
@@ -178,6 +180,135 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 
+# Clothing processor settings
+# 'sync' runs the pipeline inside the request; 'job' queues it for the
+# worker pool started with `python manage.py run_processing_workers`
+CLOTHING_PROCESSOR_DEFAULT_MODE = os.environ.get('CLOTHING_PROCESSOR_DEFAULT_MODE', 'sync')
+CLOTHING_PROCESSOR_WORKERS = int(os.environ.get('CLOTHING_PROCESSOR_WORKERS', '2'))
+# Seconds after which a job still marked running is considered abandoned by its
+# worker and may be requeued (run_processing_workers --requeue-running)
+CLOTHING_PROCESSOR_JOB_TIMEOUT = float(os.environ.get('CLOTHING_PROCESSOR_JOB_TIMEOUT', '900'))
+# Load the models in main/wsgi.py before a pre-fork server forks its workers
+CLOTHING_PROCESSOR_PRELOAD = os.environ.get('CLOTHING_PROCESSOR_PRELOAD', 'False') == 'True'
+# Admission control for synchronous processing, per worker process: MAX_CONCURRENT
+# pipeline runs, up to MAX_QUEUE more waiting at most QUEUE_TIMEOUT seconds, the
+# rest get 503 (the queue is shared by a worker's threads, see gunicorn.conf.py).
+# Across all workers each user may start USER_RATE_PER_MINUTE runs (bursts of
+# USER_BURST) before getting 429. Both carry a Retry-After header.
+CLOTHING_PROCESSOR_ADMISSION = {
+    'MAX_CONCURRENT': int(os.environ.get('CLOTHING_PROCESSOR_MAX_CONCURRENT', '2')),
+    'MAX_QUEUE': int(os.environ.get('CLOTHING_PROCESSOR_MAX_QUEUE', '4')),
+    'QUEUE_TIMEOUT': float(os.environ.get('CLOTHING_PROCESSOR_QUEUE_TIMEOUT', '15')),
+    'USER_RATE_PER_MINUTE': float(os.environ.get('CLOTHING_PROCESSOR_USER_RATE', '12')),
+    'USER_BURST': int(os.environ.get('CLOTHING_PROCESSOR_USER_BURST', '5')),
+}
+# Content-addressed cache of processing results, keyed by upload hash + pipeline version
+CLOTHING_PROCESSOR_CACHE = {
+    'ENABLED': os.environ.get('CLOTHING_PROCESSOR_CACHE_ENABLED', 'True') == 'True',
+    'DIR': os.path.join(MEDIA_ROOT, 'processing_cache'),
+    'MAX_ENTRIES': 5000,
+    'MAX_BYTES': 1024 * 1024 * 1024,  # 1GB
+    'MAX_AGE': 30 * 24 * 3600,  # 30 days
+    'MEMORY_ENTRIES': 256,
+}
+# Mask refinement: 'densecrf' (most accurate), 'guided' (fast edge-aware filter) or 'none'.
+# Masks are refined on their padded bounding box with the longest side capped at MAX_SIDE.
+CLOTHING_MASK_REFINER = {
+    'BACKEND': os.environ.get('CLOTHING_MASK_REFINER', 'densecrf'),
+    'OPTIONS': {},
+    'MAX_SIDE': 768,
+    'PADDING': 0.1,
+}
+# Inference backend for YOLOv8 and YOLOS: 'eager' (PyTorch), 'onnx' or 'torchscript'.
+# Export the models once with `python manage.py export_models --format onnx [--quantize]`;
+# missing or stale artifacts fall back to eager PyTorch.
+CLOTHING_PROCESSOR_BACKEND = {
+    'FORMAT': os.environ.get('CLOTHING_PROCESSOR_BACKEND', 'eager'),
+    'QUANTIZED': os.environ.get('CLOTHING_PROCESSOR_QUANTIZED', 'False') == 'True',
+    'EXPORT_DIR': os.path.join(BASE_DIR, 'server', 'models', 'exported'),
+    'THREADS': None,
+}
+
+# WebP derivatives of wardrobe images, generated off the request path; after
+# changing SIZES run `python manage.py generate_thumbnails` to backfill them
+WARDROBE_THUMBNAILS = {
+    'SIZES': [128, 256, 512],
+    'QUALITY': 80,
+    'WORKERS': 2,
+}
+
+# Delta sync of wardrobe changes (/wardrobe/clothing-items/sync/)
+WARDROBE_SYNC = {
+    'PAGE_SIZE': 500,
+    # Re-send changes this close to the previous sync to cover late commits
+    'OVERLAP_SECONDS': 5,
+    # Deletion records are kept this long; older cursors get a full resync
+    'TOMBSTONE_RETENTION_DAYS': 90,
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by every worker process, so a write seen by one invalidates all
+    'wardrobe': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('WARDROBE_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'wardrobe')),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    'users': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('USERS_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'users')),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Users resolved by CachedJWTAuthentication are kept for LOCAL_TTL seconds in
+# each process and TTL seconds in the shared cache (every column but the
+# password hash); saving or updating a user drops both.
+USER_AUTH_CACHE = {
+    'ENABLED': os.environ.get('USER_AUTH_CACHE_ENABLED', 'True') == 'True',
+    'ALIAS': 'users',
+    'TTL': 300,
+    'LOCAL_TTL': 30,
+    'LOCAL_MAX_ENTRIES': 1024,
+}
+
+# Per-user cache of rendered wardrobe list pages (and the category list).
+# Every write moves the user to a new cache version.
+WARDROBE_CACHE = {
+    'ENABLED': os.environ.get('WARDROBE_CACHE_ENABLED', 'True') == 'True',
+    'ALIAS': 'wardrobe',
+    'TIMEOUT': 300,
+}
+
+# Rotated and logged-out tokens: a Bloom filter per process (CAPACITY JTIs at
+# ERROR_RATE false positives) in front of the revoked_tokens table. Other
+# processes' revocations are picked up within CHECK_INTERVAL seconds.
+TOKEN_REVOCATION = {
+    'ALIAS': 'users',
+    'CAPACITY': 100000,
+    'ERROR_RATE': 0.001,
+    'CHECK_INTERVAL': 1.0,
+    'REBUILD_INTERVAL': 3600,
+    'SYNC_OVERLAP_SECONDS': 5,
+}
+
+# Build JSON pages of the wardrobe list from .values() rows instead of the
+# DRF serializer (same bytes, see wardrobe/listing.py)
+WARDROBE_FAST_LIST = True
+
+# Prometheus metrics served on /metrics. Each process writes its values to
+# DIR every FLUSH_INTERVAL seconds and a scrape sums the files of all processes.
+METRICS = {
+    'DIR': os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics')),
+    'FLUSH_INTERVAL': 5.0,
+    # Required as a bearer token by /metrics; with none set it is only served in DEBUG
+    'TOKEN': os.environ.get('METRICS_TOKEN', ''),
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -0,0 +1,127 @@
+import os
+import json
+import atexit
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from . import metrics as metrics_module
+from .metrics import MetricsRegistry
+
+DEAD_PID = '4194304'
+
+
+class MetricsRegistryTests(SimpleTestCase):
+    """Snapshots of every worker are merged; exited workers keep their counts but not their gauges."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.registry = MetricsRegistry()
+        self.registry.configure(self.directory, flush_interval=3600)
+        self.addCleanup(atexit.unregister, self.registry._flush_at_exit)
+        self.requests = self.registry.counter('requests_total', 'Requests', ['method'])
+        self.queued = self.registry.gauge('queued_jobs', 'Queued jobs')
+        self.latency = self.registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        pid_alive = mock.patch.object(metrics_module, '_pid_alive', side_effect=lambda pid: pid == str(os.getpid()))
+        pid_alive.start()
+        self.addCleanup(pid_alive.stop)
+
+    def write_snapshot(self, pid, snapshot):
+        with open(os.path.join(self.directory, f"{pid}.json"), 'w') as f:
+            json.dump(snapshot, f)
+
+    def test_merge_across_processes(self):
+        self.requests.inc(method='GET')
+        self.requests.inc(2, method='GET')
+        self.queued.set(4)
+        self.latency.observe(0.05)
+        self.latency.observe(0.5)
+        self.write_snapshot(DEAD_PID, [
+            ['requests_total', ['GET'], 5],
+            ['requests_total', ['POST'], 1],
+            ['queued_jobs', [], 7],
+            ['latency_seconds', [], [1, 0, 2, 12.5]],
+        ])
+
+        merged = self.registry._collect()
+        self.assertEqual(merged[('requests_total', ('GET',))], 8)
+        self.assertEqual(merged[('requests_total', ('POST',))], 1)
+        # The exited worker's gauge is dropped
+        self.assertEqual(merged[('queued_jobs', ())], 4)
+        self.assertEqual(merged[('latency_seconds', ())], [2, 1, 2, 13.05])
+
+    def test_unreadable_snapshots_are_skipped(self):
+        self.requests.inc(method='GET')
+        with open(os.path.join(self.directory, f"{DEAD_PID}.json"), 'w') as f:
+            f.write('[["requests_total", ["GET"], 1')
+        self.assertEqual(self.registry._collect(), {('requests_total', ('GET',)): 1})
+
+    def test_render_text_format(self):
+        self.requests.inc(method='say "hi"\n')
+        self.latency.observe(0.05)
+        self.latency.observe(0.5)
+        self.latency.observe(5)
+        self.registry.gauge_callback('backlog', 'Backlog by status', ['status'], lambda: [(('queued',), 3)])
+
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1.0"} 2',
+            'latency_seconds_bucket{le="+Inf"} 3',
+            'latency_seconds_sum 5.55',
+            'latency_seconds_count 3',
+            '# HELP queued_jobs Queued jobs',
+            '# TYPE queued_jobs gauge',
+            '# HELP requests_total Requests',
+            '# TYPE requests_total counter',
+            'requests_total{method="say \\"hi\\"\\n"} 1',
+            '# HELP backlog Backlog by status',
+            '# TYPE backlog gauge',
+            'backlog{status="queued"} 3',
+        ]) + '\n')
+
+    def test_reset_directory_removes_old_snapshots(self):
+        self.write_snapshot(DEAD_PID, [['requests_total', ['GET'], 5]])
+        self.registry.reset_directory()
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class MetricsViewTests(SimpleTestCase):
+    """/metrics needs the bearer token, or DEBUG when no token is configured."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        registry = MetricsRegistry()
+        registry.configure(self.directory)
+        self.addCleanup(atexit.unregister, registry._flush_at_exit)
+        registry.counter('requests_total', 'Requests').inc()
+        view_metrics = mock.patch('main.views.metrics', registry)
+        view_metrics.start()
+        self.addCleanup(view_metrics.stop)
+
+    def scrape(self, token, debug=False, **headers):
+        with override_settings(METRICS={'DIR': self.directory, 'TOKEN': token}, DEBUG=debug):
+            return self.client.get('/metrics', headers=headers)
+
+    def test_no_token_outside_debug_is_forbidden(self):
+        self.assertEqual(self.scrape('').status_code, 403)
+
+    def test_no_token_in_debug_is_served(self):
+        response = self.scrape('', debug=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('requests_total 1', response.content.decode('utf-8'))
+
+    def test_bearer_token_is_checked(self):
+        self.assertEqual(self.scrape('secret').status_code, 403)
+        self.assertEqual(self.scrape('secret', Authorization='Bearer wrong').status_code, 403)
+        # DEBUG does not bypass a configured token
+        self.assertEqual(self.scrape('secret', debug=True).status_code, 403)
+
+        response = self.scrape('secret', Authorization='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
@@ -19,12 +19,14 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from .views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),
     path('wardrobe/', include('wardrobe.urls')),
     path('clothing-processor/', include('clothing_processor.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 # Serve media files in development
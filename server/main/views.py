@@ -0,0 +1,20 @@
+import hmac
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from .metrics import metrics
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint, aggregated over every worker process.
+    The scraper must send METRICS['TOKEN'] as a bearer token; without a
+    token configured the endpoint is only served when DEBUG is on.
+    """
+    token = settings.METRICS.get('TOKEN')
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif not hmac.compare_digest(request.headers.get('Authorization', '').removeprefix('Bearer ').strip(), token):
+        return HttpResponseForbidden()
+
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
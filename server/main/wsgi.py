@@ -11,6 +11,14 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'main.settings')
 
 application = get_wsgi_application()
+
+# Under a pre-fork server (gunicorn --preload, see gunicorn.conf.py) load the
+# models here, in the master, so that the forked workers share the weights.
+from django.conf import settings
+
+if settings.CLOTHING_PROCESSOR_PRELOAD:
+    from clothing_processor.registry import registry
+    registry.prepare_for_fork()
@@ -0,0 +1,170 @@
+import copy
+import time
+import logging
+import threading
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from main.metrics import metrics
+from .revocation import revocation_list
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_LOOKUPS = metrics.counter(
+    'users_auth_cache_lookups_total',
+    'JWT user lookups by the cache level that answered (local, shared or database)',
+    ['result'],
+)
+
+_local = {}
+_local_lock = threading.Lock()
+
+# Never written to the shared cache, which lives on disk
+PRIVATE_FIELDS = ('password',)
+
+
+def _settings():
+    return settings.USER_AUTH_CACHE
+
+
+def _cache():
+    return caches[_settings()['ALIAS']]
+
+
+def _generation_key(user_id):
+    return f"users:auth:generation:{user_id}"
+
+
+def _user_key(user_id):
+    return f"users:auth:user:{user_id}"
+
+
+def _generation(user_id):
+    """
+    Shared generation of a user's cached row, bumped on every save.
+
+    It is read on every lookup (one shared cache read, no query), so an
+    invalidation in any process applies to the next request everywhere.
+    """
+    cache = _cache()
+    generation = cache.get(_generation_key(user_id))
+    if generation is None:
+        cache.add(_generation_key(user_id), time.time_ns(), timeout=None)
+        generation = cache.get(_generation_key(user_id))
+    return generation
+
+
+def invalidate_user(user_id):
+    """
+    Drop the cached user once the current transaction commits, so a
+    concurrent lookup cannot re-cache the row from before the change.
+
+    Saves and deletes call this through signals, and User.objects.update()
+    through UserQuerySet. Raw SQL writes to the users table must call it
+    for every affected user themselves.
+    """
+    def bump():
+        with _local_lock:
+            _local.pop(user_id, None)
+        try:
+            _cache().set(_generation_key(user_id), time.time_ns(), timeout=None)
+        except Exception as e:
+            logger.error(f"Error invalidating the cached user {user_id}: {str(e)}")
+
+    transaction.on_commit(bump)
+
+
+def _dump_user(user):
+    """The user's column values for the shared cache, without PRIVATE_FIELDS."""
+    return {field.attname: getattr(user, field.attname)
+            for field in user._meta.concrete_fields if field.attname not in PRIVATE_FIELDS}
+
+
+def _load_user(user_model, values):
+    """
+    Rebuild a user from _dump_user() values. The private fields are
+    deferred, so reading one (e.g. user.password) loads it from the database.
+    """
+    field_names = [field.attname for field in user_model._meta.concrete_fields if field.attname in values]
+    return user_model.from_db(router.db_for_read(user_model), field_names,
+                              [values[name] for name in field_names])
+
+
+def get_cached_user(user_model, user_id):
+    """
+    Look a user up through the in-process cache, then the shared cache,
+    then the database.
+
+    Returns:
+        User: A copy the caller may modify, or None if no such user exists
+    """
+    options = _settings()
+    now = time.monotonic()
+    generation = _generation(user_id)
+
+    with _local_lock:
+        entry = _local.get(user_id)
+    if entry is not None and entry[0] == generation and entry[2] > now:
+        AUTH_CACHE_LOOKUPS.inc(result='local')
+        return copy.copy(entry[1])
+
+    cache = _cache()
+    values = cache.get(_user_key(user_id), version=generation)
+    if values is not None:
+        AUTH_CACHE_LOOKUPS.inc(result='shared')
+        user = _load_user(user_model, values)
+    else:
+        AUTH_CACHE_LOOKUPS.inc(result='database')
+        try:
+            user = user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except user_model.DoesNotExist:
+            return None
+        cache.set(_user_key(user_id), _dump_user(user), timeout=options['TTL'], version=generation)
+
+    with _local_lock:
+        if len(_local) >= options['LOCAL_MAX_ENTRIES']:
+            _local.pop(next(iter(_local)))
+        _local[user_id] = (generation, user, now + options['LOCAL_TTL'])
+    return copy.copy(user)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the user_id claim through
+    get_cached_user, so authenticated requests that hit the cache make no
+    database query. The same checks as the stock get_user are applied, and
+    access tokens revoked at logout are rejected.
+    """
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if revocation_list.is_revoked(validated_token.get(api_settings.JTI_CLAIM)):
+            raise InvalidToken(_("Token has been revoked"))
+        return validated_token
+
+    def get_user(self, validated_token):
+        if not _settings()['ENABLED']:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = get_cached_user(self.user_model, user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if getattr(api_settings, 'CHECK_USER_IS_ACTIVE', True) and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if getattr(api_settings, 'CHECK_REVOKE_TOKEN', False):
+            from rest_framework_simplejwt.utils import get_md5_hash_password
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
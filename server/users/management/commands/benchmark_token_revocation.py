@@ -0,0 +1,87 @@
+import json
+import time
+import uuid
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+from users.models import User
+from users.revocation import revocation_list
+from users.views import logout_view, token_refresh_view
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure refresh, logout and revocation check throughput (requests per second and queries per request)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500,
+                            help='Refresh and logout requests to time')
+        parser.add_argument('--checks', type=int, default=100000,
+                            help='Revocation checks of unrevoked JTIs to time')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('--requests must be at least 1')
+
+        # Users and revoked tokens are created in a transaction that is rolled back
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    email=f"benchmark-{uuid.uuid4().hex}@example.com", first_name='Bench', last_name='Mark',
+                    gender='F', birthday=date(1990, 1, 1), password=None)
+                rows = [
+                    ('refresh', *self._refresh(user, options['requests'])),
+                    ('logout', *self._logout(user, options['requests'])),
+                    ('check', *self._checks(options['checks'])),
+                ]
+                raise Rollback()
+        except Rollback:
+            pass
+
+        self.stdout.write(f"{'operation':<10}{'count':>9}{'per second':>13}{'queries each':>15}")
+        for name, count, seconds, queries in rows:
+            self.stdout.write(f"{name:<10}{count:>9}{count / seconds:>13.0f}{queries / count:>15.2f}")
+
+    def _post(self, view, path, body):
+        request = RequestFactory().post(path, json.dumps(body), content_type='application/json')
+        response = view(request)
+        if response.status_code != 200:
+            raise CommandError(f"{path} returned {response.status_code}: {response.content[:200]}")
+        return json.loads(response.content)
+
+    def _refresh(self, user, count):
+        """Rotate one refresh token count times, as a client would."""
+        refresh = str(RefreshToken.for_user(user))
+        with CaptureQueriesContext(connection) as context:
+            start_time = time.perf_counter()
+            for _ in range(count):
+                data = self._post(token_refresh_view, '/users/token/refresh/', {'refresh': refresh})
+                refresh = data.get('refresh', refresh)
+            seconds = time.perf_counter() - start_time
+        return count, seconds, len(context.captured_queries)
+
+    def _logout(self, user, count):
+        tokens = [str(RefreshToken.for_user(user)) for _ in range(count)]
+        with CaptureQueriesContext(connection) as context:
+            start_time = time.perf_counter()
+            for token in tokens:
+                self._post(logout_view, '/users/logout/', {'refresh': token})
+            seconds = time.perf_counter() - start_time
+        return count, seconds, len(context.captured_queries)
+
+    def _checks(self, count):
+        """The check every authenticated request makes for its access token."""
+        jtis = [uuid.uuid4().hex for _ in range(count)]
+        revocation_list.build()
+        with CaptureQueriesContext(connection) as context:
+            start_time = time.perf_counter()
+            for jti in jtis:
+                revocation_list.is_revoked(jti)
+            seconds = time.perf_counter() - start_time
+        return count, seconds, len(context.captured_queries)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from users.revocation import revocation_list
+
+
+class Command(BaseCommand):
+    help = 'Delete revoked tokens that have expired and rebuild the revocation filters'
+
+    def handle(self, *args, **options):
+        count = revocation_list.prune()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} expired revoked tokens"))
@@ -3,7 +3,19 @@ from django.db import models
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """update() sends no post_save, so drop the cached copies of the changed users here."""
+        from .authentication import invalidate_user
+
+        user_ids = list(self.values_list('pk', flat=True))
+        count = super().update(**kwargs)
+        for user_id in user_ids:
+            invalidate_user(user_id)
+        return count
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     def create_user(self, email, first_name, last_name, gender, birthday, password=None, **extra_fields):
         if not email:
             raise ValueError("L'email est obligatoire")
@@ -83,3 +95,27 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     def __str__(self):
         return self.email
+
+
+class RevokedToken(models.Model):
+    """A refresh token that was rotated or logged out, or an access token that was logged out."""
+    TOKEN_TYPE_CHOICES = [('refresh', 'Refresh'), ('access', 'Access')]
+
+    jti = models.CharField(max_length=255, unique=True)
+    token_type = models.CharField(max_length=10, choices=TOKEN_TYPE_CHOICES)
+    # Not a foreign key: tokens of deleted users may still be presented
+    user_id = models.BigIntegerField(null=True, blank=True)
+    # The row can be deleted once the token would have expired anyway
+    expires_at = models.DateTimeField()
+    revoked_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'revoked_tokens'
+        indexes = [
+            # Pruning and the incremental filter sync
+            models.Index(fields=['expires_at'], name='revoked_token_expires_idx'),
+            models.Index(fields=['revoked_at'], name='revoked_token_revoked_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token_type} {self.jti}"
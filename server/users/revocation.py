@@ -0,0 +1,249 @@
+import math
+import time
+import hashlib
+import logging
+import threading
+import traceback
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from main.metrics import metrics
+from .models import RevokedToken
+
+logger = logging.getLogger(__name__)
+
+REVOCATION_CHECKS = metrics.counter(
+    'users_token_revocation_checks_total',
+    'Revocation checks by outcome (filter_negative needs no query, unfiltered ran before the first build)',
+    ['result'],
+)
+
+GENERATION_KEY = 'users:revocation:generation'
+EPOCH_KEY = 'users:revocation:epoch'
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    Sized for capacity items at error_rate false positives; the k bit
+    positions come from one blake2b digest by double hashing.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class RevocationList:
+    """
+    Revoked JTIs: a Bloom filter in each process in front of the
+    RevokedToken table.
+
+    A JTI the filter has never seen is not revoked, which answers almost
+    every check without a query; a filter hit is confirmed in the database.
+    Revoking bumps a generation counter in the shared cache, and other
+    processes load the newly revoked rows when they see it change (checked
+    at most every CHECK_INTERVAL seconds). Bloom filters cannot forget, so
+    the filter is rebuilt from the unexpired rows every REBUILD_INTERVAL
+    seconds, after pruning, or when it outgrows its capacity. Rebuilds scan
+    the table in a background thread while checks keep using the old filter
+    (or, before the first build, the table itself).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._filter = None
+        self._built_at = 0.0
+        self._synced_at = None
+        self._generation = None
+        self._epoch = None
+        self._checked_at = 0.0
+        self._rebuilding = False
+        self._syncing = False
+        # JTIs revoked in this process while a build runs, added to the new filter
+        self._pending = None
+
+    def _options(self):
+        return settings.TOKEN_REVOCATION
+
+    def _cache(self):
+        return caches[self._options()['ALIAS']]
+
+    def build(self):
+        """
+        Build a new filter from the unexpired rows in the calling thread and
+        swap it in. Management commands call this to build ahead of use.
+        """
+        options = self._options()
+        cache = self._cache()
+        generation, epoch = cache.get(GENERATION_KEY), cache.get(EPOCH_KEY)
+        with self._lock:
+            if self._pending is None:
+                self._pending = set()
+
+        synced_at = timezone.now()
+        jtis = list(RevokedToken.objects.filter(expires_at__gt=synced_at).values_list('jti', flat=True))
+        bloom = BloomFilter(max(options['CAPACITY'], 2 * len(jtis)), options['ERROR_RATE'])
+        for jti in jtis:
+            bloom.add(jti)
+
+        with self._lock:
+            for jti in self._pending or ():
+                bloom.add(jti)
+            self._pending = None
+            self._filter = bloom
+            self._built_at = time.monotonic()
+            # Rows revoked elsewhere during the scan arrive with the next sync
+            self._synced_at = synced_at
+            self._generation, self._epoch = generation, epoch
+        logger.info(f"Built the token revocation filter with {len(jtis)} JTIs")
+
+    def _start_rebuild(self):
+        """Start a background build unless one is running (called with the lock held)."""
+        if self._rebuilding:
+            return
+        self._rebuilding = True
+        if self._pending is None:
+            self._pending = set()
+        threading.Thread(target=self._background_rebuild, name='revocation-rebuild', daemon=True).start()
+
+    def _background_rebuild(self):
+        try:
+            self.build()
+        except Exception as e:
+            logger.error(f"Error building the token revocation filter: {str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            with self._lock:
+                self._rebuilding = False
+            connections.close_all()
+
+    def _sync(self):
+        """Bring the filter up to date with the table if another process revoked or pruned."""
+        options = self._options()
+        now = time.monotonic()
+        if self._filter is not None and now - self._checked_at < options['CHECK_INTERVAL']:
+            return
+        cache = self._cache()
+        generation, epoch = cache.get(GENERATION_KEY), cache.get(EPOCH_KEY)
+
+        with self._lock:
+            self._checked_at = now
+            if (self._filter is None or epoch != self._epoch
+                    or now - self._built_at >= options['REBUILD_INTERVAL']
+                    or self._filter.count >= self._filter.capacity):
+                self._start_rebuild()
+            if self._filter is None or generation == self._generation or self._syncing:
+                return
+            self._syncing = True
+            # Rows committed late can carry an earlier revoked_at
+            since = self._synced_at - timedelta(seconds=options['SYNC_OVERLAP_SECONDS'])
+
+        # Query without the lock so checks in other threads do not wait on the database
+        try:
+            synced_at = timezone.now()
+            jtis = list(RevokedToken.objects.filter(revoked_at__gte=since).values_list('jti', flat=True))
+        except Exception:
+            with self._lock:
+                self._syncing = False
+            raise
+
+        with self._lock:
+            self._syncing = False
+            # A rebuild may have swapped in a newer filter meanwhile; the rows are revoked either way
+            for jti in jtis:
+                self._filter.add(jti)
+            if self._pending is not None:
+                self._pending.update(jtis)
+            self._synced_at = max(self._synced_at, synced_at)
+            self._generation = generation
+
+    def is_revoked(self, jti):
+        if not jti:
+            return False
+        self._sync()
+        bloom = self._filter
+        if bloom is None:
+            # The first build is still running
+            revoked = RevokedToken.objects.filter(jti=jti).exists()
+            REVOCATION_CHECKS.inc(result='unfiltered')
+            return revoked
+        if jti not in bloom:
+            REVOCATION_CHECKS.inc(result='filter_negative')
+            return False
+        revoked = RevokedToken.objects.filter(jti=jti).exists()
+        REVOCATION_CHECKS.inc(result='revoked' if revoked else 'false_positive')
+        return revoked
+
+    def revoke(self, token):
+        """
+        Record a token as revoked.
+
+        The unique jti column makes this the atomic gate for rotation: of two
+        requests revoking the same refresh token, only one gets True.
+
+        Returns:
+            bool: False if the token was already revoked
+        """
+        jti = token.get(api_settings.JTI_CLAIM)
+        if not jti:
+            return False
+        expires_at = datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc)
+        try:
+            with transaction.atomic():
+                RevokedToken.objects.create(jti=jti, token_type=token.get(api_settings.TOKEN_TYPE_CLAIM, ''),
+                                            user_id=token.get(api_settings.USER_ID_CLAIM),
+                                            expires_at=expires_at)
+        except IntegrityError:
+            return False
+
+        self._sync()
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+            if self._pending is not None:
+                self._pending.add(jti)
+        transaction.on_commit(self._bump_generation)
+        return True
+
+    def _bump_generation(self):
+        try:
+            self._cache().set(GENERATION_KEY, time.time_ns(), timeout=None)
+        except Exception as e:
+            logger.error(f"Error publishing a token revocation: {str(e)}")
+
+    def prune(self):
+        """
+        Delete the rows of tokens that have expired and make every process
+        rebuild its filter without them.
+
+        Returns:
+            int: Number of rows deleted
+        """
+        count, _ = RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+        self._cache().set(EPOCH_KEY, time.time_ns(), timeout=None)
+        return count
+
+
+revocation_list = RevocationList()
@@ -0,0 +1,148 @@
+import uuid
+from datetime import date, timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import authentication
+from .authentication import CachedJWTAuthentication, get_cached_user
+from .models import RevokedToken, User
+from .revocation import GENERATION_KEY, RevocationList, revocation_list
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'wardrobe': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'wardrobe'},
+    'users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'users'},
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class TokenRevocationTests(TestCase):
+    """Rotated and logged-out tokens stop working; other tokens need no query."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='owner@example.com', first_name='Test', last_name='User',
+                                             gender='F', birthday=date(1990, 1, 1), password='password')
+        revocation_list.build()
+
+    def refresh(self, token):
+        return self.client.post('/users/token/refresh/', {'refresh': token}, content_type='application/json')
+
+    def test_rotated_refresh_token_is_revoked(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        response = self.refresh(refresh)
+        self.assertEqual(response.status_code, 200)
+        rotated = response.json()['refresh']
+        self.assertNotEqual(rotated, refresh)
+
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+        self.assertEqual(self.refresh(rotated).status_code, 200)
+
+    def test_logout_revokes_refresh_and_access_tokens(self):
+        refresh = RefreshToken.for_user(self.user)
+        access = str(refresh.access_token)
+        list_url = '/wardrobe/clothing-items/'
+        self.assertEqual(self.client.get(list_url, HTTP_AUTHORIZATION=f"Bearer {access}").status_code, 200)
+
+        response = self.client.post('/users/logout/', {'refresh': str(refresh)}, content_type='application/json',
+                                    HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.refresh(str(refresh)).status_code, 401)
+        self.assertEqual(self.client.get(list_url, HTTP_AUTHORIZATION=f"Bearer {access}").status_code, 401)
+
+    def test_unrevoked_check_makes_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(revocation_list.is_revoked(uuid.uuid4().hex))
+
+    def test_rebuild_keeps_unexpired_rows_only(self):
+        now = timezone.now()
+        RevokedToken.objects.create(jti='expired', token_type='refresh', expires_at=now - timedelta(hours=1))
+        RevokedToken.objects.create(jti='current', token_type='refresh', expires_at=now + timedelta(hours=1))
+        revocation_list.build()
+        self.assertTrue(revocation_list.is_revoked('current'))
+        self.assertNotIn('expired', revocation_list._filter)
+        self.assertEqual(revocation_list.prune(), 1)
+
+    def test_checks_before_the_first_build_use_the_table(self):
+        revocations = RevocationList()
+        # Keep the background build out of the test transaction
+        revocations._rebuilding = True
+        RevokedToken.objects.create(jti='revoked', token_type='access', expires_at=timezone.now() + timedelta(hours=1))
+        self.assertTrue(revocations.is_revoked('revoked'))
+        self.assertFalse(revocations.is_revoked('other'))
+
+    def test_sync_loads_rows_revoked_elsewhere_without_holding_the_lock(self):
+        revocations = RevocationList()
+        revocations.build()
+        # Another process revokes a token and bumps the generation
+        RevokedToken.objects.create(jti='elsewhere', token_type='access', expires_at=timezone.now() + timedelta(hours=1))
+        revocations._cache().set(GENERATION_KEY, 1)
+        revocations._checked_at = float('-inf')
+
+        lock_held = []
+        query = RevokedToken.objects.filter
+
+        def filter(*args, **kwargs):
+            lock_held.append(revocations._lock.locked())
+            return query(*args, **kwargs)
+
+        with mock.patch.object(RevokedToken.objects, 'filter', side_effect=filter):
+            revocations._sync()
+        self.assertEqual(lock_held, [False])
+        self.assertTrue(revocations.is_revoked('elsewhere'))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CachedAuthenticationTests(TestCase):
+    """Cached users need no query and stop authenticating as soon as they change."""
+
+    def setUp(self):
+        authentication._local.clear()
+        authentication._cache().clear()
+        self.user = User.objects.create_user(email='owner@example.com', first_name='Test', last_name='User',
+                                             gender='F', birthday=date(1990, 1, 1), password='password')
+        self.token = AccessToken.for_user(self.user)
+        self.auth = CachedJWTAuthentication()
+
+    def test_cached_user_needs_no_query(self):
+        self.auth.get_user(self.token)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.auth.get_user(self.token).pk, self.user.pk)
+        # Another process only has the shared copy
+        authentication._local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.auth.get_user(self.token).email, 'owner@example.com')
+
+    def test_save_invalidates(self):
+        self.auth.get_user(self.token)
+        self.user.first_name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.auth.get_user(self.token).first_name, 'Renamed')
+
+    def test_queryset_update_deactivates_in_every_process_at_once(self):
+        self.auth.get_user(self.token)
+        # What another worker process still holds in memory
+        other_process = dict(authentication._local)
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+        authentication._local.update(other_process)
+        with self.assertRaises(AuthenticationFailed):
+            self.auth.get_user(self.token)
+
+    def test_password_hash_stays_out_of_the_shared_cache(self):
+        self.auth.get_user(self.token)
+        generation = authentication._generation(self.user.pk)
+        values = authentication._cache().get(authentication._user_key(self.user.pk), version=generation)
+        self.assertEqual(values['email'], 'owner@example.com')
+        self.assertNotIn('password', values)
+
+        authentication._local.clear()
+        user = get_cached_user(User, self.user.pk)
+        self.assertIn('password', user.get_deferred_fields())
+        # Reading it loads it from the database
+        self.assertTrue(user.check_password('password'))
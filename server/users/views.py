@@ -2,10 +2,13 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.exceptions import ValidationError
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
 from django.utils import timezone
 import json
 from .models import User
+from .revocation import revocation_list
 import uuid
 import traceback
 
@@ -177,12 +180,54 @@ def token_refresh_view(request):
                 
             # Create a new access token from the refresh token
             refresh = RefreshToken(refresh_token)
+            if revocation_list.is_revoked(refresh.get(jwt_settings.JTI_CLAIM)):
+                return JsonResponse({'error': 'Token has been revoked'}, status=401)
             
-            return JsonResponse({
-                'access': str(refresh.access_token)
-            }, status=200)
+            data = {'access': str(refresh.access_token)}
+            
+            if jwt_settings.ROTATE_REFRESH_TOKENS:
+                # Retire the presented token; losing this race means it was already used
+                if jwt_settings.BLACKLIST_AFTER_ROTATION and not revocation_list.revoke(refresh):
+                    return JsonResponse({'error': 'Token has been revoked'}, status=401)
+                refresh.set_jti()
+                refresh.set_exp()
+                refresh.set_iat()
+                data['refresh'] = str(refresh)
+            
+            return JsonResponse(data, status=200)
             
         except Exception as e:
             return JsonResponse({'error': f'Token refresh failed: {str(e)}'}, status=400)
             
     return JsonResponse({'error': 'Invalid request'}, status=400)
+
+@csrf_exempt
+def logout_view(request):
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            refresh_token = data.get('refresh')
+            
+            if not refresh_token:
+                return JsonResponse({'error': 'Refresh token is required'}, status=400)
+            
+            try:
+                revocation_list.revoke(RefreshToken(refresh_token))
+            except TokenError:
+                # Expired or invalid tokens cannot be used anyway
+                pass
+            
+            # Also end the access token sent with the request, if any
+            header = request.headers.get('Authorization', '').split()
+            if len(header) == 2 and header[0] in jwt_settings.AUTH_HEADER_TYPES:
+                try:
+                    revocation_list.revoke(AccessToken(header[1]))
+                except TokenError:
+                    pass
+            
+            return JsonResponse({'message': 'Logged out'}, status=200)
+            
+        except Exception as e:
+            return JsonResponse({'error': f'Logout failed: {str(e)}'}, status=400)
+            
+    return JsonResponse({'error': 'Invalid request'}, status=400)
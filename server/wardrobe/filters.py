@@ -0,0 +1,118 @@
+import re
+import numpy as np
+from datetime import datetime, time
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from clothing_processor.color_names import color_hex, hex_to_rgb_array, name_color
+from clothing_processor.colors import srgb_to_lab
+from .models import ClothingItem
+
+HEX_COLOR = re.compile(r'^#?([0-9a-fA-F]{6})$')
+# A stored color this close (CIE76 Lab distance) to a hex query matches it
+COLOR_MATCH_DISTANCE = 10.0
+
+
+def _parse_bound(value, param, end_of_day=False):
+    """Parse an ISO date or datetime query parameter into an aware datetime."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValidationError({param: f"Expected an ISO date or datetime, got '{value}'"})
+        parsed = datetime.combine(day, time.max if end_of_day else time.min)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_color(value):
+    """
+    Parse a color query given as hex ('#1f2a44') or by name ('navy').
+
+    Returns:
+        tuple: ('hex', '#rrggbb') or ('name', palette name)
+    """
+    match = HEX_COLOR.match(value.strip())
+    if match:
+        return 'hex', f"#{match.group(1).lower()}"
+    hex_color = color_hex(value)
+    if hex_color is None:
+        raise ValidationError({'color': f"Unknown color '{value}'"})
+    return 'name', name_color(hex_color)
+
+
+def items_near_colors(queryset, hex_colors, distance=COLOR_MATCH_DISTANCE):
+    """
+    Ids of the items in queryset with a stored color within distance (CIE76
+    Lab) of any of hex_colors.
+
+    Shades are not something the jsonb index can answer, so the stored
+    colors of the already filtered items are compared in one vectorized pass.
+    """
+    ids, stored = [], []
+    for pk, colors in queryset.values_list('pk', 'metadata__colors'):
+        for color in colors if isinstance(colors, list) else []:
+            if isinstance(color, str) and HEX_COLOR.match(color):
+                ids.append(pk)
+                stored.append(color)
+    if not stored:
+        return []
+
+    stored_lab = srgb_to_lab(hex_to_rgb_array(stored))
+    target_lab = srgb_to_lab(hex_to_rgb_array(hex_colors))
+    distances = np.linalg.norm(stored_lab[:, None, :] - target_lab[None, :, :], axis=-1)
+    near = (distances <= distance).any(axis=1)
+    return sorted({pk for pk, match in zip(ids, near) if match})
+
+
+def filter_clothing_items(queryset, params):
+    """
+    Apply the list filters from the query string.
+
+    Supported parameters:
+        category: One or more categories, comma separated
+        created_after / created_before: ISO date or datetime bounds
+        color: Named color (matched by palette name) or hex color (matched by
+            Lab distance to the stored colors); several comma separated
+            match any of them
+        q: Keyword matched against the name and the description
+
+    Raises:
+        ValidationError: On an unknown category or color or a malformed date
+    """
+    categories = params.get('category')
+    if categories:
+        valid = {value for value, _ in ClothingItem.CATEGORY_CHOICES}
+        requested = [category.strip() for category in categories.split(',') if category.strip()]
+        unknown = [category for category in requested if category not in valid]
+        if unknown:
+            raise ValidationError({'category': f"Unknown category: {', '.join(unknown)}"})
+        queryset = queryset.filter(category__in=requested)
+
+    if params.get('created_after'):
+        queryset = queryset.filter(created_at__gte=_parse_bound(params['created_after'], 'created_after'))
+    if params.get('created_before'):
+        queryset = queryset.filter(
+            created_at__lte=_parse_bound(params['created_before'], 'created_before', end_of_day=True))
+
+    colors = params.get('color')
+    if colors:
+        parsed = [parse_color(color) for color in colors.split(',') if color.strip()]
+        # Names are jsonb containment (@>) served by the GIN index on metadata
+        condition = Q()
+        for kind, value in parsed:
+            if kind == 'name':
+                condition |= Q(metadata__contains={'color_names': [value]})
+        hex_colors = [value for kind, value in parsed if kind == 'hex']
+        if hex_colors:
+            condition |= Q(pk__in=items_near_colors(queryset, hex_colors))
+        queryset = queryset.filter(condition)
+
+    keyword = (params.get('q') or '').strip()
+    if keyword:
+        # UPPER(...) LIKE UPPER('%keyword%'), served by the trigram indexes
+        queryset = queryset.filter(Q(name__icontains=keyword) | Q(metadata__description__icontains=keyword))
+
+    return queryset
@@ -0,0 +1,168 @@
+import json
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.http import HttpResponse
+from django.utils.encoding import filepath_to_uri
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from .models import ClothingItem
+from .serializers import ClothingItemSerializer
+from .thumbnails import THUMBNAIL_FIELDS, recorded_thumbnails, thumbnail_sizes
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# Columns each serialized field needs
+FIELD_COLUMNS = {
+    'id': ('id',),
+    'name': ('name',),
+    'category': ('category',),
+    'original_image': ('original_image',),
+    'original_image_url': ('original_image',),
+    'segmented_image': ('segmented_image',),
+    'segmented_image_url': ('segmented_image',),
+    'thumbnails': ('id', 'original_image', 'segmented_image', 'thumbnails'),
+    'metadata': ('metadata',),
+    'created_at': ('created_at',),
+    'updated_at': ('updated_at',),
+    'category_display': ('category',),
+}
+
+CATEGORY_LABELS = dict(ClothingItem.CATEGORY_CHOICES)
+
+_datetime_field = serializers.DateTimeField()
+
+
+def _has_exponent_float(value):
+    """
+    True for floats Python's json writes in exponent form. orjson spells
+    those differently (1e-05 vs 1e-5), so such pages use the json module.
+    """
+    if isinstance(value, float):
+        return value != 0 and (abs(value) < 1e-4 or abs(value) >= 1e16)
+    if isinstance(value, dict):
+        return any(_has_exponent_float(item) for item in value.values())
+    if isinstance(value, list):
+        return any(_has_exponent_float(item) for item in value)
+    return False
+
+
+def can_render_fast(request):
+    """
+    The fast path only reproduces plain JSONRenderer output (no Accept
+    parameters such as indent) for files in the default file system
+    storage; anything else goes through DRF.
+    """
+    return (type(getattr(request, 'accepted_renderer', None)) is JSONRenderer
+            and ';' not in (getattr(request, 'accepted_media_type', None) or '')
+            and isinstance(default_storage, FileSystemStorage)
+            and api_settings.COMPACT_JSON and api_settings.UNICODE_JSON)
+
+
+def output_fields(request):
+    """Field names in serializer order, honouring ?fields= like SparseFieldsMixin."""
+    fields = list(ClothingItemSerializer.Meta.fields)
+    value = request.query_params.get('fields')
+    if not value:
+        return fields + ['category_display']
+    requested = {name.strip() for name in value.split(',') if name.strip()}
+    requested |= set(ClothingItemSerializer.always_included)
+    fields = [name for name in fields if name in requested]
+    if 'category_display' in requested:
+        fields.append('category_display')
+    return fields
+
+
+def value_columns(fields):
+    """The .values() columns needed for fields, including the cursor ordering."""
+    columns = ['id', 'created_at']
+    for name in fields:
+        for column in FIELD_COLUMNS[name]:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+class RowRenderer:
+    """
+    Turn .values() rows into the dicts ClothingItemSerializer would produce.
+
+    build_absolute_uri is called once per request: media URLs are the
+    absolute MEDIA_URL prefix plus the quoted file name.
+    """
+
+    def __init__(self, request, fields):
+        self.fields = fields
+        self.media_prefix = request.build_absolute_uri(default_storage.base_url)
+        self.sizes = [str(size) for size in thumbnail_sizes()]
+        self.exponent_floats = False
+
+    def media_url(self, name):
+        return self.media_prefix + filepath_to_uri(name).lstrip('/') if name else None
+
+    def thumbnails(self, row):
+        thumbnails = {}
+        for field in THUMBNAIL_FIELDS:
+            source = row[f"{field}_image"]
+            if not source:
+                continue
+            recorded = recorded_thumbnails(row['thumbnails'], field, source)
+            # Sizes not generated yet fall back to the image itself
+            thumbnails[field] = {size: self.media_url(recorded.get(size) or source) for size in self.sizes}
+        return thumbnails
+
+    def render_row(self, row):
+        item = {}
+        for name in self.fields:
+            if name in ('original_image', 'original_image_url'):
+                item[name] = self.media_url(row['original_image'])
+            elif name in ('segmented_image', 'segmented_image_url'):
+                item[name] = self.media_url(row['segmented_image'])
+            elif name == 'thumbnails':
+                item[name] = self.thumbnails(row)
+            elif name in ('created_at', 'updated_at'):
+                item[name] = _datetime_field.to_representation(row[name])
+            elif name == 'category_display':
+                item[name] = str(CATEGORY_LABELS.get(row['category'], row['category']))
+            elif name == 'metadata':
+                item[name] = row[name]
+                if orjson is not None and not self.exponent_floats:
+                    self.exponent_floats = _has_exponent_float(row[name])
+            else:
+                item[name] = row[name]
+        return item
+
+
+def dump_json(data, use_orjson=True):
+    """Encode like JSONRenderer (compact, unescaped unicode), with orjson when installed."""
+    try:
+        if orjson is None or not use_orjson:
+            raise TypeError('orjson is not used')
+        content = orjson.dumps(data).decode('utf-8')
+    except TypeError:
+        # Not installed, or a value orjson refuses (e.g. an int over 64 bits)
+        content = json.dumps(data, ensure_ascii=False, allow_nan=not api_settings.STRICT_JSON,
+                             separators=(',', ':'))
+    # Same escaping as JSONRenderer for JavaScript compatibility
+    return content.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode('utf-8')
+
+
+def fast_list_response(view, request, queryset):
+    """
+    Render a page of the wardrobe list straight from .values() rows.
+
+    The bytes match what the DRF serializer and JSONRenderer produce for
+    the same page, so clients cannot tell which path answered.
+    """
+    fields = output_fields(request)
+    rows = queryset.values(*value_columns(fields))
+    page = view.paginate_queryset(rows)
+    renderer = RowRenderer(request, fields)
+    if page is None:
+        data = [renderer.render_row(row) for row in rows]
+    else:
+        data = view.get_paginated_response([renderer.render_row(row) for row in page]).data
+    content = dump_json(data, use_orjson=not renderer.exponent_floats)
+    return HttpResponse(content, content_type='application/json')
@@ -0,0 +1,112 @@
+import json
+import time
+import uuid
+import statistics
+from datetime import date
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+from users.models import User
+from wardrobe.models import ClothingItem
+from wardrobe.views import ClothingItemViewSet
+
+CATEGORIES = [value for value, _ in ClothingItem.CATEGORY_CHOICES]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time the wardrobe list with the DRF serializer and the .values() fast path, and check both return the same bytes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='*', type=int, default=[10, 1000, 10000],
+                            help='Wardrobe sizes to benchmark')
+        parser.add_argument('--page-size', type=int, default=200,
+                            help='Items per list page (every page is fetched)')
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Timed walks over the whole wardrobe per path')
+        parser.add_argument('--fields',
+                            help='Also pass this ?fields= value, e.g. id,name,thumbnails')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be at least 1')
+
+        self.stdout.write(f"{'items':>7}{'path':>8}{'p50 ms':>11}{'min ms':>11}{'queries':>9}")
+        for size in options['sizes']:
+            # Everything is created inside a transaction that is rolled back
+            try:
+                with transaction.atomic():
+                    user = self._create_wardrobe(size)
+                    results = {path: self._measure(user, path == 'fast', options) for path in ('drf', 'fast')}
+                    raise Rollback()
+            except Rollback:
+                pass
+
+            for path, (timings, queries, _) in results.items():
+                self.stdout.write(f"{size:>7}{path:>8}{statistics.median(timings):>11.1f}"
+                                  f"{min(timings):>11.1f}{queries:>9}")
+            if results['drf'][2] != results['fast'][2]:
+                raise CommandError(f"The fast path returned different bytes for {size} items")
+            speedup = statistics.median(results['drf'][0]) / max(statistics.median(results['fast'][0]), 1e-9)
+            self.stdout.write(self.style.SUCCESS(f"{size} items: identical output, {speedup:.1f}x faster"))
+
+    def _create_wardrobe(self, size):
+        user = User.objects.create_user(
+            email=f"benchmark-{uuid.uuid4().hex}@example.com", first_name='Bench', last_name='Mark',
+            gender='F', birthday=date(1990, 1, 1), password=None)
+        ClothingItem.objects.bulk_create([
+            ClothingItem(
+                user=user,
+                name=f"Item {i} é",
+                category=CATEGORIES[i % len(CATEGORIES)],
+                original_image=f"clothes/original/bench_{i}.jpg",
+                segmented_image=f"clothes/segmented/bench_{i}.jpg" if i % 3 else None,
+                thumbnails={'original': {'source': f"clothes/original/bench_{i}.jpg",
+                                         '128': f"clothes/thumbnails/bench_{i}_128.webp"}} if i % 2 else {},
+                metadata={'colors': [[12, 34, 56], [200, 180, 160]], 'color_weights': [0.625, 0.375],
+                          'color_names': ['navy', 'beige'], 'description': f"Benchmark item {i}"},
+            )
+            for i in range(size)
+        ], batch_size=1000)
+        return user
+
+    def _measure(self, user, fast, options):
+        """Walk every page once untimed, then time options['runs'] walks."""
+        factory = APIRequestFactory()
+        view = ClothingItemViewSet.as_view({'get': 'list'})
+        params = {'page_size': options['page_size']}
+        if options['fields']:
+            params['fields'] = options['fields']
+
+        def walk():
+            pages = []
+            url, data = '/wardrobe/clothing-items/', params
+            while url:
+                request = factory.get(url, data, HTTP_ACCEPT='application/json')
+                force_authenticate(request, user=user)
+                response = view(request)
+                if hasattr(response, 'render'):
+                    response.render()
+                if response.status_code != 200:
+                    raise CommandError(f"List returned {response.status_code}: {response.content[:200]}")
+                pages.append(response.content)
+                url, data = json.loads(response.content).get('next'), None
+            return pages
+
+        # Serialization is measured, not the response cache
+        no_cache = dict(settings.WARDROBE_CACHE, ENABLED=False)
+        with override_settings(WARDROBE_FAST_LIST=fast, WARDROBE_CACHE=no_cache, ALLOWED_HOSTS=['testserver']):
+            with CaptureQueriesContext(connection) as context:
+                pages = walk()
+            timings = []
+            for _ in range(options['runs']):
+                start_time = time.perf_counter()
+                walk()
+                timings.append(1000 * (time.perf_counter() - start_time))
+        return timings, len(context.captured_queries), pages
+
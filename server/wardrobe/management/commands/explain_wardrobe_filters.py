@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import QueryDict
+from wardrobe.filters import filter_clothing_items
+from wardrobe.models import ClothingItem
+
+COMMON_FILTERS = [
+    'category=upper',
+    'category=lower&created_after=2025-01-01',
+    'color=%231f2a44',
+    'color=navy',
+    'q=shirt',
+    'category=upper&color=black&q=cotton',
+]
+
+
+class Command(BaseCommand):
+    help = 'Print the query plans of the common clothing item filters and flag sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int, help='User whose wardrobe the queries run against')
+        parser.add_argument('--filters', nargs='*', default=COMMON_FILTERS,
+                            help='Query strings to explain, e.g. "category=upper&q=shirt"')
+        parser.add_argument('--disable-seqscan', action='store_true',
+                            help='Check that an index can serve each filter even on a small table '
+                                 '(where the planner would rightly prefer a sequential scan)')
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(pk=options['user_id']).first()
+        if user is None:
+            raise CommandError(f"No user with id {options['user_id']}")
+
+        sequential = []
+        with transaction.atomic():
+            if options['disable_seqscan']:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for query_string in options['filters']:
+                queryset = filter_clothing_items(
+                    ClothingItem.objects.filter(user=user).order_by('-created_at', '-id'),
+                    QueryDict(query_string),
+                )
+                plan = queryset.explain()
+                self.stdout.write(self.style.MIGRATE_HEADING(query_string))
+                self.stdout.write(plan)
+                if 'Seq Scan on wardrobe_clothingitem' in plan:
+                    sequential.append(query_string)
+
+        if sequential:
+            self.stdout.write(self.style.WARNING(f"Sequential scans: {', '.join(sequential)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS('Every filter is served by an index'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from wardrobe.thumbnails import backfill_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Generate the missing or outdated WebP derivatives of every clothing item'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Items read from the database at a time')
+
+    def handle(self, *args, **options):
+        updated, failed = backfill_thumbnails(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Generated thumbnails for {updated} clothing items"))
+        if failed:
+            self.stderr.write(f"{failed} clothing items failed, see the log")
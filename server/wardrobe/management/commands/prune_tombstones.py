@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from wardrobe.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = 'Delete clothing item tombstones older than the sync retention period'
+
+    def handle(self, *args, **options):
+        count = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {count} tombstones"))
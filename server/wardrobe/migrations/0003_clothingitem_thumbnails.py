@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wardrobe', '0002_alter_clothingitem_original_image_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clothingitem',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AlterField(
+            model_name='clothingitem',
+            name='original_image',
+            field=models.ImageField(upload_to='clothes/original/'),
+        ),
+        migrations.AlterField(
+            model_name='clothingitem',
+            name='segmented_image',
+            field=models.ImageField(blank=True, null=True, upload_to='clothes/segmented/'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:25
+
+import django.contrib.postgres.indexes
+import django.db.models.fields.json
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wardrobe', '0004_clothingitem_sync'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='clothingitem',
+            index=models.Index(fields=['user', 'category', 'created_at'], name='wardrobe_item_user_cat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clothingitem',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['metadata'], name='wardrobe_item_meta_gin', opclasses=['jsonb_path_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='clothingitem',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='wardrobe_item_name_trgm'),
+        ),
+        migrations.AddIndex(
+            model_name='clothingitem',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.fields.json.KeyTextTransform('description', 'metadata')), name='gin_trgm_ops'), name='wardrobe_item_desc_trgm'),
+        ),
+    ]
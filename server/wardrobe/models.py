@@ -1,4 +1,7 @@
 from django.db import models
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Upper
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.conf import settings
 import json
 
@@ -18,9 +21,25 @@ class ClothingItem(models.Model):
     original_image = models.ImageField(upload_to='clothes/original/')
     segmented_image = models.ImageField(upload_to='clothes/segmented/', null=True, blank=True)
     metadata = models.JSONField(default=dict)
+    # WebP derivatives per image: {"original": {"source": name, "128": name, ...}, "segmented": {...}}
+    thumbnails = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    class Meta:
+        indexes = [
+            # Delta sync: a user's items changed since a timestamp
+            models.Index(fields=['user', 'updated_at'], name='wardrobe_item_user_upd_idx'),
+            # Category filter, newest first
+            models.Index(fields=['user', 'category', 'created_at'], name='wardrobe_item_user_cat_idx'),
+            # Color filters: metadata @> '{"colors": [...]}' / '{"color_names": [...]}'
+            GinIndex(fields=['metadata'], opclasses=['jsonb_path_ops'], name='wardrobe_item_meta_gin'),
+            # Keyword search: icontains compiles to UPPER(...) LIKE UPPER('%keyword%')
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='wardrobe_item_name_trgm'),
+            GinIndex(OpClass(Upper(KeyTextTransform('description', 'metadata')), name='gin_trgm_ops'),
+                     name='wardrobe_item_desc_trgm'),
+        ]
+    
     def __str__(self):
         return f"{self.name} - {self.get_category_display()}"
     
@@ -40,3 +59,19 @@ class ClothingItem(models.Model):
     def get_description(self):
         """Get the description from the metadata"""
         return self.metadata.get('description', '')
+
+
+class ClothingItemTombstone(models.Model):
+    """Record of a deleted clothing item, so sync clients can drop their copy."""
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='clothing_item_tombstones')
+    item_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='wardrobe_tomb_user_del_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Deleted clothing item {self.item_id}"
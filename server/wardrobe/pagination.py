@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ClothingItemCursorPagination(CursorPagination):
+    """
+    Newest-first cursor pagination for a user's wardrobe.
+
+    Cursors stay stable while items are added or deleted, unlike page
+    numbers, and each page is a single indexed range query.
+    """
+
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
@@ -0,0 +1,119 @@
+import time
+import hashlib
+import logging
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from main.metrics import metrics
+from .models import ClothingItem
+
+logger = logging.getLogger(__name__)
+
+CACHE_LOOKUPS = metrics.counter(
+    'wardrobe_cache_lookups_total',
+    'Wardrobe response cache lookups by endpoint and outcome',
+    ['endpoint', 'result'],
+)
+
+# Keyed by the choices themselves so a deploy that changes them starts afresh
+CATEGORIES_KEY = 'wardrobe:categories:' + hashlib.sha1(
+    repr(ClothingItem.CATEGORY_CHOICES).encode('utf-8')).hexdigest()[:12]
+
+
+def _cache():
+    return caches[settings.WARDROBE_CACHE['ALIAS']]
+
+
+def enabled():
+    return settings.WARDROBE_CACHE['ENABLED']
+
+
+def _version_key(user_id):
+    return f"wardrobe:version:{user_id}"
+
+
+def wardrobe_version(user_id):
+    """
+    Current cache version of a user's wardrobe.
+
+    Versions are nanosecond timestamps rather than a counter, so a lost
+    version entry (culled or expired) can never bring back an old one.
+    """
+    cache = _cache()
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        cache.add(_version_key(user_id), time.time_ns(), timeout=None)
+        version = cache.get(_version_key(user_id))
+    return version
+
+
+def invalidate_wardrobe(user_id):
+    """
+    Move the user to a new cache version once the current transaction
+    commits, so readers cannot cache rows from before the write under it.
+    Entries of older versions are never read again and expire on their own.
+    """
+    if not enabled():
+        return
+
+    def bump():
+        try:
+            _cache().set(_version_key(user_id), time.time_ns(), timeout=None)
+        except Exception as e:
+            logger.error(f"Error invalidating the wardrobe cache of user {user_id}: {str(e)}")
+
+    transaction.on_commit(bump)
+
+
+def list_key(request):
+    """
+    Cache key of one list page. The query string covers cursor, page size,
+    fields and filters; the host is included because the page holds
+    absolute URLs.
+    """
+    query = hashlib.sha1(
+        f"{request.build_absolute_uri('/')}?{request.META.get('QUERY_STRING', '')}".encode('utf-8')
+    ).hexdigest()
+    return f"wardrobe:list:{request.user.pk}:{query}"
+
+
+def get_list(request):
+    """
+    Cached list page of the requesting user.
+
+    Returns:
+        tuple: (entry, version). entry is a dict of etag, last_modified,
+            content and content_type, or None on a miss; pass version to
+            put_list. Both are None when the cache is disabled.
+    """
+    if not enabled():
+        return None, None
+    version = wardrobe_version(request.user.pk)
+    entry = _cache().get(list_key(request), version=version)
+    CACHE_LOOKUPS.inc(endpoint='list', result='hit' if entry is not None else 'miss')
+    return entry, version
+
+
+def put_list(request, version, etag, last_modified, response):
+    """
+    Store a rendered list page under the version read before the page was
+    built; if a write bumped the version meanwhile the entry is never read.
+    """
+    if version is None:
+        return
+    entry = {'etag': etag, 'last_modified': last_modified,
+             'content': response.content, 'content_type': response['Content-Type']}
+    _cache().set(list_key(request), entry, timeout=settings.WARDROBE_CACHE['TIMEOUT'], version=version)
+
+
+def get_categories(build):
+    """The category list never changes at runtime, so it is cached once for everyone."""
+    if not enabled():
+        return build()
+    cache = _cache()
+    categories = cache.get(CATEGORIES_KEY)
+    CACHE_LOOKUPS.inc(endpoint='categories', result='hit' if categories is not None else 'miss')
+    if categories is None:
+        categories = build()
+        cache.set(CATEGORIES_KEY, categories, timeout=None)
+    return categories
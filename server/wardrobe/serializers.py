@@ -1,14 +1,39 @@
 from rest_framework import serializers
 from .models import ClothingItem
+from .thumbnails import THUMBNAIL_FIELDS, recorded_thumbnails, thumbnail_sizes
 from django.conf import settings
 
-class ClothingItemSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Limit the serialized fields with a `fields` query parameter, e.g.
+    ?fields=id,name,thumbnails. Unrequested method fields are never computed.
+    """
+    
+    always_included = ('id',)
+    
+    def requested_fields(self):
+        request = self.context.get('request')
+        value = request.query_params.get('fields') if request is not None else None
+        if not value:
+            return None
+        return {name.strip() for name in value.split(',') if name.strip()} | set(self.always_included)
+    
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.requested_fields()
+        if requested is None:
+            return fields
+        return {name: field for name, field in fields.items() if name in requested}
+
+
+class ClothingItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     original_image_url = serializers.SerializerMethodField()
     segmented_image_url = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = ClothingItem
-        fields = ['id', 'name', 'category', 'original_image', 'original_image_url', 'segmented_image', 'segmented_image_url', 'metadata', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'category', 'original_image', 'original_image_url', 'segmented_image', 'segmented_image_url', 'thumbnails', 'metadata', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
     
     def get_original_image_url(self, obj):
@@ -21,11 +46,32 @@ class ClothingItemSerializer(serializers.ModelSerializer):
             return self.context['request'].build_absolute_uri(obj.segmented_image.url)
         return None
     
+    def get_thumbnails(self, obj):
+        """
+        Size -> URL map of the WebP derivatives of each image, for srcset.
+        Sizes not generated yet point to the image itself: img tags send no
+        Authorization header, so they cannot use the thumbnail action.
+        """
+        request = self.context['request']
+        thumbnails = {}
+        for field in THUMBNAIL_FIELDS:
+            image = getattr(obj, f"{field}_image")
+            if not image:
+                continue
+            recorded = recorded_thumbnails(obj.thumbnails, field, image.name)
+            thumbnails[field] = {
+                str(size): request.build_absolute_uri(image.storage.url(recorded.get(str(size)) or image.name))
+                for size in thumbnail_sizes()
+            }
+        return thumbnails
+    
     def to_representation(self, instance):
         """Convert the instance to a dictionary for API responses"""
         representation = super().to_representation(instance)
         # Add the category display name
-        representation['category_display'] = instance.get_category_display()
+        requested = self.requested_fields()
+        if requested is None or 'category_display' in requested:
+            representation['category_display'] = instance.get_category_display()
         return representation
 
 class ClothingItemCreateSerializer(serializers.ModelSerializer):
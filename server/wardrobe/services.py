@@ -0,0 +1,89 @@
+import os
+import logging
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import transaction
+from .models import ClothingItem
+
+logger = logging.getLogger(__name__)
+
+# Clothing processor categories -> ClothingItem.CATEGORY_CHOICES
+PROCESSOR_CATEGORIES = {
+    'upper clothing': 'upper',
+    'lower clothing': 'lower',
+    'dress': 'dress',
+}
+
+
+def clothing_item_fields(garment):
+    """
+    Map one garment of a processing result to ClothingItem field values.
+
+    Args:
+        garment (dict): category, metadata and segmented_image of one garment
+
+    Returns:
+        dict: name, category and metadata for a ClothingItem
+    """
+    metadata = garment['metadata']
+    description = metadata.get('description') or ''
+    return {
+        'name': (description or 'New Clothing Item')[:100],
+        'category': PROCESSOR_CATEGORIES.get(garment['category'].lower(), 'upper'),
+        'metadata': {
+            'colors': metadata.get('colors') or ['#000000'],
+            'color_weights': metadata.get('color_weights', []),
+            'color_names': metadata.get('color_names', []),
+            'description': description or 'A clothing item',
+        },
+    }
+
+
+def create_clothing_items(user, image_name, image_bytes, result):
+    """
+    Create one ClothingItem per garment of a processing result.
+
+    All files are written first: the original upload once (every item
+    references the same stored file) and each segmented image copied from
+    the processing workspace. The rows are then inserted with a single
+    bulk_create inside one transaction, and the files are removed again if
+    the insert fails. The caller releases the workspace afterwards.
+
+    Every item deliberately shares one original_image file: the garments
+    come from the same photo, so it is stored once rather than once per
+    garment. Deleting an item leaves its files in place, so this is safe;
+    code that deletes or replaces an original_image must first check that
+    no other item still references it.
+
+    Args:
+        user: Owner of the new items
+        image_name (str): Filename of the upload
+        image_bytes (bytes): The uploaded image
+        result (dict): ClothingProcessorService result
+
+    Returns:
+        list: The created ClothingItems, in garment order
+    """
+    garments = result.get('items') or [result]
+    items = [ClothingItem(user=user, **clothing_item_fields(garment)) for garment in garments]
+
+    items[0].original_image.save(image_name, ContentFile(image_bytes), save=False)
+    stored_files = [items[0].original_image]
+    try:
+        for item, garment in zip(items, garments):
+            item.original_image = items[0].original_image.name
+            with open(garment['segmented_image'], 'rb') as f:
+                item.segmented_image.save(os.path.basename(garment['segmented_image']), File(f), save=False)
+            stored_files.append(item.segmented_image)
+
+        with transaction.atomic():
+            items = ClothingItem.objects.bulk_create(items)
+    except Exception:
+        # Do not leave orphaned files behind when the rows cannot be written
+        for stored_file in stored_files:
+            stored_file.delete(save=False)
+        raise
+
+    logger.info(f"Created {len(items)} clothing items ({', '.join(item.category for item in items)}) "
+                f"for user {user.pk}")
+    return items
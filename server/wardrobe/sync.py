@@ -0,0 +1,109 @@
+import base64
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from .models import ClothingItem, ClothingItemTombstone
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _to_micros(value):
+    return int(value.timestamp() * 1_000_000) if value else ''
+
+
+def _from_micros(value):
+    return datetime.fromtimestamp(int(value) / 1_000_000, tz=dt_timezone.utc) if value else None
+
+
+def encode_cursor(since, after_updated_at=None, after_id=None):
+    """
+    Opaque sync cursor: the start of the sync window and, while a sync is
+    spread over several pages, the (updated_at, id) of the last item sent.
+    """
+    raw = f"1:{_to_micros(since)}:{_to_micros(after_updated_at)}:{after_id or ''}"
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns:
+        tuple: (since, after_updated_at, after_id), any of which may be None
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        version, since, after_updated_at, after_id = raw.split(':')
+        if version != '1':
+            raise ValueError(version)
+        return _from_micros(since), _from_micros(after_updated_at), int(after_id) if after_id else None
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid sync cursor: {str(e)}")
+
+
+def changes_since(user, cursor=None, limit=None):
+    """
+    Collect a user's wardrobe changes since a sync cursor.
+
+    Items are returned in (updated_at, id) order from the (user, updated_at)
+    index. The window starts OVERLAP_SECONDS before the previous sync so a
+    change committed late by a concurrent request is not missed; clients
+    apply items and deletions idempotently, so resending one is harmless.
+    Tombstones are sent with the last page. A cursor older than the
+    tombstone retention period cannot be answered incrementally and
+    triggers a full resync ('reset'), as does a sync without a cursor.
+
+    Returns:
+        dict: items (a queryset slice), deleted (item ids), cursor, has_more and reset
+    """
+    sync_settings = settings.WARDROBE_SYNC
+    limit = limit or sync_settings['PAGE_SIZE']
+    started_at = timezone.now()
+    since, after_updated_at, after_id = decode_cursor(cursor) if cursor else (None, None, None)
+
+    reset = False
+    if since and since < started_at - timedelta(days=sync_settings['TOMBSTONE_RETENTION_DAYS']):
+        since = after_updated_at = after_id = None
+        reset = True
+    # A full sync: after its last page the client drops local items it did not receive
+    reset = reset or since is None
+    window_start = since - timedelta(seconds=sync_settings['OVERLAP_SECONDS']) if since else None
+
+    items = ClothingItem.objects.filter(user=user)
+    if after_updated_at:
+        items = items.filter(Q(updated_at__gt=after_updated_at) | Q(updated_at=after_updated_at, id__gt=after_id))
+    elif window_start:
+        items = items.filter(updated_at__gte=window_start)
+    items = list(items.order_by('updated_at', 'id')[:limit + 1])
+
+    has_more = len(items) > limit
+    if has_more:
+        items = items[:limit]
+        return {
+            'items': items,
+            'deleted': [],
+            'cursor': encode_cursor(since, items[-1].updated_at, items[-1].pk),
+            'has_more': True,
+            'reset': reset,
+        }
+
+    deleted = []
+    if window_start:
+        deleted = list(ClothingItemTombstone.objects
+                       .filter(user=user, deleted_at__gte=window_start)
+                       .values_list('item_id', flat=True))
+    return {
+        'items': items,
+        'deleted': deleted,
+        'cursor': encode_cursor(started_at),
+        'has_more': False,
+        'reset': reset,
+    }
+
+
+def prune_tombstones():
+    """Delete tombstones older than the retention period; returns how many."""
+    cutoff = timezone.now() - timedelta(days=settings.WARDROBE_SYNC['TOMBSTONE_RETENTION_DAYS'])
+    count, _ = ClothingItemTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return count
@@ -1,3 +1,542 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from clothing_processor.registry import registry
+from clothing_processor.tests import processing_service, segmented_item
+from users.models import User
+from . import response_cache, views
+from .filters import filter_clothing_items
+from .models import ClothingItem, ClothingItemTombstone
+from .services import create_clothing_items
+from .sync import InvalidCursor, changes_since, decode_cursor, encode_cursor
+from .thumbnails import needs_thumbnails, thumbnail_name, update_thumbnails
+
+
+def create_user(email='owner@example.com'):
+    return User.objects.create_user(email=email, first_name='Test', last_name='User',
+                                    gender='F', birthday=date(1990, 1, 1), password='password')
+
+
+def create_item(user, name, category='upper', colors=(), color_names=(), description='', **fields):
+    return ClothingItem.objects.create(
+        user=user, name=name, category=category, original_image=f"clothes/original/{name}.jpg", **fields,
+        metadata={'colors': list(colors), 'color_weights': [1.0 / len(colors)] * len(colors) if colors else [],
+                  'color_names': list(color_names), 'description': description},
+    )
+
+
+class FilterTests(TestCase):
+    """Category and color filters of the wardrobe list."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        # '#000080' is navy; '#0a0a85' is a near shade, '#1f2a44' a different color also named navy
+        cls.navy = create_item(cls.user, 'navy', 'upper', ['#000080'], ['navy'])
+        cls.near_navy = create_item(cls.user, 'near-navy', 'lower', ['#0a0a85', '#ffffff'], ['navy', 'white'])
+        cls.dark_navy = create_item(cls.user, 'dark-navy', 'upper', ['#1f2a44'], ['navy'])
+        cls.red = create_item(cls.user, 'red', 'shoes', ['#ff0000'], ['red'])
+
+    def filtered(self, **params):
+        queryset = ClothingItem.objects.filter(user=self.user)
+        return set(filter_clothing_items(queryset, params).values_list('name', flat=True))
+
+    def test_category(self):
+        self.assertEqual(self.filtered(category='upper'), {'navy', 'dark-navy'})
+        self.assertEqual(self.filtered(category='upper, shoes'), {'navy', 'dark-navy', 'red'})
+
+    def test_unknown_category_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            self.filtered(category='hats')
+
+    def test_color_name_matches_every_item_with_that_name(self):
+        self.assertEqual(self.filtered(color='navy'), {'navy', 'near-navy', 'dark-navy'})
+        self.assertEqual(self.filtered(color='Navy'), {'navy', 'near-navy', 'dark-navy'})
+
+    def test_hex_color_matches_close_shades_only(self):
+        self.assertEqual(self.filtered(color='#000080'), {'navy', 'near-navy'})
+        self.assertEqual(self.filtered(color='1f2a44'), {'dark-navy'})
+
+    def test_several_colors_match_any(self):
+        self.assertEqual(self.filtered(color='#ff0000,#1f2a44'), {'red', 'dark-navy'})
+        self.assertEqual(self.filtered(color='red,#1f2a44'), {'red', 'dark-navy'})
+
+    def test_color_and_category_combine(self):
+        self.assertEqual(self.filtered(color='#000080', category='lower'), {'near-navy'})
+
+    def test_unknown_color_is_rejected(self):
+        with self.assertRaises(ValidationError):
+            self.filtered(color='not-a-color')
+
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'wardrobe': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'wardrobe'},
+    'users': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'users'},
+}
+
+
+@override_settings(CACHES=LOCAL_CACHES, WARDROBE_CACHE=dict(settings.WARDROBE_CACHE, ENABLED=False))
+class FastListTests(TestCase):
+    """The .values() list path must return exactly the serializer's bytes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user()
+        for i in range(7):
+            create_item(
+                cls.user, f"Item {i} é \u2028", ['upper', 'lower', 'shoes'][i % 3], ['#000080', '#f5f5dc'],
+                ['navy', 'beige'], description=f"Item {i}",
+                segmented_image=f"clothes/segmented/item_{i}.jpg" if i % 2 else None,
+                thumbnails={'original': {'source': f"clothes/original/Item {i}.jpg",
+                                         '128': f"clothes/thumbnails/item_{i}_128.webp"}} if i % 3 else {},
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def pages(self, fast, **extra):
+        """Every page of the list, following the cursor."""
+        contents, url, params = [], '/wardrobe/clothing-items/', {'page_size': 3, **extra.pop('params', {})}
+        with override_settings(WARDROBE_FAST_LIST=fast):
+            while url:
+                response = self.client.get(url, params, **extra)
+                self.assertEqual(response.status_code, 200)
+                contents.append(response.content)
+                url, params = response.json()['next'], None
+        return contents
+
+    def test_fast_path_matches_serializer(self):
+        with mock.patch.object(views, 'fast_list_response', wraps=views.fast_list_response) as fast:
+            fast_pages = self.pages(True, HTTP_ACCEPT='application/json')
+        self.assertTrue(fast.called)
+        self.assertEqual(fast_pages, self.pages(False, HTTP_ACCEPT='application/json'))
+
+    def test_fast_path_matches_serializer_with_sparse_fields(self):
+        params = {'fields': 'id,name,thumbnails,category_display'}
+        self.assertEqual(self.pages(True, params=params, HTTP_ACCEPT='application/json'),
+                         self.pages(False, params=params, HTTP_ACCEPT='application/json'))
+
+    def test_accept_parameters_use_the_serializer(self):
+        accept = 'application/json; indent=4'
+        with mock.patch.object(views, 'fast_list_response', wraps=views.fast_list_response) as fast:
+            fast_pages = self.pages(True, HTTP_ACCEPT=accept)
+        self.assertFalse(fast.called)
+        self.assertIn(b'\n    ', fast_pages[0])
+        self.assertEqual(fast_pages, self.pages(False, HTTP_ACCEPT=accept))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ConditionalListTests(TestCase):
+    """The list ETag answers 304 until any item, including its thumbnails, changes."""
+
+    url = '/wardrobe/clothing-items/'
+
+    def setUp(self):
+        self.user = create_user()
+        self.item = create_item(self.user, 'shirt', 'upper', ['#000080'], ['navy'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, etag=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(self.url, params, HTTP_ACCEPT='application/json', **headers)
+
+    def test_unchanged_list_is_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        not_modified = self.get(response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+    def test_query_string_is_part_of_the_etag(self):
+        self.assertNotEqual(self.get()['ETag'], self.get(category='upper')['ETag'])
+
+    def test_edit_changes_the_etag(self):
+        etag = self.get()['ETag']
+        # Thumbnails are not generated in the test transaction
+        with mock.patch.object(views, 'schedule_thumbnails'), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f"{self.url}{self.item.pk}/", {'name': 'blue shirt'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('blue shirt', {item['name'] for item in response.json()['results']})
+
+    def test_recorded_thumbnails_change_the_etag(self):
+        from .thumbnails import update_thumbnails
+
+        etag = self.get()['ETag']
+        with mock.patch('wardrobe.thumbnails.generate_thumbnails', return_value={'128': 'clothes/thumbnails/shirt.webp'}):
+            with self.captureOnCommitCallbacks(execute=True):
+                update_thumbnails(self.item.pk)
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('shirt.webp', response.content.decode('utf-8'))
+
+    def test_delete_changes_the_etag(self):
+        other = create_item(self.user, 'skirt', 'lower')
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(f"{self.url}{other.pk}/").status_code, 204)
+        self.assertEqual(self.get(etag).status_code, 200)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class DeltaSyncTests(TestCase):
+    """Sync cursors page through changes and carry deletions as tombstones."""
+
+    def setUp(self):
+        self.user = create_user()
+        self.items = [create_item(self.user, f"item-{i}") for i in range(5)]
+        # Everything was last synced half an hour ago
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        ClothingItem.objects.filter(user=self.user).update(updated_at=an_hour_ago)
+        self.cursor = encode_cursor(timezone.now() - timedelta(minutes=30))
+
+    def test_cursor_round_trip(self):
+        since = timezone.now().replace(microsecond=0)
+        after = since - timedelta(days=1)
+        self.assertEqual(decode_cursor(encode_cursor(since, after, 42)), (since, after, 42))
+        self.assertEqual(decode_cursor(encode_cursor(since)), (since, None, None))
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not a cursor')
+
+    def test_full_sync_pages_through_every_item(self):
+        seen, cursor, pages = [], None, 0
+        while True:
+            changes = changes_since(self.user, cursor, limit=2)
+            self.assertTrue(changes['reset'])
+            seen.extend(item.pk for item in changes['items'])
+            cursor, pages = changes['cursor'], pages + 1
+            if not changes['has_more']:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(sorted(seen), sorted(item.pk for item in self.items))
+
+    def test_incremental_sync_sends_changes_and_tombstones(self):
+        changed, deleted = self.items[1], self.items[3]
+        changed.name = 'renamed'
+        changed.save()
+        # delete() clears the instance's pk
+        deleted_id = deleted.pk
+        ClothingItemTombstone.objects.create(user=self.user, item_id=deleted_id)
+        deleted.delete()
+
+        changes = changes_since(self.user, self.cursor)
+        self.assertFalse(changes['reset'])
+        self.assertFalse(changes['has_more'])
+        self.assertEqual([item.pk for item in changes['items']], [changed.pk])
+        self.assertEqual(changes['deleted'], [deleted_id])
+
+        # Nothing new since that sync (apart from the overlap window)
+        again = changes_since(self.user, changes['cursor'])
+        self.assertEqual([item.pk for item in again['items']], [changed.pk])
+        self.assertEqual(again['deleted'], [deleted_id])
+
+    def test_tombstones_come_with_the_last_page(self):
+        for item in self.items[:3]:
+            item.save()
+        deleted_id = self.items[4].pk
+        ClothingItemTombstone.objects.create(user=self.user, item_id=deleted_id)
+        self.items[4].delete()
+
+        first = changes_since(self.user, self.cursor, limit=2)
+        self.assertTrue(first['has_more'])
+        self.assertEqual(first['deleted'], [])
+        last = changes_since(self.user, first['cursor'], limit=2)
+        self.assertFalse(last['has_more'])
+        self.assertEqual(len(first['items']) + len(last['items']), 3)
+        self.assertEqual(last['deleted'], [deleted_id])
+
+    def test_cursor_past_tombstone_retention_resets(self):
+        retention = timedelta(days=settings.WARDROBE_SYNC['TOMBSTONE_RETENTION_DAYS'] + 1)
+        changes = changes_since(self.user, encode_cursor(timezone.now() - retention))
+        self.assertTrue(changes['reset'])
+        self.assertEqual(len(changes['items']), 5)
+
+    def test_sync_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/wardrobe/clothing-items/sync/', {'cursor': self.cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['items'], [])
+        self.assertFalse(response.json()['reset'])
+        self.assertEqual(client.get('/wardrobe/clothing-items/sync/', {'cursor': '!!'}).status_code, 400)
+
+
+def jpeg(width=600, height=400):
+    buffer = BytesIO()
+    Image.new('RGB', (width, height), (20, 40, 120)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@override_settings(CACHES=LOCAL_CACHES, WARDROBE_CACHE=dict(settings.WARDROBE_CACHE, ENABLED=False),
+                   WARDROBE_THUMBNAILS=dict(settings.WARDROBE_THUMBNAILS, SIZES=[64, 128]))
+class ThumbnailTests(TestCase):
+    """Derivatives are generated for the current source and used until it changes."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = create_user()
+        self.item = create_item(self.user, 'shirt')
+        self.item.original_image.save('shirt.jpg', ContentFile(jpeg()), save=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def listed_thumbnails(self):
+        response = self.client.get('/wardrobe/clothing-items/', HTTP_ACCEPT='application/json')
+        return response.json()['results'][0]['thumbnails']['original']
+
+    def test_update_generates_and_records_every_size(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            thumbnails = update_thumbnails(self.item.pk)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.thumbnails, thumbnails)
+        self.assertEqual(thumbnails['original']['source'], self.item.original_image.name)
+        for size in (64, 128):
+            name = thumbnails['original'][str(size)]
+            self.assertEqual(name, thumbnail_name(self.item.original_image.name, size))
+            with default_storage.open(name) as f:
+                self.assertEqual(max(Image.open(f).size), size)
+        self.assertFalse(needs_thumbnails(self.item))
+
+    def test_missing_derivatives_fall_back_to_the_image(self):
+        self.assertTrue(needs_thumbnails(self.item))
+        for url in self.listed_thumbnails().values():
+            self.assertTrue(url.endswith(self.item.original_image.url))
+
+    def test_derivatives_of_a_replaced_image_are_stale(self):
+        update_thumbnails(self.item.pk)
+        self.assertTrue(self.listed_thumbnails()['64'].endswith('.webp'))
+
+        self.item.refresh_from_db()
+        self.item.original_image.save('new-shirt.jpg', ContentFile(jpeg(300, 500)), save=True)
+        self.assertTrue(needs_thumbnails(self.item))
+        for url in self.listed_thumbnails().values():
+            self.assertTrue(url.endswith(self.item.original_image.url))
+
+    def test_backfill_command_generates_only_what_is_missing(self):
+        current = create_item(self.user, 'skirt', 'lower')
+        current.original_image.save('skirt.jpg', ContentFile(jpeg()), save=True)
+        update_thumbnails(current.pk)
+        current.refresh_from_db()
+
+        with mock.patch('wardrobe.thumbnails.update_thumbnails', wraps=update_thumbnails) as update:
+            call_command('generate_thumbnails', stdout=StringIO())
+        self.assertEqual([call.args[0] for call in update.call_args_list], [self.item.pk])
+        self.item.refresh_from_db()
+        self.assertFalse(needs_thumbnails(self.item))
+
+
+@override_settings(CACHES=LOCAL_CACHES, WARDROBE_FAST_LIST=True,
+                   WARDROBE_CACHE=dict(settings.WARDROBE_CACHE, ENABLED=True))
+class ResponseCacheTests(TestCase):
+    """List pages are served from the cache until a committed write bumps the user's version."""
+
+    url = '/wardrobe/clothing-items/'
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        response_cache._cache().clear()
+
+        self.user = create_user()
+        self.item = create_item(self.user, 'shirt', 'upper', ['#000080'], ['navy'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Thumbnails are not generated in the test transaction
+        patcher = mock.patch.object(views, 'schedule_thumbnails')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def names(self):
+        """Names on the first list page, and whether the page had to be rendered."""
+        with mock.patch.object(views, 'fast_list_response', wraps=views.fast_list_response) as render:
+            response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return {item['name'] for item in response.json()['results']}, render.called
+
+    def assert_write_refreshes_the_list(self, write, names):
+        self.assertEqual(self.names(), ({'shirt'}, True))
+        self.assertEqual(self.names(), ({'shirt'}, False))
+        version = response_cache.wardrobe_version(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertNotEqual(response_cache.wardrobe_version(self.user.pk), version)
+        self.assertEqual(self.names(), (names, True))
+
+    def test_create_refreshes_the_list(self):
+        image = SimpleUploadedFile('skirt.jpg', jpeg(), content_type='image/jpeg')
+        self.assert_write_refreshes_the_list(
+            lambda: self.assertEqual(self.client.post(self.url, {'name': 'skirt', 'category': 'lower',
+                                                                 'original_image': image}).status_code, 201),
+            {'shirt', 'skirt'})
+
+    def test_update_refreshes_the_list(self):
+        self.assert_write_refreshes_the_list(
+            lambda: self.assertEqual(self.client.patch(f"{self.url}{self.item.pk}/", {'name': 'blue shirt'},
+                                                       format='json').status_code, 200),
+            {'blue shirt'})
+
+    def test_delete_refreshes_the_list(self):
+        self.assert_write_refreshes_the_list(
+            lambda: self.assertEqual(self.client.delete(f"{self.url}{self.item.pk}/").status_code, 204), set())
+
+    def test_thumbnail_update_refreshes_the_list(self):
+        def write():
+            with mock.patch('wardrobe.thumbnails.generate_thumbnails', return_value={'128': 'thumbs/shirt.webp'}):
+                update_thumbnails(self.item.pk)
+
+        self.assert_write_refreshes_the_list(write, {'shirt'})
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertIn('thumbs/shirt.webp', response.content.decode('utf-8'))
+
+    def test_version_only_moves_on_commit(self):
+        version = response_cache.wardrobe_version(self.user.pk)
+        with self.captureOnCommitCallbacks(execute=False):
+            response_cache.invalidate_wardrobe(self.user.pk)
+        self.assertEqual(response_cache.wardrobe_version(self.user.pk), version)
+
+
+class CreateClothingItemsTests(TestCase):
+    """A processing result becomes one item per garment, all or nothing."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.workspace = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workspace, ignore_errors=True)
+        self.user = create_user()
+
+    def result(self, garments):
+        items = []
+        for i, category in enumerate(garments):
+            path = f"{self.workspace}/00_{i}.jpg"
+            with open(path, 'wb') as f:
+                f.write(jpeg(40, 60))
+            items.append({'segmented_image': path, 'category': category,
+                          'metadata': {'colors': ['#000080'], 'description': f"garment {i}"}})
+        return dict(items[0], items=items)
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media_root) for name in names]
+
+    def test_every_garment_becomes_an_item_sharing_the_original(self):
+        items = create_clothing_items(self.user, 'outfit.jpg', jpeg(),
+                                      self.result(['upper clothing', 'lower clothing']))
+        self.assertEqual([item.category for item in items], ['upper', 'lower'])
+        self.assertEqual(len({item.original_image.name for item in items}), 1)
+        self.assertEqual(len({item.segmented_image.name for item in items}), 2)
+        self.assertEqual(len(self.stored_files()), 3)
+
+    def test_missing_garment_file_stores_nothing(self):
+        result = self.result(['upper clothing', 'lower clothing', 'dress'])
+        os.remove(result['items'][2]['segmented_image'])
+        with self.assertRaises(OSError):
+            create_clothing_items(self.user, 'outfit.jpg', jpeg(), result)
+        self.assertFalse(ClothingItem.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_failed_insert_removes_the_written_files(self):
+        with mock.patch.object(ClothingItem.objects, 'bulk_create', side_effect=DatabaseError('insert failed')):
+            with self.assertRaises(DatabaseError):
+                create_clothing_items(self.user, 'outfit.jpg', jpeg(), self.result(['upper clothing', 'dress']))
+        self.assertFalse(ClothingItem.objects.exists())
+        self.assertEqual(self.stored_files(), [])
+
+    def test_query_count_does_not_grow_with_garments(self):
+        counts = []
+        for garments in (['upper clothing'], ['upper clothing', 'lower clothing', 'dress', 'dress']):
+            with CaptureQueriesContext(connection) as queries:
+                create_clothing_items(self.user, 'outfit.jpg', jpeg(), self.result(garments))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ProcessActionTests(TestCase):
+    """One upload is processed and saved as an item per detected garment."""
+
+    url = '/wardrobe/clothing-items/process/'
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, service):
+        image = SimpleUploadedFile('outfit.jpg', jpeg(), content_type='image/jpeg')
+        with mock.patch.object(registry, 'get_service', return_value=service), \
+                mock.patch.object(views, 'schedule_thumbnails') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(self.url, {'image': image})
+        return response, schedule
+
+    def test_every_garment_is_saved(self):
+        service = processing_service(f"{self.media_root}/processed_clothes",
+                                     items=[segmented_item('upper clothing'), segmented_item('lower clothing', 'lower')])
+        response, schedule = self.post(service)
+        self.assertEqual(response.status_code, 201)
+
+        items = response.json()
+        self.assertEqual([item['category'] for item in items], ['upper', 'lower'])
+        self.assertEqual(set(items[0]), {'id', 'name', 'category', 'category_display', 'original_image',
+                                         'original_image_url', 'segmented_image', 'segmented_image_url',
+                                         'thumbnails', 'metadata', 'created_at', 'updated_at'})
+        self.assertEqual(items[0]['metadata']['color_names'], ['navy'])
+        self.assertEqual(items[0]['original_image'], items[1]['original_image'])
+        self.assertEqual(sorted(ClothingItem.objects.filter(user=self.user).values_list('pk', flat=True)),
+                         sorted(item['id'] for item in items))
+        schedule.assert_called_once_with([item['id'] for item in items])
+
+    def test_failed_processing_creates_nothing(self):
+        service = processing_service(f"{self.media_root}/processed_clothes", items=[])
+        response, schedule = self.post(service)
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('error', response.json())
+        self.assertFalse(ClothingItem.objects.exists())
+        self.assertFalse(schedule.called)
+
+    def test_unrecognised_garment_creates_nothing(self):
+        service = processing_service(f"{self.media_root}/processed_clothes", items=[segmented_item('unknown')])
+        response, _ = self.post(service)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ClothingItem.objects.exists())
+
+    def test_missing_image_is_rejected(self):
+        self.assertEqual(self.client.post(self.url, {}).status_code, 400)
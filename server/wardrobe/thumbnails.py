@@ -0,0 +1,189 @@
+import os
+import threading
+import logging
+import traceback
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import ClothingItem
+from .response_cache import invalidate_wardrobe
+
+logger = logging.getLogger(__name__)
+
+# Images of an item that get derivatives, keyed as in ClothingItem.thumbnails
+THUMBNAIL_FIELDS = ('original', 'segmented')
+
+# [lock, users] per source image: items created from one photo share its original
+_source_locks = {}
+_source_locks_lock = threading.Lock()
+
+_executor = ThreadPoolExecutor(max_workers=settings.WARDROBE_THUMBNAILS['WORKERS'],
+                               thread_name_prefix='wardrobe-thumbnails')
+
+
+def thumbnail_sizes():
+    return settings.WARDROBE_THUMBNAILS['SIZES']
+
+
+def thumbnail_name(image_name, size):
+    """Storage name of a derivative, in a thumbs/ folder next to the source image."""
+    directory, filename = os.path.split(image_name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'thumbs', f"{stem}_{size}.webp")
+
+
+def generate_thumbnails(image_name, sizes=None):
+    """
+    Write WebP derivatives of a stored image, skipping those that already exist.
+
+    The source is decoded once (JPEGs at a reduced scale via draft()) and
+    each size is resized from the next larger derivative. Calls for the
+    same source run one at a time, so items sharing an original do not
+    write its derivatives twice.
+
+    Returns:
+        dict: Storage name per size, with the sizes as strings
+    """
+    sizes = sorted(sizes or thumbnail_sizes(), reverse=True)
+    names = {str(size): thumbnail_name(image_name, size) for size in sizes}
+    with _source_locks_lock:
+        entry = _source_locks.setdefault(image_name, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            _write_thumbnails(image_name, sizes, names)
+    finally:
+        with _source_locks_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _source_locks[image_name]
+    return names
+
+
+def _write_thumbnails(image_name, sizes, names):
+    missing = [size for size in sizes if not default_storage.exists(names[str(size)])]
+    if not missing:
+        return
+
+    with default_storage.open(image_name, 'rb') as f:
+        image = Image.open(f)
+        image.draft('RGB', (missing[0], missing[0]))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+    quality = settings.WARDROBE_THUMBNAILS['QUALITY']
+    for size in missing:
+        image.thumbnail((size, size), Image.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, 'WEBP', quality=quality, method=4)
+        if default_storage.exists(names[str(size)]):
+            continue
+        saved = default_storage.save(names[str(size)], ContentFile(buffer.getvalue()))
+        if saved != names[str(size)]:
+            # Another process wrote the same derivative first; drop the duplicate
+            default_storage.delete(saved)
+
+
+def recorded_thumbnails(thumbnails, field, image_name):
+    """
+    The derivatives recorded for one image of an item, or {} if they were
+    generated from a different source (the image has been replaced since).
+    """
+    recorded = (thumbnails or {}).get(field, {})
+    return recorded if recorded.get('source') == image_name else {}
+
+
+def needs_thumbnails(item):
+    """Whether any image of an item lacks a recorded derivative of the current sizes."""
+    for field in THUMBNAIL_FIELDS:
+        image = getattr(item, f"{field}_image")
+        if not image:
+            continue
+        recorded = recorded_thumbnails(item.thumbnails, field, image.name)
+        if any(str(size) not in recorded for size in thumbnail_sizes()):
+            return True
+    return False
+
+
+def update_thumbnails(item_id):
+    """Generate every derivative of an item and record them on the row."""
+    item = ClothingItem.objects.filter(pk=item_id).only(
+        'user_id', 'original_image', 'segmented_image', 'thumbnails').first()
+    if item is None:
+        return None
+
+    thumbnails = {}
+    for field in THUMBNAIL_FIELDS:
+        image = getattr(item, f"{field}_image")
+        if image:
+            thumbnails[field] = {'source': image.name, **generate_thumbnails(image.name)}
+
+    # Bump updated_at so the list ETag and delta sync pick up the new URLs
+    ClothingItem.objects.filter(pk=item_id).update(thumbnails=thumbnails, updated_at=timezone.now())
+    # Cached list pages still point at the full-size images
+    invalidate_wardrobe(item.user_id)
+    return thumbnails
+
+
+def _run(item_ids):
+    close_old_connections()
+    try:
+        for item_id in item_ids:
+            try:
+                update_thumbnails(item_id)
+            except Exception as e:
+                logger.error(f"Error generating thumbnails for clothing item {item_id}: {str(e)}")
+                logger.error(traceback.format_exc())
+    finally:
+        close_old_connections()
+
+
+def backfill_thumbnails(chunk_size=500):
+    """
+    Generate the derivatives of every item whose images have none recorded
+    for the current source and sizes, e.g. after a failed background run,
+    a change of WARDROBE_THUMBNAILS['SIZES'] or for items created before
+    derivatives existed.
+
+    Returns:
+        tuple: (items updated, items that failed)
+    """
+    items = ClothingItem.objects.only('original_image', 'segmented_image', 'thumbnails').order_by('pk')
+    updated = failed = 0
+    for item in items.iterator(chunk_size=chunk_size):
+        if not needs_thumbnails(item):
+            continue
+        try:
+            update_thumbnails(item.pk)
+            updated += 1
+        except Exception as e:
+            logger.error(f"Error generating thumbnails for clothing item {item.pk}: {str(e)}")
+            failed += 1
+    return updated, failed
+
+
+def schedule_thumbnails(item_ids):
+    """Generate derivatives in a background thread once the current transaction commits."""
+    item_ids = list(item_ids)
+    transaction.on_commit(lambda: _executor.submit(_run, item_ids))
+
+
+def thumbnail_for(item, field, size):
+    """
+    Storage name of one derivative, generating it now if it is missing.
+
+    Returns:
+        str: The derivative's storage name, or None if the item has no such image
+    """
+    image = getattr(item, f"{field}_image")
+    if not image:
+        return None
+    name = recorded_thumbnails(item.thumbnails, field, image.name).get(str(size))
+    if name and default_storage.exists(name):
+        return name
+    return generate_thumbnails(image.name, [size])[str(size)]
@@ -3,11 +3,32 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from .models import ClothingItem
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from .models import ClothingItem, ClothingItemTombstone
 from .serializers import ClothingItemSerializer, ClothingItemCreateSerializer
+from .pagination import ClothingItemCursorPagination
+from .sync import InvalidCursor, changes_since
+from .filters import filter_clothing_items
+from .listing import can_render_fast, fast_list_response
+from . import response_cache
+from .response_cache import invalidate_wardrobe
+from .services import create_clothing_items
+from .thumbnails import schedule_thumbnails, thumbnail_for, thumbnail_sizes
+from clothing_processor.registry import registry
+from clothing_processor.admission import AdmissionRejected, admission, rejected_response
 import os
+import hashlib
+import logging
+import traceback
 from django.conf import settings
 
+logger = logging.getLogger(__name__)
+
 # Create your views here.
 
 class ClothingItemViewSet(viewsets.ModelViewSet):
@@ -16,13 +37,66 @@ class ClothingItemViewSet(viewsets.ModelViewSet):
     """
     serializer_class = ClothingItemSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ClothingItemCursorPagination
     
     def get_queryset(self):
         """
         This view should return a list of all clothing items
-        for the currently authenticated user.
+        for the currently authenticated user, filtered by the query string
+        (category, created_after, created_before, color, q) when listing.
+        """
+        queryset = ClothingItem.objects.filter(user=self.request.user).order_by('-created_at')
+        if self.action == 'list':
+            queryset = filter_clothing_items(queryset, self.request.query_params)
+        return queryset
+    
+    def list_validators(self):
+        """
+        ETag and Last-Modified of the current user's list.
+        
+        Any create, edit or delete changes the item count or the latest
+        updated_at, so one aggregate query tells whether the list changed.
+        The query string (cursor, page size, fields) is part of the ETag.
+        """
+        state = ClothingItem.objects.filter(user=self.request.user).aggregate(
+            last_modified=Max('updated_at'), count=Count('id'))
+        digest = hashlib.sha1(
+            f"{self.request.user.pk}:{state['count']}:{state['last_modified']}:"
+            f"{self.request.META.get('QUERY_STRING', '')}".encode('utf-8')
+        ).hexdigest()
+        # HTTP dates have a one second resolution
+        last_modified = int(state['last_modified'].timestamp()) if state['last_modified'] else None
+        return f'"{digest}"', last_modified
+    
+    def list(self, request, *args, **kwargs):
+        """
+        List the user's clothing items, answering 304 Not Modified when the
+        client's ETag or Last-Modified still matches. JSON pages are built
+        from .values() rows unless WARDROBE_FAST_LIST is off, and are kept in
+        the per-user response cache until the user's next write.
         """
-        return ClothingItem.objects.filter(user=self.request.user).order_by('-created_at')
+        fast = settings.WARDROBE_FAST_LIST and can_render_fast(request)
+        cached, version = response_cache.get_list(request) if fast else (None, None)
+        if cached is not None:
+            etag, last_modified = cached['etag'], cached['last_modified']
+        else:
+            etag, last_modified = self.list_validators()
+        
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None and cached is not None:
+            response = HttpResponse(cached['content'], content_type=cached['content_type'])
+        elif response is None and fast:
+            response = fast_list_response(self, request, self.filter_queryset(self.get_queryset()))
+            response_cache.put_list(request, version, etag, last_modified, response)
+        elif response is None:
+            response = super().list(request, *args, **kwargs)
+        
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # Let browsers keep the list but revalidate it on every use
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
     
     def get_serializer_class(self):
         """
@@ -36,7 +110,47 @@ class ClothingItemViewSet(viewsets.ModelViewSet):
         """
         Save the clothing item with the current user.
         """
-        serializer.save(user=self.request.user)
+        clothing_item = serializer.save(user=self.request.user)
+        invalidate_wardrobe(self.request.user.pk)
+        schedule_thumbnails([clothing_item.pk])
+    
+    def perform_update(self, serializer):
+        """
+        Save the changes and refresh the image derivatives.
+        """
+        clothing_item = serializer.save()
+        invalidate_wardrobe(clothing_item.user_id)
+        schedule_thumbnails([clothing_item.pk])
+    
+    def perform_destroy(self, instance):
+        """
+        Delete the item and leave a tombstone for sync clients.
+        """
+        with transaction.atomic():
+            ClothingItemTombstone.objects.create(user=instance.user, item_id=instance.pk)
+            instance.delete()
+            invalidate_wardrobe(instance.user_id)
+    
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """
+        Return the items created or updated and the ids of items deleted since
+        the cursor of the previous sync (?cursor=...). Without a cursor the
+        whole wardrobe is sent. Keep requesting with the returned cursor
+        while has_more is true.
+        """
+        try:
+            changes = changes_since(request.user, request.query_params.get('cursor'))
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'items': ClothingItemSerializer(changes['items'], many=True, context={'request': request}).data,
+            'deleted': changes['deleted'],
+            'cursor': changes['cursor'],
+            'has_more': changes['has_more'],
+            'reset': changes['reset'],
+        })
     
     @action(detail=True, methods=['post'])
     def update_segmented_image(self, request, pk=None):
@@ -59,9 +173,11 @@ class ClothingItemViewSet(viewsets.ModelViewSet):
         # Update the segmented image
         clothing_item.segmented_image = request.FILES['segmented_image']
         clothing_item.save()
+        invalidate_wardrobe(clothing_item.user_id)
+        schedule_thumbnails([clothing_item.pk])
         
         return Response(
-            ClothingItemSerializer(clothing_item).data,
+            ClothingItemSerializer(clothing_item, context={'request': request}).data,
             status=status.HTTP_200_OK
         )
     
@@ -87,8 +203,9 @@ class ClothingItemViewSet(viewsets.ModelViewSet):
         
         if serializer.is_valid():
             clothing_item.set_metadata(request.data['metadata'])
+            invalidate_wardrobe(clothing_item.user_id)
             return Response(
-                ClothingItemSerializer(clothing_item).data,
+                ClothingItemSerializer(clothing_item, context={'request': request}).data,
                 status=status.HTTP_200_OK
             )
         
@@ -99,5 +216,100 @@ class ClothingItemViewSet(viewsets.ModelViewSet):
         """
         Return a list of all available clothing categories.
         """
-        categories = [{'value': choice[0], 'label': choice[1]} for choice in ClothingItem.CATEGORY_CHOICES]
+        categories = response_cache.get_categories(
+            lambda: [{'value': choice[0], 'label': choice[1]} for choice in ClothingItem.CATEGORY_CHOICES])
         return Response(categories)
+    
+    @action(detail=False, methods=['post'])
+    def process(self, request):
+        """
+        Process an uploaded photo and save every detected garment (e.g. a top
+        and trousers) as its own clothing item in one request.
+        Expects a multipart form with an 'image' file; returns the created items.
+        """
+        if 'image' not in request.FILES:
+            return Response(
+                {'error': 'No image file provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            clothing_processor = registry.get_service()
+        except RuntimeError:
+            return Response(
+                {'error': 'Clothing processor service is not available. Please try again later.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        
+        try:
+            image_file = request.FILES['image']
+            image_bytes = image_file.read()
+            result = clothing_processor.process_clothing_bytes(
+                image_bytes,
+                image_file.name,
+                idempotency_key=request.headers.get('Idempotency-Key'),
+                scope=str(request.user.pk),
+                admission=admission().admit(request.user.pk)
+            )
+            
+            try:
+                if not result:
+                    return Response(
+                        {'error': 'Failed to process the image'},
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    )
+                
+                if not result.get('category') or result['category'] == 'unknown':
+                    return Response(
+                        {'error': 'Could not identify the clothing item. Please try a clearer image.'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                
+                clothing_items = create_clothing_items(request.user, image_file.name, image_bytes, result)
+            finally:
+                # The segmented images have been copied into storage
+                clothing_processor.release(result)
+            invalidate_wardrobe(request.user.pk)
+            schedule_thumbnails([clothing_item.pk for clothing_item in clothing_items])
+        except AdmissionRejected as e:
+            return rejected_response(e)
+        except Exception as e:
+            logger.error(f"Error processing and saving clothing item: {str(e)}")
+            logger.error(traceback.format_exc())
+            return Response(
+                {'error': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        return Response(
+            ClothingItemSerializer(clothing_items, many=True, context={'request': request}).data,
+            status=status.HTTP_201_CREATED
+        )
+    
+    @action(detail=True, methods=['get'], url_path=r'thumbnail/(?P<field>original|segmented)/(?P<size>\d+)')
+    def thumbnail(self, request, pk=None, field=None, size=None):
+        """
+        Redirect to a WebP derivative of the item's image, generating it
+        first if it does not exist yet.
+        """
+        clothing_item = self.get_object()
+        if int(size) not in thumbnail_sizes():
+            raise Http404('Unsupported thumbnail size')
+        
+        try:
+            name = thumbnail_for(clothing_item, field, int(size))
+        except Exception as e:
+            logger.error(f"Error generating thumbnail for clothing item {clothing_item.pk}: {str(e)}")
+            logger.error(traceback.format_exc())
+            return Response(
+                {'error': 'Failed to generate the thumbnail'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        if name is None:
+            raise Http404('The clothing item has no such image')
+        
+        # Record the derivatives on the item so later listings link them directly
+        image = getattr(clothing_item, f"{field}_image")
+        if clothing_item.thumbnails.get(field, {}).get('source') != image.name:
+            schedule_thumbnails([clothing_item.pk])
+        return HttpResponseRedirect(request.build_absolute_uri(default_storage.url(name)))